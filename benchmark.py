@@ -0,0 +1,327 @@
+"""
+per.py 解析与分析热路径的 benchmark。输入为固定 seed 产生的合成资料（大小递增），不需要设备。
+
+  python benchmark.py [-o bench.json] [-k 正则] [--quick] [--compare 旧的.json] [--threshold 1.2]
+
+结果写成 JSON（每个 case 的每次呼叫耗时 min / median / mean，单位 µs，以及环境资讯），
+--compare 会与之前的结果逐项比较，任何一项变慢超过 threshold 倍时 exit code 为 1。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import per
+
+BENCH_VERSION = 1
+SEED = 1234
+MIN_TIME = 0.2  # 每轮至少跑这么久（秒），次数自动加倍
+REPEAT = 5  # 取 REPEAT 轮中的最小值 / 中位数
+
+CPU_CORES = (8, 12, 16)
+ACTIVITY_TASKS = (50, 500, 5000)
+LAYER_COUNTS = (100, 1000, 10000)
+LATENCY_ROWS = (127, 1000, 10000, 100000)
+CHART_POINTS = (100, 500, 2000)  # update_display 每条曲线的点数，上限为 main.MAX_POINTS
+
+PACKAGE = "com.bench.game"
+VSYNC_NS = 16_666_666
+
+
+# ========== 合成输入 ==========
+
+def make_proc_stat(cores, rng):
+    lines = []
+    for name in ["cpu"] + [f"cpu{i}" for i in range(cores)]:
+        fields = [rng.randint(10_000, 10_000_000) for _ in range(10)]
+        lines.append(name + " " + " ".join(map(str, fields)))
+    lines.append("intr " + " ".join(str(rng.randint(0, 10_000)) for _ in range(200)))
+    lines += ["ctxt 123456789", "btime 1700000000", "processes 654321", "procs_running 3", "procs_blocked 0"]
+    return "\n".join(lines)
+
+
+def make_cpu_freqs(cores, rng):
+    return "\n".join(f"/sys/devices/system/cpu/cpu{i}/cpufreq/scaling_cur_freq:{rng.randint(300_000, 3_000_000)}"
+                     for i in range(cores))
+
+
+def make_meminfo(rng):
+    keys = ["MemTotal", "MemFree", "MemAvailable", "Buffers", "Cached", "SwapCached", "Active", "Inactive",
+            "Active(anon)", "Inactive(anon)", "Active(file)", "Inactive(file)", "Unevictable", "Mlocked",
+            "SwapTotal", "SwapFree", "Dirty", "Writeback", "AnonPages", "Mapped", "Shmem", "KReclaimable",
+            "Slab", "SReclaimable", "SUnreclaim", "KernelStack", "ShadowCallStack", "PageTables",
+            "NFS_Unstable", "Bounce", "WritebackTmp", "CommitLimit", "Committed_AS", "VmallocTotal",
+            "VmallocUsed", "VmallocChunk", "Percpu", "CmaTotal", "CmaFree"]
+    return "\n".join(f"{k}:{rng.randint(0, 12_000_000):>16} kB" for k in keys)
+
+
+def make_snapshot_output(cores, rng):
+    return "\n".join([
+        "@@stat", make_proc_stat(cores, rng),
+        "@@freq", make_cpu_freqs(cores, rng),
+        "@@mem", "MemTotal:       11811160 kB\nMemAvailable:    4727624 kB",
+        "@@gpu", "1234567 9876543",
+        "@@temp", "352",
+        "@@end",
+    ])
+
+
+def make_activity_dump(tasks, rng):
+    """完整的 `dumpsys activity activities`（没有在设备端 grep 过滤时的大小），resumed activity 在最后。"""
+    lines = ["ACTIVITY MANAGER ACTIVITIES (dumpsys activity activities)", "Display #0 (activities from top to bottom):"]
+    for t in range(tasks):
+        pkg = f"com.vendor.app{t}"
+        lines += [
+            f"  * Task{{{rng.getrandbits(28):x} #{t + 100} type=standard A=10{t:03d}:{pkg} U=0 visible=false}}",
+            f"    mLastNonFullscreenBounds=Rect(0, 0 - 1080, 2400) isResizeable=true",
+            f"    * Hist #0: ActivityRecord{{{rng.getrandbits(28):x} u0 {pkg}/.MainActivity t{t + 100}}}",
+            f"      packageName={pkg} processName={pkg}",
+            f"      launchedFromUid=10{t:03d} launchedFromPackage={pkg} userId=0",
+            f"      app=ProcessRecord{{{rng.getrandbits(28):x} {rng.randint(1000, 30000)}:{pkg}/u0a{t}}}",
+            f"      Intent {{ act=android.intent.action.MAIN cat=[android.intent.category.LAUNCHER] cmp={pkg}/.MainActivity }}",
+            f"      frontOfTask=true task=Task{{{rng.getrandbits(28):x} #{t + 100}}}",
+            f"      taskAffinity={pkg}",
+            f"      realActivity={pkg}/.MainActivity",
+            f"      state=STOPPED stopped=true delayedResume=false finishing=false",
+        ]
+    lines += [
+        f"  ResumedActivity: ActivityRecord{{{rng.getrandbits(28):x} u0 {PACKAGE}/.GameActivity t9999}}",
+        f"  mLastPausedActivity: ActivityRecord{{{rng.getrandbits(28):x} u0 com.vendor.app0/.MainActivity t100}}",
+    ]
+    return "\n".join(lines)
+
+
+def make_layer_list(layers, rng):
+    """`dumpsys SurfaceFlinger --list`：大量无关 layer，目标 package 的 SurfaceView 散布其中（最后一个才是答案）。"""
+    lines = ["Display 4619827259835644672 (active) HWC layers:"]
+    for i in range(layers):
+        prefix = f"{rng.getrandbits(28):x} " if rng.random() < 0.5 else ""
+        if i % 97 == 0:
+            lines.append(f"{prefix}SurfaceView[{PACKAGE}/{PACKAGE}.GameActivity](BLAST)#{i}")
+        else:
+            pkg = f"com.vendor.app{i % 300}"
+            lines.append(f"{prefix}{pkg}/{pkg}.MainActivity#{i}")
+            lines.append(f"{prefix}Bounds for - {pkg}/{pkg}.MainActivity#{i}")
+    lines.append(f"Total layers: {layers * 2}")
+    return "\n".join(lines)
+
+
+def make_latency_table(rows, rng, jank_every=40):
+    """`dumpsys SurfaceFlinger --latency`：第一行刷新周期，之后每行三个时间戳，夹杂尚未显示与全 0 的行。"""
+    lines = [str(VSYNC_NS)]
+    t = 1_000_000_000_000
+    for i in range(rows):
+        t += VSYNC_NS * (rng.choice((2, 3, 4)) if i % jank_every == jank_every - 1 else 1)
+        if i % 50 == 49:
+            lines.append(f"{t}\t{per.INVALID_TIMESTAMP}\t{t}")
+        elif i % 211 == 0:
+            lines.append("0\t0\t0")
+        else:
+            lines.append(f"{t - VSYNC_NS}\t{t + rng.randint(0, 200_000)}\t{t - rng.randint(0, VSYNC_NS // 2)}")
+    return "\n".join(lines) + "\n"
+
+
+# ========== 量测 ==========
+
+@contextmanager
+def canned_adb(output):
+    # 把 adb 换成固定输出，只量 per.py 自己的解析成本
+    original = per.run_adb_command
+    per.run_adb_command = lambda cmd, serial=None: output
+    try:
+        yield
+    finally:
+        per.run_adb_command = original
+
+
+def measure(func, min_time=MIN_TIME, repeat=REPEAT):
+    """回传 (每轮呼叫次数, [每轮的每次呼叫耗时（秒）])。"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        # 依这次的耗时估算够跑满 min_time 的次数，至少加倍
+        number = max(number * 2, int(number * min_time * 1.1 / max(elapsed, 1e-9)))
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return number, timings
+
+
+class Bench:
+    def __init__(self, pattern=None, min_time=MIN_TIME, repeat=REPEAT):
+        self.pattern = re.compile(pattern) if pattern else None
+        self.min_time = min_time
+        self.repeat = repeat
+        self.results = []
+
+    def wants(self, name):
+        return self.pattern is None or bool(self.pattern.search(name))
+
+    def run(self, name, size, func, adb_output=None):
+        if not self.wants(name):
+            return
+        if adb_output is None:
+            number, timings = measure(func, self.min_time, self.repeat)
+        else:
+            with canned_adb(adb_output):
+                number, timings = measure(func, self.min_time, self.repeat)
+        result = {
+            "name": name,
+            "size": size,
+            "calls": number,
+            "min_us": min(timings) * 1e6,
+            "median_us": statistics.median(timings) * 1e6,
+            "mean_us": statistics.mean(timings) * 1e6,
+        }
+        self.results.append(result)
+        print(f"{name:<40} {size:>8}  {result['median_us']:>12.2f} µs  (min {result['min_us']:.2f}, x{number})")
+
+
+def bench_parsers(bench):
+    rng = random.Random(SEED)
+
+    for cores in CPU_CORES:
+        stat = make_proc_stat(cores, rng)
+        cpu_output = stat + "\n@@freq\n" + make_cpu_freqs(cores, rng)
+        bench.run("parse_proc_stat", cores, lambda: per.parse_proc_stat(stat))
+        tracker = per.CpuUsageTracker()
+        bench.run("get_cpu_usage_and_freq", cores, lambda: per.get_cpu_usage_and_freq(tracker), adb_output=cpu_output)
+        snapshot = make_snapshot_output(cores, rng)
+        collector = per.SnapshotCollector()
+        bench.run("SnapshotCollector.parse", cores, lambda: collector.parse(snapshot, 0.0))
+
+    meminfo = make_meminfo(rng)
+    bench.run("get_mem_usage", len(meminfo.splitlines()), per.get_mem_usage, adb_output=meminfo)
+
+    for tasks in ACTIVITY_TASKS:
+        dump = make_activity_dump(tasks, rng)
+        bench.run("get_foreground_app", len(dump.splitlines()), per.get_foreground_app, adb_output=dump)
+
+    for layers in LAYER_COUNTS:
+        listing = make_layer_list(layers, rng)
+        bench.run("get_surfaceflinger_target_layer", layers,
+                  lambda: per.get_surfaceflinger_target_layer(PACKAGE), adb_output=listing)
+
+    layer = f"SurfaceView[{PACKAGE}/{PACKAGE}.GameActivity](BLAST)#0"
+    for rows in LATENCY_ROWS:
+        table = make_latency_table(rows, rng)
+        bench.run("dump_layer_stats", rows, lambda: per.dump_layer_stats(layer), adb_output=table)
+        bench.run("get_vsync_triplets", rows, lambda: per.get_vsync_triplets(layer), adb_output=table)
+        triplets = per.parse_latency(table)[1]
+        bench.run("calculate_jank_by_vsync_triplets", rows,
+                  lambda: per.calculate_jank_by_vsync_triplets(triplets, VSYNC_NS))
+
+
+def bench_update_display(bench):
+    if not bench.wants("MonitorWindow.update_display") and not bench.wants("MonitorWindow.update_display.tick"):
+        return
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import main
+    except ImportError as e:
+        print(f"跳过 MonitorWindow.update_display（无法载入 PyQt5: {e}）")
+        return
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = main.MonitorWindow()
+    rng = random.Random(SEED)
+    for points in CHART_POINTS:
+        for history in window.histories:
+            history.clear()
+            history.extend([i * 0.5 for i in range(points)],
+                           [[rng.uniform(0, 100) for _ in history.columns] for _ in range(points)])
+
+        def full_redraw():
+            window.rendered_totals = {}
+            window.update_display()
+
+        def tick():
+            # 稳定状态：每个缓冲各来一笔新资料（缓冲已满，同时挤掉一笔旧的）
+            for history in window.histories:
+                history.append(history.last_time + 0.5, [rng.uniform(0, 100) for _ in history.columns])
+            window.update_display()
+
+        bench.run("MonitorWindow.update_display", points, full_redraw)
+        bench.run("MonitorWindow.update_display.tick", points, tick)
+    # 不呼叫 close()：closeEvent 会断开 adb 并卸载服务
+    window.deleteLater()
+    app.processEvents()
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """印出与 baseline 的比值（新 / 旧 median），回传变慢超过 threshold 倍的项目数。"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f).get("results", [])}
+    regressions = 0
+    print(f"\n与 {baseline_path} 比较（新 / 旧 median）：")
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if not old or not old["median_us"]:
+            continue
+        ratio = r["median_us"] / old["median_us"]
+        mark = ""
+        if ratio > threshold:
+            mark = "  <-- 变慢"
+            regressions += 1
+        print(f"{r['name']:<40} {r['size']:>8}  {ratio:>6.2f}x{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per.py 解析与分析热路径的 benchmark")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="结果 JSON 的路径")
+    parser.add_argument("-k", "--filter", help="只跑名称符合此正则的 case")
+    parser.add_argument("--quick", action="store_true", help="每轮只跑 0.02 秒、3 轮（冒烟测试用）")
+    parser.add_argument("--compare", help="与之前的结果 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=1.2, help="变慢超过这个倍数视为回归")
+    args = parser.parse_args()
+
+    bench = Bench(args.filter, *((0.02, 3) if args.quick else (MIN_TIME, REPEAT)))
+    bench_parsers(bench)
+    bench_update_display(bench)
+
+    report = {"version": BENCH_VERSION, "seed": SEED, "environment": environment(), "results": bench.results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.output}")
+
+    if args.compare and compare(bench.results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import TELEMETRY
+
+# ========== 采集调度 ==========
+# 每个 collector 有独立的周期，在线程池中并行执行，
+# 一个慢的 dumpsys 不会再卡住其他指标。结果一到就连同采集时间一起发布。
+
+
+class ScheduledCollector:
+    def __init__(self, name, func, period):
+        self.name = name
+        self.func = func
+        self.period = period  # 秒；0 表示跑完立刻再跑（例如阻塞式的串流读取）
+        self.next_due = None  # 第一次在 run() 开始时执行，之后从那时起按固定节拍
+        self.busy = False
+        self.thread_id = None
+
+
+class CollectorScheduler:
+    """
+    publish(name, result, captured_at) 会在工作线程中被调用，
+    captured_at 为该次采集开始的时间（clock()，预设 time.time；回放时为录制当时的时间）。
+    virtual_time 用于虚拟时钟（尽快回放，见 session_archive.ReplaySource）：排程改以 virtual_time.clock() 为准，
+    所有进行中的采集都在等待虚拟时间时呼叫 virtual_time.advance(下一个排程时间)，不真的等待。
+    """
+
+    def __init__(self, publish, max_workers=4, clock=time.time, virtual_time=None, device=None):
+        self.publish = publish
+        self.device = device  # 多台设备时的 serial，自我量测按设备分开记
+        self.max_workers = max_workers
+        self.clock = clock
+        self.virtual_time = virtual_time
+        if virtual_time is not None:
+            self.clock = virtual_time.clock
+            virtual_time.on_wait = self._wakeup_soon
+        self.collectors = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self.running = False
+        self.stopped = False
+
+    def add(self, name, func, period):
+        self.collectors[name] = ScheduledCollector(name, func, period)
+
+    def run(self):
+        """阻塞执行，直到 stop() 被调用；run() 之前就已 stop() 时直接返回。"""
+        with self._lock:
+            if self.stopped:
+                return
+            self.running = True
+        pool = ThreadPoolExecutor(max_workers=max(self.max_workers, len(self.collectors)),
+                                  thread_name_prefix="collector")
+        try:
+            while self.active:
+                now = self.clock() if self.virtual_time else time.time()
+                next_wakeup = now + 1.0
+                with self._lock:
+                    for c in self.collectors.values():
+                        if c.busy:
+                            continue
+                        due = now if c.next_due is None else c.next_due
+                        if now >= due:
+                            c.busy = True
+                            c.thread_id = None
+                            # 按固定节拍排程
+                            c.next_due = due + c.period
+                            if c.next_due <= now and c.period:
+                                # 上一次跑太久而错过了节拍（漏掉的样本）：从现在重新起算，不补跑
+                                TELEMETRY.count(f"missed.{c.name}", int((now - due) / c.period), self.device)
+                                c.next_due = now + c.period
+                            pool.submit(self._run_one, c)
+                        else:
+                            next_wakeup = min(next_wakeup, due)
+                    idle = self.virtual_time is not None and all(
+                        not c.busy or self._waiting_virtual(c) for c in self.collectors.values())
+                if self.virtual_time is not None:
+                    if idle:
+                        self.virtual_time.advance(next_wakeup)
+                    else:
+                        self._wakeup.wait()
+                        self._wakeup.clear()
+                    continue
+                self._wakeup.wait(max(0.0, next_wakeup - time.time()))
+                self._wakeup.clear()
+        finally:
+            pool.shutdown(wait=True)
+
+    @property
+    def active(self):
+        # 虚拟时钟走完（回放结束）后就不再排程，也不再回报读不到资料的错误
+        return self.running and not (self.virtual_time is not None and self.virtual_time.finished())
+
+    def _waiting_virtual(self, c):
+        return c.thread_id is not None and self.virtual_time.is_waiting(c.thread_id)
+
+    def _wakeup_soon(self):
+        self._wakeup.set()
+
+    def _run_one(self, c):
+        c.thread_id = threading.get_ident()
+        captured_at = self.clock()
+        try:
+            with TELEMETRY.scope(c.name, self.device), TELEMETRY.timer(f"collector.{c.name}", device=self.device):
+                result = c.func()
+            # 在清除 busy 之前发布：同一个 collector 的下一次执行不会抢先发布，较旧的结果不会盖掉较新的
+            if result is not None and self.running:
+                self.publish(c.name, result, captured_at)
+        except Exception as e:
+            if self.active:
+                print(f"[CollectorScheduler] {c.name} error: {e}")
+        finally:
+            with self._lock:
+                c.busy = False
+            self._wakeup.set()
+
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            self.running = False
+        self._wakeup.set()
@@ -0,0 +1,206 @@
+import numpy as np
+
+# ========== 多解析度时间序列：min/max 金字塔 ==========
+# 第 0 层是原始样本，第 k 层的每个 bucket 合并第 k-1 层的 FACTOR 个 bucket，记录时间范围与各栏的最小 / 最大值。
+# 样本一到就逐层往上合并（不满 FACTOR 个的先放在 pending），所以任何时候都能查询。
+# 每层最多保留 LEVEL_CAPACITY 个 bucket，较细的层只留最近的资料；越粗的层涵盖越久，
+# 整个 session（数小时）都能以有限的点数画出来，任意缩放区间也一样。
+
+FACTOR = 4
+LEVEL_CAPACITY = 4096
+INITIAL_SIZE = 256  # 每层一开始配置的 bucket 数，之后加倍成长到 LEVEL_CAPACITY * 2
+
+
+class _Level:
+    """一层 bucket：t_lo / t_hi 为时间范围，vmin / vmax 的形状为 (栏数, bucket 数)。超过容量时丢掉最旧的一半。"""
+
+    def __init__(self, n_columns, capacity, dtype):
+        self.capacity = capacity
+        size = min(INITIAL_SIZE, capacity * 2)
+        self.t_lo = np.empty(size, dtype=np.float64)
+        self.t_hi = np.empty(size, dtype=np.float64)
+        self.vmin = np.empty((n_columns, size), dtype=dtype)
+        self.vmax = np.empty((n_columns, size), dtype=dtype)
+        self.size = 0
+        self.dropped = False  # 是否丢过资料（此时这一层不再涵盖 session 开头）
+        # 还不满 FACTOR 个、尚未合并进这一层的下层 bucket
+        self.pending = (np.empty(0), np.empty(0), np.empty((n_columns, 0), dtype), np.empty((n_columns, 0), dtype))
+
+    def push(self, t_lo, t_hi, vmin, vmax):
+        n = len(t_lo)
+        if self.size + n > self.capacity * 2:
+            # 压缩：只留最近 capacity 个（连同这次的资料）
+            keep = max(self.capacity - n, 0)
+            start = self.size - keep
+            for arr in (self.t_lo, self.t_hi):
+                arr[:keep] = arr[start:self.size]
+            for arr in (self.vmin, self.vmax):
+                arr[:, :keep] = arr[:, start:self.size]
+            self.size = keep
+            self.dropped = True
+            if n > self.capacity * 2:
+                t_lo, t_hi, vmin, vmax = t_lo[-self.capacity:], t_hi[-self.capacity:], \
+                    vmin[:, -self.capacity:], vmax[:, -self.capacity:]
+                n = len(t_lo)
+        end = self.size + n
+        if end > len(self.t_lo):
+            self._grow(min(self.capacity * 2, max(end, len(self.t_lo) * 2)))
+        self.t_lo[self.size:end] = t_lo
+        self.t_hi[self.size:end] = t_hi
+        self.vmin[:, self.size:end] = vmin
+        self.vmax[:, self.size:end] = vmax
+        self.size = end
+
+    def _grow(self, size):
+        n = self.size
+        for name in ("t_lo", "t_hi"):
+            arr = np.empty(size, dtype=np.float64)
+            arr[:n] = getattr(self, name)[:n]
+            setattr(self, name, arr)
+        for name in ("vmin", "vmax"):
+            old = getattr(self, name)
+            arr = np.empty((old.shape[0], size), dtype=old.dtype)
+            arr[:, :n] = old[:, :n]
+            setattr(self, name, arr)
+
+    def view(self):
+        n = self.size
+        return self.t_lo[:n], self.t_hi[:n], self.vmin[:, :n], self.vmax[:, :n]
+
+    @property
+    def first_time(self):
+        return float(self.t_lo[0]) if self.size else None
+
+
+def _merge(t_lo, t_hi, vmin, vmax, group):
+    """把连续 group 个 bucket 合并成一个（长度需为 group 的倍数）。"""
+    n = len(t_lo) // group
+    return (t_lo[::group][:n], t_hi[group - 1::group][:n],
+            vmin.reshape(vmin.shape[0], n, group).min(axis=2),
+            vmax.reshape(vmax.shape[0], n, group).max(axis=2))
+
+
+def _concat(a, b):
+    return tuple(np.concatenate([x, y], axis=-1) for x, y in zip(a, b))
+
+
+class MinMaxPyramid:
+    """
+    append / extend 与 RingBuffer 相同；window(t0, t1, max_points) 回传该区间内每栏最多 max_points 个点。
+    查询时选能涵盖 t0 的最细的一层（超出预算再临时合并）；每个 bucket 以 (中点, 最小值)、(中点, 最大值) 两点画出，
+    所以降采样后的曲线仍保留尖峰。
+    """
+
+    def __init__(self, columns, factor=FACTOR, level_capacity=LEVEL_CAPACITY, dtype=np.float32):
+        self.columns = list(columns)
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self.factor = factor
+        self.level_capacity = level_capacity
+        self.dtype = dtype
+        self.levels = []
+        self.total = 0
+        self.clear()
+
+    def clear(self):
+        self.levels = [self._new_level()]
+        self.total = 0
+
+    def _new_level(self):
+        return _Level(len(self.columns), self.level_capacity, self.dtype)
+
+    def append(self, t, values):
+        self.extend([t], [values])
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        if not len(times):
+            return
+        values = np.asarray(values, dtype=self.dtype).reshape(len(times), len(self.columns)).T
+        self.total += len(times)
+        self._push(0, (times, times, values, values))
+
+    def _push(self, level, buckets):
+        # 写进这一层，并把凑满 FACTOR 个的 bucket 合并到上一层
+        self.levels[level].push(*buckets)
+        if level + 1 == len(self.levels):
+            if self.levels[level].size < self.factor * 2:
+                return  # 资料还少，先不建更粗的层
+            self.levels.append(self._new_level())
+            buckets = self.levels[level].view()
+        upper = self.levels[level + 1]
+        combined = _concat(upper.pending, buckets)
+        complete = len(combined[0]) // self.factor * self.factor
+        upper.pending = tuple(x[..., complete:].copy() for x in combined)
+        if complete:
+            self._push(level + 1, _merge(*(x[..., :complete] for x in combined), self.factor))
+
+    def _tail(self, level):
+        # 第 level 层最后一个完整 bucket 之后的资料：各层 pending 各自合并成一个 bucket，由粗到细
+        tail = []
+        for lv in self.levels[level:0:-1]:
+            t_lo, t_hi, vmin, vmax = lv.pending
+            if len(t_lo):
+                tail.append((t_lo[:1], t_hi[-1:], vmin.min(axis=1, keepdims=True), vmax.max(axis=1, keepdims=True)))
+        return tail
+
+    @property
+    def first_time(self):
+        for lv in reversed(self.levels):
+            if lv.size:
+                return lv.first_time
+        return None
+
+    def window(self, t0=None, t1=None, max_points=1000, columns=None):
+        """
+        回传 (times, {栏位: values})。t0 / t1 为 None 表示从 session 开头 / 到最新。
+        原始层直接回传样本；较粗的层每个 bucket 两点（最小值、最大值）。
+        """
+        names = self.columns if columns is None else list(columns)
+        rows = [self._index[name] for name in names]
+        t0 = -np.inf if t0 is None else t0
+        t1 = np.inf if t1 is None else t1
+        budget = max(max_points, 2)
+
+        chosen = None
+        for level, lv in enumerate(self.levels):
+            t_lo, t_hi, _, _ = lv.view()
+            if lv.dropped and (not lv.size or t_lo[0] > t0):
+                continue  # 这一层已丢掉区间开头的资料
+            i, j = np.searchsorted(t_hi, t0, "left"), np.searchsorted(t_lo, t1, "right")
+            count = (j - i) * (1 if level == 0 else 2) + 2 * level  # 加上 pending 的尾巴
+            chosen = (level, i, j)
+            # 原始层要在预算内才直接用；较粗的层超出预算不到 FACTOR 倍时，查询时再合并一次，点数更接近预算
+            if count <= (budget if level == 0 else budget * self.factor):
+                break
+        if chosen is None:
+            return np.empty(0), {name: np.empty(0, dtype=self.dtype) for name in names}
+        level, i, j = chosen
+
+        t_lo, t_hi, vmin, vmax = (x[..., i:j] for x in self.levels[level].view())
+        buckets = [(t_lo, t_hi, vmin[rows], vmax[rows])]
+        if j == self.levels[level].size:
+            buckets += [(a, b, c[rows], d[rows]) for a, b, c, d in self._tail(level)
+                        if b[0] >= t0 and a[0] <= t1]
+        t_lo, t_hi, vmin, vmax = (np.concatenate(x, axis=-1) for x in zip(*buckets))
+
+        if level == 0 and len(buckets) == 1:
+            return t_lo, {name: vmin[k] for k, name in enumerate(names)}
+        # 超出预算时（选到的层或最粗的一层仍太多点）：查询时再合并一次
+        group = -(-2 * len(t_lo) // budget)
+        if group > 1:
+            n = len(t_lo) // group * group
+            head = _merge(t_lo[:n], t_hi[:n], vmin[:, :n], vmax[:, :n], group)
+            if n < len(t_lo):
+                rest = (t_lo[n:n + 1], t_hi[-1:], vmin[:, n:].min(axis=1, keepdims=True),
+                        vmax[:, n:].max(axis=1, keepdims=True))
+                head = _concat(head, rest)
+            t_lo, t_hi, vmin, vmax = head
+        mid = (t_lo + t_hi) / 2
+        times = np.repeat(mid, 2)
+        values = {}
+        for k, name in enumerate(names):
+            pair = np.empty(len(mid) * 2, dtype=self.dtype)
+            pair[0::2] = vmin[k]
+            pair[1::2] = vmax[k]
+            values[name] = pair
+        return times, values
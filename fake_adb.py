@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+离线测试 / benchmark 用的假 adb。把 ADB_EXEC_PATH 指到这个档案（需有执行权限），
+per.py 的整条采集管线（shell 会话、批次快照、exec-out 串流、--latency 解析…）就能在没有手机的机器上跑。
+
+shell 指令交给本机的 sh 执行：指令中的 /proc、/sys、/data 路径会被导向一个虚拟设备目录，
+目录里的 /proc/stat、cpufreq、meminfo、gpubusy、电池温度等档案由背景线程依时间持续更新；
+dumpsys / getprop / ip / logcat / pm / am 则是同目录 bin/ 下产生的小脚本。
+
+环境变数：
+  FAKE_ADB_SCENARIO  情境 JSON 档（见 DEFAULT_SCENARIO；timeline 可在指定秒数后改变任何值）
+  FAKE_ADB_LATENCY   每个指令额外的延迟（秒），覆盖情境中的 latency
+  FAKE_ADB_STATE     跨行程的状态目录（推送的档案、gfxinfo reset 时间、情境起始时间）
+"""
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+DEFAULT_SCENARIO = {
+    "serials": ["FAKE0001"],
+    "model": "Fake Pixel",
+    "ip": "192.168.1.100",
+    "cores": 8,
+    "max_freq_mhz": [1800] * 4 + [2400] * 3 + [3000],
+    "cpu_load": 0.4,  # 平均负载 0~1，会随时间正弦变化
+    "mem_total_kb": 8_000_000,
+    "mem_used_ratio": 0.6,
+    "gpu_busy": 0.45,
+    "temp_c": 33.5,
+    "battery_temp_node": True,  # False 时没有 /sys/class/power_supply/battery/temp，只能从 thermal zone 读电池温度
+    "refresh_rate": 120.0,
+    "display_modes": [60.0, 120.0],
+    "package": "com.example.game",
+    "activity": ".MainActivity",
+    "surface_view": True,  # False 时没有 SurfaceView layer，只能走 gfxinfo
+    "fps": 120.0,
+    "jank_every": 90,  # 每 N 帧出现一次卡顿（该帧多花 jank_vsyncs 个 VSync），0 为不卡顿
+    "jank_vsyncs": 3,
+    "latency": 0.0,
+    "install_seconds": 1.0,  # adb install 的耗时（真机通常要好几秒）
+    "refresh": 0.05,  # 虚拟档案的更新间隔（秒）
+    "timeline": [],  # 例如 [{"at": 10, "package": "com.other.app", "fps": 60}]
+}
+
+ROOT_PATHS = re.compile(r"(?<![\w/.])/(proc|sys|data)/")
+
+
+# ========== 情境 ==========
+def load_scenario():
+    scenario = dict(DEFAULT_SCENARIO)
+    path = os.environ.get("FAKE_ADB_SCENARIO")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            scenario.update(json.load(f))
+    if os.environ.get("FAKE_ADB_LATENCY"):
+        scenario["latency"] = float(os.environ["FAKE_ADB_LATENCY"])
+    return scenario
+
+
+def state_dir():
+    path = os.environ.get("FAKE_ADB_STATE") or os.path.join(tempfile.gettempdir(), "fake_adb_state")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def device_root(serial):
+    # Wi-Fi / 模拟器的序号（ip:port）含有 ':'，放进 PATH 会被拆开，目录名换成 '_'
+    return os.path.join(state_dir(), serial.replace(":", "_"))
+
+
+def scenario_epoch(state):
+    # 情境时间从第一次呼叫假 adb 起算，之后的行程共用同一个起点
+    path = os.path.join(state, "epoch")
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            f.write(str(time.time()))
+    with open(path) as f:
+        return float(f.read())
+
+
+def at_time(scenario, elapsed):
+    current = dict(scenario)
+    for step in sorted(scenario.get("timeline", []), key=lambda s: s.get("at", 0)):
+        if step.get("at", 0) <= elapsed:
+            current.update({k: v for k, v in step.items() if k != "at"})
+    return current
+
+
+# ========== 虚拟档案内容（都是时间的函数，跨行程一致） ==========
+def core_load(s, i, t):
+    base = s["cpu_load"]
+    amp = min(base, 1 - base) * 0.5
+    return base, amp, base + amp * math.sin(t / 3 + i)
+
+
+def proc_stat(s, t):
+    lines, total_user, total_idle = [], 0, 0
+    for i in range(s["cores"]):
+        base, amp, _ = core_load(s, i, t)
+        # 负载的积分，保证计数单调递增
+        busy = base * t - 3 * amp * (math.cos(t / 3 + i) - math.cos(i))
+        user = int(busy * 100)
+        idle = int(t * 100) - user
+        total_user += user
+        total_idle += idle
+        lines.append(f"cpu{i} {user} 0 0 {idle} 0 0 0 0 0 0")
+    lines.insert(0, f"cpu  {total_user} 0 0 {total_idle} 0 0 0 0 0 0")
+    lines.append(f"intr {int(t * 1000)}")
+    return "\n".join(lines) + "\n"
+
+
+def frame_interval_ns(s):
+    period = int(1e9 / s["refresh_rate"])
+    return period, period * max(1, round(s["refresh_rate"] / max(s["fps"], 1)))
+
+
+def frame_present(s, k, t0):
+    period, interval = frame_interval_ns(s)
+    extra = (k // s["jank_every"]) * s["jank_vsyncs"] * period if s["jank_every"] else 0
+    return t0 + k * interval + extra
+
+
+def recent_frames(s, now_ns, count, since_ns=0):
+    """最近 count 帧的 (desired, actual, ready)，只包含 since_ns 之后的帧。"""
+    period, interval = frame_interval_ns(s)
+    t0 = 0
+    cycle = interval * (s["jank_every"] or 1) + (s["jank_vsyncs"] * period if s["jank_every"] else 0)
+    k = int(now_ns // cycle) * (s["jank_every"] or 1)
+    while frame_present(s, k + 1, t0) <= now_ns:
+        k += 1
+    frames = []
+    while len(frames) < count and k >= 0:
+        present = frame_present(s, k, t0)
+        if present <= since_ns:
+            break
+        frames.append((present - 2 * period, present, present - period // 2))
+        k -= 1
+    frames.reverse()
+    return frames
+
+
+def sf_latency(s, now_ns):
+    period, _ = frame_interval_ns(s)
+    rows = [str(period)] + [f"{a}\t{b}\t{c}" for a, b, c in recent_frames(s, now_ns, 127)]
+    return "\n".join(rows) + "\n"
+
+
+GFXINFO_HEADER = ("Flags,FrameTimelineVsyncId,IntendedVsync,Vsync,InputEventId,HandleInputStart,AnimationStart,"
+                  "PerformTraversalsStart,DrawStart,FrameDeadline,FrameInterval,FrameStartTime,SyncQueued,SyncStart,"
+                  "IssueDrawCommandsStart,SwapBuffers,FrameCompleted,DequeueBufferDuration,QueueBufferDuration,"
+                  "GpuCompleted,SwapBuffersCompleted,DisplayPresentTime,CommandSubmissionCompleted,")
+
+
+def gfxinfo(s, now_ns, since_ns):
+    period, _ = frame_interval_ns(s)
+    names = GFXINFO_HEADER.rstrip(",").split(",")
+    rows = []
+    for desired, present, ready in recent_frames(s, now_ns, 120, since_ns):
+        values = dict.fromkeys(names, 0)
+        values.update(IntendedVsync=desired, Vsync=desired, FrameInterval=period, DrawStart=desired + 1_000_000,
+                      FrameCompleted=ready, GpuCompleted=ready, DisplayPresentTime=present)
+        rows.append(",".join(str(values[n]) for n in names) + ",")
+    return (f"{now_ns}\nApplications Graphics Acceleration Info:\n\n** Graphics info for pid 1234 [{s['package']}] **\n\n"
+            f"---PROFILEDATA---\n{GFXINFO_HEADER}\n" + "\n".join(rows) + "\n---PROFILEDATA---\n")
+
+
+def build_files(s, t, state):
+    now_ns = time.monotonic_ns()
+    files = {
+        "proc/stat": proc_stat(s, t),
+        "proc/meminfo": (f"MemTotal:       {s['mem_total_kb']} kB\nMemFree:        {int(s['mem_total_kb'] * 0.1)} kB\n"
+                         f"MemAvailable:   {int(s['mem_total_kb'] * (1 - s['mem_used_ratio']))} kB\n"),
+        "proc/uptime": f"{t:.2f} {t * s['cores'] * 0.5:.2f}\n",
+        "sys/devices/system/cpu/possible": f"0-{s['cores'] - 1}\n",
+        "sys/class/thermal/thermal_zone0/type": "battery\n",
+        "sys/class/thermal/thermal_zone0/temp": f"{int(s['temp_c'] * 1000)}\n",
+        "sys/class/thermal/thermal_zone1/type": "cpu-0-0\n",
+        "sys/class/thermal/thermal_zone1/temp": f"{int((s['temp_c'] + 8) * 1000)}\n",
+        "sys/class/kgsl/kgsl-3d0/gpubusy": f"{int(s['gpu_busy'] * 1_000_000)} 1000000\n",
+    }
+    if s["battery_temp_node"]:
+        files["sys/class/power_supply/battery/temp"] = f"{int(s['temp_c'] * 10)}\n"
+    for i in range(s["cores"]):
+        max_freq = s["max_freq_mhz"][i] if i < len(s["max_freq_mhz"]) else s["max_freq_mhz"][-1]
+        load = core_load(s, i, t)[2]
+        files[f"sys/devices/system/cpu/cpu{i}/cpufreq/scaling_cur_freq"] = f"{int(max_freq * (0.3 + 0.7 * load)) * 1000}\n"
+
+    layer = f"SurfaceView[{s['package']}/{s['package']}{s['activity']}](BLAST)#{zlib.crc32(s['package'].encode()) % 1000}"
+    files["fake/activities"] = f"  ResumedActivity: ActivityRecord{{5b3a1c u0 {s['package']}/{s['activity']} t12}}\n"
+    files["fake/sf_list"] = "\n".join([
+        "Display 4619827259835644672 (HWC display 0): port=0 pnpId=GGL displayName=\"EMU_display_0\"",
+        "com.android.systemui.ImageWallpaper#0",
+        f"{s['package']}/{s['package']}{s['activity']}#1",
+    ] + ([f"2c9183a {layer}"] if s["surface_view"] else []) + ["StatusBar#2", "NavigationBar0#3"]) + "\n"
+    files["fake/sf_latency"] = sf_latency(s, now_ns) if s["surface_view"] else f"{frame_interval_ns(s)[0]}\n"
+    files["fake/sf_dump"] = f"Display 0 HWC layers:\nrefresh-rate              : {s['refresh_rate']:.2f} Hz\n"
+    files["fake/display"] = ("  mBaseDisplayInfo=DisplayInfo{supportedModes [" + ", ".join(
+        f"{{id={i + 1}, width=1080, height=2400, fps={fps}}}" for i, fps in enumerate(s["display_modes"])) + "]}\n")
+    files["fake/battery"] = (f"Current Battery Service state:\n  AC powered: false\n  USB powered: true\n"
+                             f"  level: 80\n  voltage: 4000\n  temperature: {int(s['temp_c'] * 10)}\n")
+    reset_path = os.path.join(state, "gfxinfo_reset")
+    since = int(open(reset_path).read() or 0) if os.path.exists(reset_path) else 0
+    files["fake/gfxinfo"] = gfxinfo(s, now_ns, since)
+    files["fake/package"] = s["package"]
+    return files
+
+
+def write_files(root, files):
+    for rel, content in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+# ========== 假的设备端指令 ==========
+TOOLS = {
+    "dumpsys": r'''#!/bin/sh
+F="$FAKE_ROOT/fake"
+case "$1" in
+  SurfaceFlinger)
+    case "$2" in
+      --list) cat "$F/sf_list" ;;
+      --latency) cat "$F/sf_latency" ;;
+      *) cat "$F/sf_dump" ;;
+    esac ;;
+  activity) cat "$F/activities" ;;
+  battery) cat "$F/battery" ;;
+  display) cat "$F/display" ;;
+  gfxinfo)
+    # 第一行是产生该档时的时间，reset 之后只会看到这个时间之后的帧
+    { read -r stamp; cat; } < "$F/gfxinfo"
+    case " $* " in *" reset "*) echo "$stamp" > "$FAKE_STATE/gfxinfo_reset" ;; esac ;;
+  package) echo "  versionCode=1 minSdk=24 targetSdk=34" ;;
+esac
+''',
+    "getprop": '''#!/bin/sh
+case "$1" in
+  ro.product.model) echo "$FAKE_MODEL" ;;
+  *) echo "" ;;
+esac
+''',
+    "ip": '''#!/bin/sh
+case "$*" in
+  *route*) echo "192.168.1.0/24 dev wlan0 proto kernel scope link src $FAKE_IP" ;;
+  *) printf '3: wlan0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500\\n    inet %s/24 brd 192.168.1.255 scope global wlan0\\n' "$FAKE_IP" ;;
+esac
+''',
+    "logcat": '''#!/bin/sh
+# 前景应用改变时输出一笔 resume 事件
+last=""
+while true; do
+  pkg=$(cat "$FAKE_ROOT/fake/package")
+  if [ "$pkg" != "$last" ]; then
+    echo "I wm_on_resume_called: [0,$pkg,RESUME_ACTIVITY]"
+    last="$pkg"
+  fi
+  sleep 0.2
+done
+''',
+    "pm": '''#!/bin/sh
+case "$1" in
+  path) [ -f "$FAKE_ROOT/data/app/$2/base.apk" ] && echo "package:$FAKE_ROOT/data/app/$2/base.apk" || exit 1 ;;
+  *) echo "Success" ;;
+esac
+''',
+    "am": '''#!/bin/sh
+echo "Starting service: Intent { cmp=$3 }"
+''',
+}
+
+
+class VirtualDevice:
+    """
+    每个 serial 一个虚拟设备目录（放在状态目录下，推送的脚本里改写过的路径在之后的行程仍然有效），
+    每个假 adb 行程在执行期间都以背景线程持续更新其中的档案。
+    """
+
+    def __init__(self, scenario, serial):
+        self.scenario = scenario
+        self.serial = serial
+        self.state = state_dir()
+        self.epoch = scenario_epoch(self.state)
+        self.root = device_root(serial)
+        self.bin = os.path.join(self.root, "bin")
+        write_files(self.root, {f"bin/{name}": body for name, body in TOOLS.items()})
+        for name in TOOLS:
+            os.chmod(os.path.join(self.bin, name), 0o755)
+        os.makedirs(os.path.join(self.root, "data", "local", "tmp"), exist_ok=True)
+        self.refresh()
+        self._stop = threading.Event()
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def current(self):
+        return at_time(self.scenario, time.time() - self.epoch)
+
+    def refresh(self):
+        write_files(self.root, build_files(self.current(), time.time() - self.epoch, self.state))
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.scenario["refresh"]):
+            try:
+                self.refresh()
+            except OSError:
+                pass
+
+    def env(self):
+        s = self.current()
+        env = dict(os.environ)
+        env.update(PATH=self.bin + os.pathsep + env.get("PATH", ""), FAKE_ROOT=self.root, FAKE_STATE=self.state,
+                   FAKE_MODEL=s["model"], FAKE_IP=s["ip"], ANDROID_SERIAL=self.serial)
+        return env
+
+    def rewrite(self, text):
+        return ROOT_PATHS.sub(lambda m: f"{self.root}/{m.group(1)}/", text)
+
+    def close(self):
+        self._stop.set()
+
+
+def pump(src, dst, device):
+    """逐行转发 sh 的输出，去掉虚拟目录前缀。"""
+    prefix = device.root.encode()
+    try:
+        for line in iter(src.readline, b""):
+            dst.write(line.replace(prefix, b""))
+            dst.flush()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+def run_shell(device, command, latency):
+    """执行 shell 指令；command 为 None 时是互动式会话（指令由 stdin 送入）。"""
+    interactive = command is None
+    if latency and not interactive:
+        time.sleep(latency)
+    args = ["sh"] if interactive else ["sh", "-c", device.rewrite(command)]
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE if interactive else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=device.env(), cwd=device.root)
+    threads = [threading.Thread(target=pump, args=(proc.stdout, sys.stdout.buffer, device), daemon=True),
+               threading.Thread(target=pump, args=(proc.stderr, sys.stderr.buffer, device), daemon=True)]
+    for t in threads:
+        t.start()
+    if interactive:
+        stdin = sys.stdin.buffer
+        try:
+            while True:
+                chunk = os.read(stdin.fileno(), 65536)
+                if not chunk:
+                    break
+                if latency:
+                    time.sleep(latency)
+                proc.stdin.write(device.rewrite(chunk.decode("utf-8", errors="ignore")).encode("utf-8"))
+                proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+    code = proc.wait()
+    for t in threads:
+        t.join(timeout=1)
+    return code
+
+
+def push(device, local, remote):
+    # 推送脚本时同样改写其中的设备路径
+    target = device.rewrite(remote)
+    with open(local, encoding="utf-8", errors="ignore") as f:
+        content = device.rewrite(f.read())
+    with open(target, "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+    print(f"{local}: 1 file pushed, 0 skipped.")
+    return 0
+
+
+def main(argv):
+    scenario = load_scenario()
+    serial = os.environ.get("ANDROID_SERIAL") or scenario["serials"][0]
+    while argv and argv[0] in ("-s", "-H", "-P", "-t"):
+        if argv[0] == "-s":
+            serial = argv[1]
+        argv = argv[2:]
+    if not argv:
+        print("fake adb: missing command", file=sys.stderr)
+        return 1
+    cmd, args = argv[0], argv[1:]
+
+    if cmd == "devices":
+        print("List of devices attached")
+        for s in scenario["serials"]:
+            print(f"{s}\tdevice")
+        return 0
+    if cmd == "get-state":
+        if serial not in scenario["serials"]:
+            print(f"error: device '{serial}' not found", file=sys.stderr)
+            return 1
+        print("device")
+        return 0
+    if cmd in ("forward", "reverse"):
+        if args and args[0].startswith("tcp:"):
+            print(args[0].split(":", 1)[1])
+        return 0
+    if cmd in ("tcpip", "disconnect", "kill-server", "start-server"):
+        return 0
+    if cmd == "connect":
+        print(f"connected to {args[0] if args else ''}")
+        return 0
+    if cmd == "install":
+        # 装好的 APK 放在虚拟设备的 /data/app/<package>/base.apk，pm path / sha256sum 看得到
+        apk = [a for a in args if not a.startswith("-")][-1]
+        with open(apk, "rb") as f:
+            content = f.read()
+        time.sleep(scenario["install_seconds"])
+        target = os.path.join(device_root(serial), "data", "app", "com.example.batteryapi", "base.apk")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(content)
+        print("Performing Streamed Install\nSuccess")
+        return 0
+    if cmd == "uninstall":
+        path = os.path.join(device_root(serial), "data", "app", args[0], "base.apk")
+        if os.path.exists(path):
+            os.remove(path)
+        print("Success")
+        return 0
+
+    if cmd not in ("shell", "exec-out", "push"):
+        print(f"fake adb: unsupported command {cmd}", file=sys.stderr)
+        return 1
+    if serial not in scenario["serials"]:
+        print(f"error: device '{serial}' not found", file=sys.stderr)
+        return 1
+
+    device = VirtualDevice(scenario, serial)
+    try:
+        if cmd == "push":
+            return push(device, args[0], args[1])
+        command = " ".join(args) if args else None
+        return run_shell(device, command, scenario["latency"])
+    finally:
+        device.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+BatteryService 的假端点，配合 fake_adb.py 做离线测试 / benchmark。
+
+  python fake_power_server.py [--port 18080] [--rate 50] [--latency 0.0] [--no-batch]
+
+- GET /battery                    最新一笔 {"powerMW", "voltageV", "currentMA"}
+- GET /battery/batch?since=<cursor> 之后的所有样本（设备时间 t 为 ms），--no-batch 时回 404
+预设 port 与 per.POWER_FORWARD_PORT 相同，假 adb 的 forward 不做任何事，PowerClient 会直接连到这里。
+"""
+import argparse
+import json
+import math
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BUFFER_SECONDS = 60  # 只保留最近这段时间的样本，太久没来取的 cursor 会丢资料
+
+
+class PowerModel:
+    """功耗随时间正弦变化；样本依序号 k 产生，不需要背景线程。"""
+
+    def __init__(self, rate=50.0, base_ma=400.0, swing_ma=150.0, voltage=4.0, clock_skew=0.0):
+        self.rate = rate
+        self.base_ma = base_ma
+        self.swing_ma = swing_ma
+        self.voltage = voltage
+        self.clock_skew = clock_skew  # 模拟设备与主机的时钟差（秒）
+        self.start = time.time()
+
+    def cursor(self):
+        return int((time.time() - self.start) * self.rate)
+
+    def sample(self, k):
+        t = self.start + k / self.rate
+        current = self.base_ma + self.swing_ma * math.sin(t * 2)
+        return {
+            't': int((t + self.clock_skew) * 1000),
+            'powerMW': round(current * self.voltage, 2),
+            'voltageV': self.voltage,
+            'currentMA': round(current, 2),
+        }
+
+    def since(self, cursor):
+        now = self.cursor()
+        first = max(cursor + 1, now - int(BUFFER_SECONDS * self.rate) + 1, 0)
+        return now, [self.sample(k) for k in range(first, now + 1)]
+
+
+def make_handler(model, latency=0.0, batch=True):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            url = urlparse(self.path)
+            if url.path == '/battery/batch' and batch:
+                try:
+                    since = int(parse_qs(url.query).get('since', ['-1'])[0])
+                except ValueError:
+                    since = -1
+                cursor, samples = model.since(since)
+                self.reply(200, {'cursor': cursor, 'samples': samples})
+            elif url.path == '/battery':
+                sample = model.sample(model.cursor())
+                sample.pop('t')
+                self.reply(200, sample)
+            else:
+                self.reply(404, None)
+
+        def reply(self, status, payload):
+            body = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=18080, rate=50.0, latency=0.0, batch=True, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), make_handler(PowerModel(rate), latency, batch))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="假的 BatteryService 功耗端点")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--rate', type=float, default=50.0, help="每秒样本数")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求额外的延迟（秒）")
+    parser.add_argument('--no-batch', action='store_true', help="不提供 /battery/batch（模拟旧版服务）")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.rate, args.latency, not args.no_batch, args.host)
+    print(f"fake power server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+# ========== 无介面采集（python -m headless） ==========
+# 与 GUI 相同的采集管线与每秒 log，但不载入 Qt、不建立 MonitorWindow，
+# 给没有显示器的 Linux 测试机（device farm）使用。per / pipeline 在解析完参数、设好 ANDROID_SERIAL 之后才载入。
+# --devices 同时监控多台设备（pipeline.DevicePool），每台各自一份 session log。
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m headless",
+        description="不開 GUI 採集 Android 效能資料，每秒一行寫進 session 記錄檔（與 GUI 的 CSV 格式相同）。")
+    parser.add_argument("-s", "--serial", default=os.environ.get("ANDROID_SERIAL"),
+                        help="設備序號（預設為 ANDROID_SERIAL；只接一台設備時可省略）")
+    parser.add_argument("--devices", default=None,
+                        help="同時監控多台設備：以逗號分隔的序號，或 all 表示 adb devices 列出的全部設備")
+    parser.add_argument("-d", "--duration", type=float, default=0,
+                        help="採集秒數；0 表示直到 Ctrl+C（回放時到檔案結尾）")
+    parser.add_argument("-i", "--interval", type=int, default=None,
+                        help="快照（CPU/GPU/溫度/記憶體）的採集間隔 (ms)")
+    parser.add_argument("-c", "--collectors", default=None,
+                        help="要啟用的 collector，以逗號分隔（預設全部）")
+    parser.add_argument("-o", "--output", default=None,
+                        help="結束時把整個 session 合併導出成這個 CSV 檔（多台設備時檔名加上序號）")
+    parser.add_argument("--session-dir", default=None, help="session 記錄檔的目錄（預設為 PER_SESSION_DIR）")
+    parser.add_argument("--package", default=None, help="監控的應用程式（預設為目前的前景應用程式）")
+    parser.add_argument("--no-install", action="store_true", help="不安裝 / 啟動功耗服務")
+    parser.add_argument("--stream", action="store_true", help="在設備端循環採樣（adb exec-out 串流）")
+    parser.add_argument("--telemetry", default=None, help="結束時把自我量測（診斷）資料導出成這個 JSON 檔")
+    parser.add_argument("-q", "--quiet", action="store_true", help="不輸出定期的摘要")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serial:
+        # adb 本身会读 ANDROID_SERIAL；之后启动的每个 adb 行程（含长驻 shell 会话）都指向这台设备
+        os.environ["ANDROID_SERIAL"] = args.serial
+
+    import pipeline
+    from pipeline import per
+    from telemetry import TELEMETRY
+
+    periods = {}
+    if args.collectors:
+        names = [name.strip() for name in args.collectors.split(",") if name.strip()]
+        unknown = sorted(set(names) - set(pipeline.COLLECTOR_PERIODS))
+        if unknown:
+            print(f"未知的 collector: {', '.join(unknown)}（可用: {', '.join(pipeline.COLLECTOR_PERIODS)}）",
+                  file=sys.stderr)
+            return 2
+        periods = {name: None for name in pipeline.COLLECTOR_PERIODS if name not in names}
+    enabled = [name for name in pipeline.COLLECTOR_PERIODS if name not in periods]
+    interval_ms = args.interval or pipeline.DATA_COLLECTION_INTERVAL
+    if args.devices:
+        return run_devices(args, pipeline, periods, enabled, interval_ms)
+
+    replaying = pipeline.open_session_archive(interval_ms, args.stream)
+    if not replaying and not args.no_install and 'power' in enabled:
+        try:
+            per.install_and_start_service()
+        except Exception as e:
+            # 服务可能早已装好；装不上时功耗栏位为 0，其余照常采集
+            print(f"[headless] 功耗服務安裝失敗: {e}", file=sys.stderr)
+    package = args.package or per.get_foreground_app()
+    if not package:
+        pipeline.close_session_archive()
+        print("無法取得前景應用程式。", file=sys.stderr)
+        return 1
+
+    session_log = pipeline.open_session_log(package, args.session_dir, interval_ms, args.stream)
+    start_time = pipeline.session_time()
+    summary = pipeline.SessionSummary(session_log, start_time, wait_for_cpu='snapshot' in enabled)
+    TELEMETRY.reset()
+
+    # 结果由各采集线程送进佇列，全部在主线程依序处理（对应 GUI 的 data_ready signal）
+    results = queue.Queue()
+    data_pipeline = pipeline.DataPipeline(interval_ms, streaming=args.stream, periods=periods, on_data=results.put)
+    worker = threading.Thread(target=data_pipeline.run, name="pipeline", daemon=True)
+    worker.start()
+    print(f"開始採集 {package}（collector: {', '.join(enabled)}）")
+
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    samples = 0
+    try:
+        while worker.is_alive() or not results.empty():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            try:
+                info = results.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if 'error' in info:
+                print(f"[headless] data error: {info['error']}")
+                continue
+            samples += 1
+            current_time = info['captured_at'] if replaying else time.time()
+            closed = summary.add(info, current_time, pipeline.power_samples(info, current_time))
+            if pipeline.SUMMARY_WINDOW in closed and not args.quiet:
+                elapsed = current_time - start_time
+                print(f"[{int(elapsed // 3600):02}:{int(elapsed % 3600 // 60):02}:{int(elapsed % 60):02}] "
+                      f"{summary.describe()}", flush=True)
+    except KeyboardInterrupt:
+        print("中斷，寫入剩餘資料…")
+    finally:
+        data_pipeline.stop()
+        worker.join(timeout=10)
+        pipeline.close_session_archive()
+        session_log.close()
+
+    print(f"共 {samples} 筆結果，{session_log.rows} 行記錄: {session_log.path}")
+    coverage = summary.describe_coverage()
+    if coverage:
+        print(f"警告: {coverage}", file=sys.stderr)
+    if session_log.error is not None:
+        print(f"記錄檔寫入失敗: {session_log.error}", file=sys.stderr)
+    if args.output and session_log.rows:
+        session_log.export_csv(args.output)
+        print(f"CSV 已導出: {args.output}")
+        if session_log.dropped_parts:
+            print(f"較早的 {session_log.dropped_parts} 個分檔已輪替刪除，未包含在導出中（PER_SESSION_KEEP_PARTS）")
+    if args.telemetry:
+        TELEMETRY.export(args.telemetry)
+    # 一行都没记到通常表示设备或 collector 设定有问题，让 CI 看得出来
+    return 0 if session_log.rows else 1
+
+
+def run_devices(args, pipeline, periods, enabled, interval_ms):
+    from telemetry import TELEMETRY
+
+    if pipeline.RECORD_SESSION or pipeline.REPLAY_SESSION:
+        print("多台設備模式不支援錄製 / 回放（PER_RECORD / PER_REPLAY），已忽略。", file=sys.stderr)
+    serials = None if args.devices == "all" else [s.strip() for s in args.devices.split(",") if s.strip()]
+    on_summary = None if args.quiet else (lambda serial, text: print(f"[{serial}] {text}", flush=True))
+    pool = pipeline.DevicePool(serials, args.session_dir, interval_ms, streaming=args.stream, periods=periods,
+                               package=args.package, install=not args.no_install and 'power' in enabled,
+                               on_summary=on_summary)
+    if not pool.sessions:
+        print("找不到已連線的設備。", file=sys.stderr)
+        return 1
+    TELEMETRY.reset()
+    pool.start()
+    print(f"開始採集 {len(pool.sessions)} 台設備: {', '.join(pool.sessions)}（collector: {', '.join(enabled)}）")
+
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    try:
+        while pool.running():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("中斷，寫入剩餘資料…")
+    finally:
+        pool.stop()
+
+    failed = 0
+    for serial, session in pool.sessions.items():
+        session_log = session.session_log
+        if session_log is None:
+            print(f"[{serial}] 未開始採集: {session.error}", file=sys.stderr)
+            failed += 1
+            continue
+        print(f"[{serial}] 共 {session.samples} 筆結果，{session_log.rows} 行記錄: {session_log.path}")
+        coverage = session.summary.describe_coverage()
+        if coverage:
+            print(f"[{serial}] 警告: {coverage}", file=sys.stderr)
+        if session_log.error is not None:
+            print(f"[{serial}] 記錄檔寫入失敗: {session_log.error}", file=sys.stderr)
+        if args.output and session_log.rows:
+            root, ext = os.path.splitext(args.output)
+            output = f"{root}_{os.path.basename(session.directory)}{ext}"
+            session_log.export_csv(output)
+            print(f"[{serial}] CSV 已導出: {output}")
+            if session_log.dropped_parts:
+                print(f"[{serial}] 較早的 {session_log.dropped_parts} 個分檔已輪替刪除，未包含在導出中")
+        if not session_log.rows:
+            failed += 1
+    if args.telemetry:
+        TELEMETRY.export(args.telemetry)
+    return 0 if not failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
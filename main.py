@@ -1,205 +1,99 @@
+import os
 import sys
 import time
-import math
-import csv
-from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QComboBox, QMessageBox, QFileDialog
+    QPushButton, QLabel, QComboBox, QMessageBox, QFileDialog,
+    QGroupBox, QTableWidget, QTableWidgetItem, QHeaderView
 )
 from PyQt5.QtChart import QChart, QChartView, QLineSeries, QValueAxis
 from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal, QPointF
 from PyQt5.QtGui import QPainter, QColor
 
-# It's assumed a 'per' module exists with the necessary functions.
-# Since it's not provided, a mock will be used for demonstration if run directly.
-try:
-    import per
-except ImportError:
-    print("Warning: 'per' module not found. Using mock data.")
-    class MockPer:
-        def get_foreground_app(self): return "com.mock.app"
-        def get_fps(self, app): return 60 * (0.9 + 0.1 * math.sin(time.time()))
-        def get_cpu_usage_and_freq(self):
-            t = time.time()
-            # Simulate initial zero values for the first 0.1 seconds
-            if not hasattr(self, 'start_time'):
-                self.start_time = t
-            if t - self.start_time < 0.1:
-                 return [0]*8, [0]*8
-            usages = [50 + 40 * math.sin(t + i) for i in range(8)]
-            freqs = [1500 + 1000 * math.sin(t + i) for i in range(8)]
-            return usages, freqs
-        def GPU_Usage(self): return 45 + 20 * math.sin(time.time() * 0.5)
-        def get_battery_temp(self): return 35 + 5 * math.sin(time.time() * 0.2)
-        def get_mem_usage(self): return 60 + 10 * math.sin(time.time() * 0.3)
-        def get_power_data(self, ip):
-            t = time.time()
-            current = abs(-400 + 150 * math.sin(t * 2))
-            voltage = 4.2 - 0.2 * math.sin(t * 2)
-            power = current * voltage
-            return {'power_mW': power, 'voltage_V': voltage, 'current_mA': current}
-        def get_refresh_rate(self): return 120.0
-        def get_surfaceflinger_target_layer(self, target): 
-            # Mock triplets data
-            import random
-            triplets = []
-            base_time = time.time_ns()
-            for i in range(10):
-                triplets.append((i, base_time + i * 16_666_666, base_time + i * 16_666_666 + random.randint(0, 50_000_000)))
-            return triplets
-        def calculate_jank_by_vsync_triplets(self, triplets, period): return (int(time.time()) % 5, int(time.time()) % 2)
-        def get_device_name(self): return "Mock Device"
-        def get_device_ip(self): return "192.168.1.100"
-        def enable_wifi_debug(self): return "192.168.1.100"
-        def install_and_start_service(self): print("Mock: Installing service.")
-        def run_adb_command(self, cmd): print(f"Mock ADB: {cmd}")
-        def uninstall_service(self): print("Mock: Uninstalling service.")
-    per = MockPer()
+from ring_buffer import RingBuffer
+from downsample import MinMaxPyramid
+from pipeline import (
+    per, DataPipeline, SessionSummary, session_time, power_samples,
+    open_session_log, open_session_archive, close_session_archive,
+    DATA_COLLECTION_INTERVAL, STREAM_SAMPLING, SOURCE_METRICS, SUMMARY_WINDOW,
+)
+from telemetry import TELEMETRY
 
+# 采集管线、per（或 mock）与 session 相关设定都在 pipeline.py，headless.py 不载入 Qt 也能使用
 
 MAX_POINTS = 2000
+OVERVIEW_POINTS = 1000  # 长时间区间（降采样）每条曲线最多画的点数
+OVERVIEW_REFRESH = 1.0  # 长时间区间的重画间隔（秒）
+# 图表的时间区间：None 为即时（最近 MAX_POINTS 笔），0 为整个 session，其余为最近几秒
+VIEW_SPANS = [("即時", None), ("10 分鐘", 600), ("1 小時", 3600), ("全程", 0)]
 UI_UPDATE_INTERVAL = 100  # UI 更新频率 100ms，更流畅
-DATA_COLLECTION_INTERVAL = 500  # 数据采集间隔改为 500ms
-DATA_LOG_INTERVAL = 1.0  # 数据记录到 log 的间隔 1 秒
+DIAGNOSTICS_INTERVAL = 1000  # 诊断面板打开时的刷新间隔 (ms)
+# 关闭视窗时是否卸载功耗服务；预设保留，下次监控不必重新安装
+UNINSTALL_ON_EXIT = os.environ.get("PER_UNINSTALL_ON_EXIT", "0") == "1"
+
 
 class DataThread(QThread):
+    """在 QThread 中执行 DataPipeline，结果以 data_ready 交回 UI 线程。"""
     data_ready = pyqtSignal(dict)
 
-    def __init__(self, interval_ms=500):
+    def __init__(self, interval_ms=500, streaming=STREAM_SAMPLING, periods=None):
         super().__init__()
-        self.interval = interval_ms / 1000.0
-        self.running = True
-        self.last_triplets = []  # 缓存上次的 triplets
-        
-        # 缓存上次的数据，避免某些数据获取失败时显示空白
-        self.last_data = {
-            'device': '',
-            'ip': '',
-            'refresh_rate': 60.0
-        }
+        self.pipeline = DataPipeline(interval_ms, streaming, periods, on_data=self.data_ready.emit)
 
     def run(self):
-        frame_count = 0
-        last_triplet_time = 0
-        last_slow_data_time = 0  # 用于控制慢速数据获取
-        
-        while self.running:
-            loop_start_time = time.time()
-            
-            try:
-                info = {}
-                
-                # === 快速数据：每次都获取 ===
-                # CPU 使用率和频率 - 相对快速
-                usages, freqs = per.get_cpu_usage_and_freq()
-                info['usages'] = usages
-                info['freqs'] = freqs
-                
-                # === 慢速数据：每 2 秒获取一次 ===
-                current_time = time.time()
-                if current_time - last_slow_data_time >= 2.0:
-                    last_slow_data_time = current_time
-                    
-                    # 这些命令较慢，降低频率
-                    try:
-                        foreground_app = per.get_foreground_app()
-                        self.last_data['foreground_app'] = foreground_app
-                        
-                        # FPS - 较慢
-                        fps = per.get_fps(foreground_app)
-                        if fps >= 0:  # 只有有效值才更新
-                            self.last_data['fps'] = fps
-                        
-                        # GPU、温度、内存
-                        self.last_data['gpu'] = per.GPU_Usage()
-                        self.last_data['temp'] = per.get_battery_temp()
-                        self.last_data['mem'] = per.get_mem_usage()
-                        
-                        # 电源数据
-                        power_info = per.get_power_data(per.get_device_ip())
-                        if power_info:
-                            self.last_data['power_info'] = power_info
-                        
-                        # 刷新率（很少变化）
-                        refresh_rate = per.get_refresh_rate()
-                        if refresh_rate > 0:
-                            self.last_data['refresh_rate'] = refresh_rate
-                        
-                        # 设备信息（基本不变）
-                        if not self.last_data.get('device'):
-                            self.last_data['device'] = per.get_device_name()
-                        if not self.last_data.get('ip'):
-                            self.last_data['ip'] = per.get_device_ip() if hasattr(per, 'get_device_ip') else None
-                            
-                    except Exception as e:
-                        print(f"[DataThread] Slow data error: {e}")
-                
-                # 使用缓存的数据
-                info['fps'] = self.last_data.get('fps', 0.0)
-                info['gpu'] = self.last_data.get('gpu', 0.0)
-                info['temp'] = self.last_data.get('temp', 0.0)
-                info['mem'] = self.last_data.get('mem', 0.0)
-                info['power_info'] = self.last_data.get('power_info', {})
-                info['refresh_rate'] = self.last_data.get('refresh_rate', 60.0)
-                info['device'] = self.last_data.get('device', '')
-                info['ip'] = self.last_data.get('ip', None)
-                
-                # === Jank 计算：每 2 秒一次 ===
-                jank_count = 0
-                big_jank_count = 0
-                
-                if current_time - last_triplet_time >= 2.0:
-                    last_triplet_time = current_time
-                    
-                    try:
-                        foreground_app = self.last_data.get('foreground_app', '')
-                        if foreground_app:
-                            layer_name = per.get_surfaceflinger_target_layer(foreground_app)
-                            
-                            if layer_name and hasattr(per, 'get_vsync_triplets'):
-                                current_triplets = per.get_vsync_triplets(layer_name)
-                                
-                                if current_triplets and len(current_triplets) > 0:
-                                    new_triplets = current_triplets
-                                    if self.last_triplets and len(self.last_triplets) > 0:
-                                        last_timestamp = self.last_triplets[-1][2]
-                                        new_triplets = [t for t in current_triplets if t[2] > last_timestamp]
-                                    
-                                    if new_triplets and len(new_triplets) >= 4:
-                                        refresh_period_ns = int(1_000_000_000 / info['refresh_rate'])
-                                        jank_count, big_jank_count = per.calculate_jank_by_vsync_triplets(
-                                            new_triplets, refresh_period_ns
-                                        )
-                                    
-                                    self.last_triplets = current_triplets[-50:]
-                    except Exception as e:
-                        if frame_count % 20 == 0:
-                            print(f"[DataThread] Jank error: {e}")
-                
-                info['jank'] = jank_count
-                info['big_jank'] = big_jank_count
-                
-                frame_count += 1
-                
-            except Exception as e:
-                print(f"[DataThread] exception: {e}")
-                info = {'error': str(e)}
-            
-            self.data_ready.emit(info)
-            
-            # 精确的时间控制
-            elapsed = time.time() - loop_start_time
-            sleep_time = max(0, self.interval - elapsed)
-            
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+        self.pipeline.run()
 
     def stop(self):
-        self.running = False
+        self.pipeline.stop()
         self.wait()
 
 
+class SetupThread(QThread):
+    """
+    开始监控前的准备：安装（必要时）并启动功耗服务、取得前景应用、建立 session 记录档。
+    这些都要呼叫 adb，放在背景执行不会卡住视窗；进度以 progress 回报，结束时以 ready 交回结果。
+    """
+    progress = pyqtSignal(str)
+    ready = pyqtSignal(dict)
+
+    def __init__(self, install=True):
+        super().__init__()
+        self.install = install
+        self.cancelled = False  # 准备期间按了停止 / 关闭视窗
+
+    def run(self):
+        result = {'package': None, 'session_log': None, 'error': None}
+        try:
+            if self.install:
+                per.install_and_start_service(progress=self.progress.emit)
+            self.progress.emit("取得前景應用程式…")
+            result['package'] = per.get_foreground_app()
+            if not result['package']:
+                result['error'] = "無法取得前景應用程式。"
+            elif not self.cancelled:
+                result['session_log'] = open_session_log(result['package'])
+        except Exception as e:
+            result['error'] = f"準備監控失敗: {e}"
+        self.ready.emit(result)
+
+
+class ExportThread(QThread):
+    """把 session 的分档合并导出成一份 CSV；长时间的 session 要读很多分档，放在背景执行。"""
+    done = pyqtSignal(str)  # 失败时为错误讯息，成功时为空字串
+
+    def __init__(self, session_log, path):
+        super().__init__()
+        self.session_log = session_log
+        self.path = path
+
+    def run(self):
+        try:
+            self.session_log.export_csv(self.path)
+            self.done.emit("")
+        except OSError as e:
+            self.done.emit(str(e))
+
+
 class MonitorWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -207,16 +101,18 @@ class MonitorWindow(QMainWindow):
         self.resize(1400, 800)
 
         self.metric_titles = ["FPS", "Temp", "Mem", "GPU", "Power"]
-        self.metric_deques = [deque(maxlen=MAX_POINTS) for _ in self.metric_titles]
-
-        self.power_deques = {
-            'power': self.metric_deques[self.metric_titles.index("Power")],
-            'voltage': deque(maxlen=MAX_POINTS),
-            'current': deque(maxlen=MAX_POINTS),
-        }
-
-        self.cpu_usage_deques = [deque(maxlen=MAX_POINTS) for _ in range(8)]
-        self.cpu_freq_deques = [deque(maxlen=MAX_POINTS) for _ in range(8)]
+        # 图表历史：同一个 collector 的指标共用一个时间栏
+        self.cpu_usage_columns = [f"CPU{i}" for i in range(8)]
+        self.cpu_freq_columns = [f"Core{i}" for i in range(8)]
+        self.frame_history = RingBuffer(MAX_POINTS, ["FPS"])
+        self.snapshot_history = RingBuffer(MAX_POINTS, ["Temp", "Mem", "GPU"] + self.cpu_usage_columns + self.cpu_freq_columns)
+        self.power_history = RingBuffer(MAX_POINTS, ["power", "voltage", "current"])
+        self.histories = [self.frame_history, self.snapshot_history, self.power_history]
+        # 整个 session 的多解析度历史，用来画超出 MAX_POINTS 的区间
+        self.pyramids = {id(history): MinMaxPyramid(history.columns) for history in self.histories}
+        # metric_series 的第 i 条曲线（FPS, Temp, Mem, GPU）对应的缓冲与栏位
+        self.metric_columns = [(self.frame_history, "FPS"), (self.snapshot_history, "Temp"),
+                               (self.snapshot_history, "Mem"), (self.snapshot_history, "GPU")]
 
         self.metric_series = []
         self.power_series = {}
@@ -230,34 +126,35 @@ class MonitorWindow(QMainWindow):
         self.cpu_usage_labels = []
         self.cpu_freq_labels = []
 
-        self.data_log = []
+        self.session_log = None  # 每秒一行的记录由背景线程直接写进磁碟
+        self.setup_thread = None
         self.data_thread = None
+        self.export_thread = None
         self.start_time = time.time()
         self.is_monitoring = False
-        self.has_logged_data = False # Flag to prevent logging initial zero values
         
         # 累积 Jank 计数
         self.total_jank_count = 0
         self.total_big_jank_count = 0
         
-        # 数据记录控制
-        self.last_log_time = 0
-        self.accumulated_data = {
-            'fps_sum': 0, 'fps_count': 0,
-            'temp_sum': 0, 'temp_count': 0,
-            'mem_sum': 0, 'mem_count': 0,
-            'gpu_sum': 0, 'gpu_count': 0,
-            'power_sum': 0, 'power_count': 0,
-            'voltage_sum': 0, 'voltage_count': 0,
-            'current_sum': 0, 'current_count': 0,
-            'jank_sum': 0, 'big_jank_sum': 0,
-            'cpu_usages': [[] for _ in range(8)],
-            'cpu_freqs': [[] for _ in range(8)]
-        }
+        # 数据记录控制：每秒的平均值与 10 秒 / 60 秒的摘要都由分层汇总算出
+        self.replaying = False
+        self.summary = SessionSummary()
 
         self.ui_timer = QTimer(self)
         self.ui_timer.setInterval(UI_UPDATE_INTERVAL)
         self.ui_timer.timeout.connect(self.update_display)
+        self.last_display_at = None  # 用来量 UI 计时器的延迟（主线程卡住的时间）
+        # 增量绘图：每个缓冲上次画到第几笔 (RingBuffer.total)，以及当时的时间轴单位
+        self.rendered_totals = {}
+        self.render_divisor = None
+        self.view_span = None
+        self.overview_state = None  # 上次画长时间区间时的 (区间, 各缓冲的 total)
+        self.last_overview_at = 0.0
+
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.setInterval(DIAGNOSTICS_INTERVAL)
+        self.diagnostics_timer.timeout.connect(self.refresh_diagnostics)
 
         self.init_ui()
 
@@ -282,6 +179,9 @@ class MonitorWindow(QMainWindow):
         self.stop_btn = QPushButton("停止")
         self.export_btn = QPushButton("導出CSV")
         self.wifi_btn = QPushButton("開啟WiFi ADB")
+        self.diagnostics_btn = QPushButton("診斷")
+        self.diagnostics_btn.setCheckable(True)
+        self.diagnostics_btn.toggled.connect(self.toggle_diagnostics)
         self.start_btn.clicked.connect(self.start_monitoring)
         self.stop_btn.clicked.connect(self.stop_monitoring)
         self.export_btn.clicked.connect(self.export_csv)
@@ -290,6 +190,13 @@ class MonitorWindow(QMainWindow):
         top_layout.addWidget(self.stop_btn)
         top_layout.addWidget(self.export_btn)
         top_layout.addWidget(self.wifi_btn)
+        top_layout.addWidget(self.diagnostics_btn)
+        self.view_combo = QComboBox()
+        for text, span in VIEW_SPANS:
+            self.view_combo.addItem(text, span)
+        self.view_combo.currentIndexChanged.connect(self.on_view_changed)
+        top_layout.addWidget(QLabel("區間:"))
+        top_layout.addWidget(self.view_combo)
         main_layout.addLayout(top_layout)
 
         # --- Info Labels ---
@@ -299,6 +206,9 @@ class MonitorWindow(QMainWindow):
         self.fps_label = QLabel("FPS: N/A")
         self.jank_label = QLabel("Jank: 0")
         self.big_jank_label = QLabel("Big Jank: 0")
+        self.frame_time_label = QLabel("幀時間 P50/P90/P99/P99.9: N/A")
+        self.stutter_label = QLabel("Stutter: N/A")
+        self.frame_gap_label = QLabel("幀缺口: 0")
         self.temp_label = QLabel("溫度: N/A")
         self.mem_label = QLabel("記憶體: N/A")
         self.gpu_label = QLabel("GPU: N/A")
@@ -306,10 +216,11 @@ class MonitorWindow(QMainWindow):
         self.voltage_label = QLabel("電壓(V): N/A")
         self.current_label = QLabel("電流(mA): N/A")
         self.monitor_time_label = QLabel("監控時間: 00:00:00")
+        self.summary_label = QLabel(f"近 {SUMMARY_WINDOW:.0f} 秒: N/A")
         for label in [self.device_label, self.ip_label, self.fps_label, self.jank_label, 
-                      self.big_jank_label, self.temp_label, self.mem_label, self.gpu_label,
+                      self.big_jank_label, self.frame_time_label, self.stutter_label, self.frame_gap_label, self.temp_label, self.mem_label, self.gpu_label,
                       self.power_label, self.voltage_label, self.current_label,
-                      self.monitor_time_label]:
+                      self.monitor_time_label, self.summary_label]:
             info_layout.addWidget(label)
         main_layout.addLayout(info_layout)
         
@@ -415,6 +326,76 @@ class MonitorWindow(QMainWindow):
         cpu_layout.addLayout(freq_box)
 
         main_layout.addLayout(cpu_layout)
+        main_layout.addWidget(self.create_diagnostics_panel())
+        self.bind_charts()
+
+    def bind_charts(self):
+        """
+        每个缓冲对应的曲线、标签与座标轴。同一个缓冲的曲线一起更新：
+        series 为 (曲线, 栏位, 标签, 标签格式)，y_axes 为 (Y 轴, 决定范围的栏位, 最小上限)。
+        """
+        fps_series, fps_y, fps_x = self.metric_series[0]
+        snapshot_series, snapshot_y, snapshot_x = [], [], []
+        for i, column in enumerate(["Temp", "Mem", "GPU"], start=1):
+            series_obj, axisY, axisX = self.metric_series[i]
+            snapshot_series.append((series_obj, column, self.metric_labels[i], "{:.1f}"))
+            snapshot_y.append((axisY, [column], 10.0))
+            snapshot_x.append(axisX)
+        for series_list, columns, labels, unit, floor in (
+                (self.cpu_usage_series, self.cpu_usage_columns, self.cpu_usage_labels, "%", 100),
+                (self.cpu_freq_series, self.cpu_freq_columns, self.cpu_freq_labels, " MHz", 2000)):
+            for (series_obj, _, _), column, label in zip(series_list, columns, labels):
+                snapshot_series.append((series_obj, column, label, "{:.1f}" + unit))
+            # 8 个核心共用一个 Y 轴，范围取所有核心的最大值
+            snapshot_y.append((series_list[0][1], columns, floor))
+            snapshot_x.append(series_list[0][2])
+        self.chart_groups = [
+            (self.frame_history, {
+                'series': [(fps_series, "FPS", self.metric_labels[0], "{:.1f}")],
+                'y_axes': [(fps_y, ["FPS"], 10.0)],
+                'x_axes': [fps_x],
+            }),
+            (self.snapshot_history, {'series': snapshot_series, 'y_axes': snapshot_y, 'x_axes': snapshot_x}),
+            (self.power_history, {
+                'series': [(self.power_series['power'], 'power', self.power_labels['power'], "{:.2f} mW"),
+                           (self.power_series['voltage'], 'voltage', self.power_labels['voltage'], "{:.3f} V"),
+                           (self.power_series['current'], 'current', self.power_labels['current'], "{:.2f} mA")],
+                'y_axes': [(self.power_axes['power_y'], ['power'], 500.0),
+                           (self.power_axes['secondary_y'], ['voltage', 'current'], 10.0)],
+                'x_axes': [self.power_axes['power_x']],
+            }),
+        ]
+
+    def create_diagnostics_panel(self):
+        # 工具本身的耗时与记忆体：各 collector / adb / HTTP / 解析 / UI 更新的延迟直方图
+        self.diagnostics_panel = QGroupBox("診斷（工具自身耗時，ms）")
+        layout = QVBoxLayout(self.diagnostics_panel)
+        columns = ["項目", "次數", "錯誤", "平均", "P50", "P90", "P99", "最大", "最近"]
+        self.diagnostics_table = QTableWidget(0, len(columns))
+        self.diagnostics_table.setHorizontalHeaderLabels(columns)
+        self.diagnostics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.diagnostics_table.verticalHeader().setVisible(False)
+        self.diagnostics_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.diagnostics_table.setMinimumHeight(180)
+        layout.addWidget(self.diagnostics_table)
+
+        self.diagnostics_label = QLabel()
+        self.diagnostics_label.setWordWrap(True)
+        layout.addWidget(self.diagnostics_label)
+
+        buttons = QHBoxLayout()
+        self.tracemalloc_btn = QPushButton("tracemalloc")
+        self.tracemalloc_btn.setCheckable(True)
+        self.tracemalloc_btn.toggled.connect(self.toggle_tracemalloc)
+        export_btn = QPushButton("導出診斷")
+        export_btn.clicked.connect(self.export_diagnostics)
+        buttons.addWidget(self.tracemalloc_btn)
+        buttons.addWidget(export_btn)
+        buttons.addStretch()
+        layout.addLayout(buttons)
+
+        self.diagnostics_panel.setVisible(False)
+        return self.diagnostics_panel
 
     def enable_wifi(self):
         ip = per.enable_wifi_debug()
@@ -425,69 +406,94 @@ class MonitorWindow(QMainWindow):
             QMessageBox.warning(self, "WiFi ADB 失敗", "無法啟用 WiFi ADB, 請確認手機已透過 USB 連接。")
 
     def start_monitoring(self):
-        if self.is_monitoring:
+        if self.is_monitoring or self.setup_thread:
             return
-        per.install_and_start_service()
-        current_package = per.get_foreground_app()
-        if not current_package:
-            QMessageBox.warning(self, "錯誤", "無法取得前景應用程式。")
+        self.replaying = open_session_archive()
+        # 安装 / 启动服务与查询前景应用都在背景执行，完成后由 on_setup_ready 继续
+        self.start_btn.setEnabled(False)
+        self.setup_thread = SetupThread(install=not self.replaying)
+        self.setup_thread.progress.connect(self.statusBar().showMessage)
+        self.setup_thread.ready.connect(self.on_setup_ready)
+        self.setup_thread.start()
+
+    def on_setup_ready(self, result):
+        cancelled = self.setup_thread.cancelled
+        self.setup_thread.wait()
+        self.setup_thread = None
+        self.start_btn.setEnabled(True)
+        if cancelled or result['error']:
+            close_session_archive()
+            if result['session_log']:
+                result['session_log'].close()
+            self.statusBar().showMessage("已取消" if cancelled else result['error'])
+            if not cancelled:
+                QMessageBox.warning(self, "錯誤", result['error'])
             return
+        current_package = result['package']
+        self.statusBar().showMessage(f"監控中: {current_package}")
         
         self.is_monitoring = True
-        self.has_logged_data = False # 重置日誌標記
         self.total_jank_count = 0  # 重置累积 Jank 计数
         self.total_big_jank_count = 0  # 重置累积 Big Jank 计数
-        self.last_log_time = time.time()  # 重置记录时间
-        
-        # 重置累积数据
-        self.accumulated_data = {
-            'fps_sum': 0, 'fps_count': 0,
-            'temp_sum': 0, 'temp_count': 0,
-            'mem_sum': 0, 'mem_count': 0,
-            'gpu_sum': 0, 'gpu_count': 0,
-            'power_sum': 0, 'power_count': 0,
-            'voltage_sum': 0, 'voltage_count': 0,
-            'current_sum': 0, 'current_count': 0,
-            'jank_sum': 0, 'big_jank_sum': 0,
-            'cpu_usages': [[] for _ in range(8)],
-            'cpu_freqs': [[] for _ in range(8)]
-        }
         
         self.package_combo.clear(); self.package_combo.addItem(current_package)
+        if self.session_log:
+            self.session_log.close()
+        self.session_log = result['session_log']
         if self.data_thread:
             self.data_thread.stop(); self.data_thread = None
 
-        for dq in self.metric_deques: dq.clear()
-        for dq in self.power_deques.values(): dq.clear()
-        for dq in self.cpu_usage_deques: dq.clear()
-        for dq in self.cpu_freq_deques: dq.clear()
-        self.start_time = time.time()
-        self.last_log_time = self.start_time
+        for history in self.histories: history.clear()
+        for pyramid in self.pyramids.values(): pyramid.clear()
+        self.start_time = session_time()
+        self.summary = SessionSummary(self.session_log, self.start_time)  # 重置累积数据与记录时间
+        self.summary_label.setText(f"近 {SUMMARY_WINDOW:.0f} 秒: N/A")
+        self.frame_gap_label.setText("幀缺口: 0"); self.frame_gap_label.setStyleSheet("")
+        TELEMETRY.reset()
+        self.last_display_at = None
+        self.rendered_totals = {}
+        self.render_divisor = None
+        self.overview_state = None
         
         self.data_thread = DataThread(interval_ms=DATA_COLLECTION_INTERVAL)
         self.data_thread.data_ready.connect(self.on_data_ready)
+        if self.replaying:
+            self.data_thread.finished.connect(self.on_replay_finished)
         self.data_thread.start()
         
         self.ui_timer.start()
-        self.data_log.clear()
         self.monitor_time_label.setText("監控時間: 00:00:00")
 
     def stop_monitoring(self):
+        if self.setup_thread:
+            # 还在准备中：等它结束后由 on_setup_ready 收尾
+            self.setup_thread.cancelled = True
         if not self.is_monitoring:
             return
         self.is_monitoring = False
         if self.data_thread:
             self.data_thread.stop(); self.data_thread = None
         self.ui_timer.stop()
+        close_session_archive()
+        if self.session_log:
+            # 写完剩下的资料；保留物件，停止后仍可导出
+            self.session_log.close()
 
+    def on_replay_finished(self):
+        if self.is_monitoring:
+            self.stop_monitoring()
+
+    @TELEMETRY.timed("ui.on_data_ready")
     def on_data_ready(self, info):
         if 'error' in info:
             print(f"[MonitorWindow] data error: {info['error']}")
             return
         
-        # === 使用单调递增的时间，避免时间跳跃 ===
-        current_time = time.time()
-        elapsed_seconds = current_time - self.start_time
+        # === 以采集时间为准，结果晚到也不会画错位置 ===
+        # 回放时以录制当时的采集时间为准，log 的节奏与回放速度无关
+        current_time = info['captured_at'] if self.replaying else time.time()
+        elapsed_seconds = max(0.0, info.get('captured_at', current_time) - self.start_time)
+        elapsed_monitor = current_time - self.start_time
         
         # --- Update Labels Immediately ---
         if info.get('device'): self.device_label.setText(f"設備: {info['device']}")
@@ -509,9 +515,9 @@ class MonitorWindow(QMainWindow):
         self.total_big_jank_count += big_jank_increment
         
         # 立即更新监控时间标签（使用实际经过的时间）
-        h = int(elapsed_seconds // 3600)
-        m = int((elapsed_seconds % 3600) // 60)
-        s = int(elapsed_seconds % 60)
+        h = int(elapsed_monitor // 3600)
+        m = int((elapsed_monitor % 3600) // 60)
+        s = int(elapsed_monitor % 60)
         self.monitor_time_label.setText(f"監控時間: {h:02}:{m:02}:{s:02}")
         
         self.fps_label.setText(f"FPS: {fps:.1f}")
@@ -523,188 +529,230 @@ class MonitorWindow(QMainWindow):
         self.current_label.setText(f"電流(mA): {current_mA:.2f}mA")
         self.jank_label.setText(f"Jank: {self.total_jank_count}")
         self.big_jank_label.setText(f"Big Jank: {self.total_big_jank_count}")
-
-        # --- Append data to deques (for charts) ---
-        metrics = [fps, temp, mem, gpu]
-        for i, v in enumerate(metrics):
-            self.metric_deques[i].append((elapsed_seconds, float(v))) 
-
-        self.power_deques['power'].append((elapsed_seconds, power_mW))
-        self.power_deques['voltage'].append((elapsed_seconds, voltageV))
-        self.power_deques['current'].append((elapsed_seconds, current_mA))
+        frame_stats = info.get('frame_stats') or {}
+        if frame_stats.get('frames'):
+            self.frame_time_label.setText(
+                f"幀時間 P50/P90/P99/P99.9: {frame_stats['p50']:.1f}/{frame_stats['p90']:.1f}/"
+                f"{frame_stats['p99']:.1f}/{frame_stats['p999']:.1f}ms")
+            self.stutter_label.setText(f"Stutter: {frame_stats['stutter']:.2f}%")
+        coverage = info.get('frame_coverage') or {}
+        if coverage.get('gaps'):
+            # 两次 poll 之间漏掉的帧没有判定 Jank，Jank 数偏低
+            self.frame_gap_label.setText(f"幀缺口: {coverage['gaps']}（遺失 {coverage['lost_pct']:.1f}%）")
+            self.frame_gap_label.setStyleSheet("color: #d9534f;")
+
+        # --- Append data to ring buffers (for charts) ---
+        # 只追加这次结果所属 collector 的指标，其余为缓存值，不重复画点
+        updated = SOURCE_METRICS.get(info.get('source'), ())
+        if 'FPS' in updated:
+            self.append_history(self.frame_history, elapsed_seconds, (fps,))
+
+        # 批次功耗：每个样本带自己的设备时间；没有批次时就是这一次的单点读数
+        power = power_samples(info, current_time)
+        if power:
+            self.append_history(self.power_history, [max(0.0, s[0] - self.start_time) for s in power],
+                                [s[1:] for s in power])
         
-        usages = info.get('usages', [0]*8)
-        freqs = info.get('freqs', [0]*8)
-        for i in range(8):
-            self.cpu_usage_deques[i].append((elapsed_seconds, float(usages[i] if i < len(usages) else 0.0)))
-            self.cpu_freq_deques[i].append((elapsed_seconds, float(freqs[i] if i < len(freqs) else 0.0)))
-        
-        # === 优化数据记录：每秒记录一次平均值 ===
-        if not self.has_logged_data and sum(usages) > 0:
-            self.has_logged_data = True
+        usages = info.get('usages') or [0]*8
+        freqs = info.get('freqs') or [0]*8
+        if 'CPU' in updated:
+            self.append_history(self.snapshot_history, elapsed_seconds, [temp, mem, gpu] + [
+                float(usages[i] if i < len(usages) else 0.0) for i in range(8)] + [
+                float(freqs[i] if i < len(freqs) else 0.0) for i in range(8)])
         
-        if self.has_logged_data:
-            # 累积数据
-            acc = self.accumulated_data
-            acc['fps_sum'] += fps; acc['fps_count'] += 1
-            acc['temp_sum'] += temp; acc['temp_count'] += 1
-            acc['mem_sum'] += mem; acc['mem_count'] += 1
-            acc['gpu_sum'] += gpu; acc['gpu_count'] += 1
-            acc['power_sum'] += power_mW; acc['power_count'] += 1
-            acc['voltage_sum'] += voltageV; acc['voltage_count'] += 1
-            acc['current_sum'] += current_mA; acc['current_count'] += 1
-            acc['jank_sum'] += jank_increment
-            acc['big_jank_sum'] += big_jank_increment
-            
-            for i in range(8):
-                if i < len(usages):
-                    acc['cpu_usages'][i].append(usages[i])
-                if i < len(freqs):
-                    acc['cpu_freqs'][i].append(freqs[i])
-            
-            # 每秒写入一次数据
-            time_since_last_log = current_time - self.last_log_time
-            if time_since_last_log >= DATA_LOG_INTERVAL:
-                now = time.strftime("%H:%M:%S")
-                
-                # 计算平均值
-                avg_fps = acc['fps_sum'] / max(acc['fps_count'], 1)
-                avg_temp = acc['temp_sum'] / max(acc['temp_count'], 1)
-                avg_mem = acc['mem_sum'] / max(acc['mem_count'], 1)
-                avg_gpu = acc['gpu_sum'] / max(acc['gpu_count'], 1)
-                avg_power = acc['power_sum'] / max(acc['power_count'], 1)
-                avg_voltage = acc['voltage_sum'] / max(acc['voltage_count'], 1)
-                avg_current = acc['current_sum'] / max(acc['current_count'], 1)
-                
-                # CPU 平均值
-                avg_cpu_usages = [
-                    sum(acc['cpu_usages'][i]) / max(len(acc['cpu_usages'][i]), 1) 
-                    if acc['cpu_usages'][i] else 0.0
-                    for i in range(8)
-                ]
-                avg_cpu_freqs = [
-                    sum(acc['cpu_freqs'][i]) / max(len(acc['cpu_freqs'][i]), 1) 
-                    if acc['cpu_freqs'][i] else 0.0
-                    for i in range(8)
-                ]
-                
-                # 写入日志（使用累积的 Jank 值）
-                self.data_log.append([
-                    now, avg_fps, avg_temp, avg_mem, avg_gpu, 
-                    avg_power, avg_voltage, avg_current,
-                    acc['jank_sum'], acc['big_jank_sum']
-                ] + avg_cpu_usages + avg_cpu_freqs)
-                
-                # 重置累积数据
-                self.accumulated_data = {
-                    'fps_sum': 0, 'fps_count': 0,
-                    'temp_sum': 0, 'temp_count': 0,
-                    'mem_sum': 0, 'mem_count': 0,
-                    'gpu_sum': 0, 'gpu_count': 0,
-                    'power_sum': 0, 'power_count': 0,
-                    'voltage_sum': 0, 'voltage_count': 0,
-                    'current_sum': 0, 'current_count': 0,
-                    'jank_sum': 0, 'big_jank_sum': 0,
-                    'cpu_usages': [[] for _ in range(8)],
-                    'cpu_freqs': [[] for _ in range(8)]
-                }
-                # 更新 last_log_time，确保精确的 1 秒间隔
-                self.last_log_time += DATA_LOG_INTERVAL
-                
-                # 如果累积了太多延迟（超过 2 秒），重新同步
-                if current_time - self.last_log_time > 2.0:
-                    self.last_log_time = current_time
+        # === 数据记录：每秒写一行平均值，SUMMARY_WINDOW 结束时更新摘要 ===
+        if SUMMARY_WINDOW in self.summary.add(info, current_time, power):
+            self.summary_label.setText(self.summary.describe())
+
+    def append_history(self, history, t, values):
+        """写进即时用的环形缓冲与整个 session 的金字塔；t 为序列时表示一次加入多笔。"""
+        pyramid = self.pyramids[id(history)]
+        if isinstance(t, list):
+            history.extend(t, values)
+            pyramid.extend(t, values)
+        else:
+            history.append(t, values)
+            pyramid.append(t, values)
 
+    def on_view_changed(self, index):
+        self.view_span = self.view_combo.itemData(index)
+        # 切换区间后所有曲线整条重画
+        self.rendered_totals = {}
+        self.overview_state = None
+        self.update_display()
+
+    @TELEMETRY.timed("ui.update_display")
     def update_display(self):
-        if not self.metric_deques or not self.metric_deques[0]:
+        now = time.perf_counter()
+        if self.last_display_at is not None:
+            # 计时器晚到多少：主线程被别的事情（重绘、阻塞的呼叫）占住的时间
+            TELEMETRY.record("ui.timer_lag", max(0.0, now - self.last_display_at - UI_UPDATE_INTERVAL / 1000.0))
+        self.last_display_at = now
+        # 各图表的更新频率不同，取所有序列中最新的时间点
+        latest = [history.last_time for history in self.histories if len(history)]
+        if not latest:
             return
         
-        elapsed_seconds = self.metric_deques[0][-1][0]
+        elapsed_seconds = max(latest)
         
         # 监控时间标签已在 on_data_ready 中更新，这里不再重复更新
+        if self.view_span is not None:
+            self.update_overview(elapsed_seconds)
+            return
 
         divisor, label_format = (60.0, "%.2fm") if elapsed_seconds > 60 else (1.0, "%.0fs")
-
-        # 1. Standard Metrics (FPS, Temp, Mem, GPU)
-        for i, (series_obj, axisY, axisX) in enumerate(self.metric_series):
-            dq = self.metric_deques[i]
-            if not dq: continue
-            pts = [QPointF(px / divisor, py) for px, py in dq]
-            series_obj.replace(pts)
-            if pts:
-                self.metric_labels[i].setText(f"{pts[-1].y():.1f}")
-                maxy = max(p.y() for p in pts)
-                axisY.setRange(0, max(10.0, maxy * 1.2))
-                xmax = pts[-1].x()
+        if divisor != self.render_divisor:
+            # 时间轴单位改变（秒 -> 分），所有曲线整条重画一次
+            self.render_divisor = divisor
+            self.rendered_totals = {}
+
+        # 只处理上次之后有新资料的缓冲：新点直接 append，挤出缓冲的旧点从曲线开头移除
+        for history, group in self.chart_groups:
+            seen = self.rendered_totals.get(id(history))
+            if not len(history) or seen == history.total:
+                continue
+            full = seen is None or history.total - seen >= len(history)
+            self.rendered_totals[id(history)] = history.total
+            if full:
+                times, column = history.times(), history.column
+            else:
+                times, column = history.since(seen)
+            xs = (times / divisor).tolist()
+
+            for series_obj, name, label, fmt in group['series']:
+                pts = [QPointF(x, y) for x, y in zip(xs, column(name).tolist())]
+                if full:
+                    series_obj.replace(pts)
+                else:
+                    excess = series_obj.count() + len(pts) - len(history)
+                    if excess > 0:
+                        series_obj.removePoints(0, excess)
+                    series_obj.append(pts)
+                label.setText(fmt.format(history.last(name)))
+
+            # 座标轴：Y 轴用缓冲维护的最大值，X 轴跟着最新的点
+            for axisY, names, floor in group['y_axes']:
+                axisY.setRange(0, max(floor, max(history.max(name) for name in names) * 1.2))
+            xmax = history.last_time / divisor
+            for axisX in group['x_axes']:
                 axisX.setRange(max(0, xmax - (self.window_seconds/divisor)), xmax)
                 axisX.setLabelFormat(label_format)
 
-        # 2. Combined Power Metric
-        if self.power_deques['power']:
-            power_pts = [QPointF(px/divisor, py) for px, py in self.power_deques['power']]
-            self.power_series['power'].replace(power_pts)
-            self.power_labels['power'].setText(f"{power_pts[-1].y():.2f} mW")
-            self.power_axes['power_y'].setRange(0, max(500.0, max(p.y() for p in power_pts) * 1.2))
-            
-            voltage_pts = [QPointF(px/divisor, py) for px, py in self.power_deques['voltage']]
-            self.power_series['voltage'].replace(voltage_pts)
-            self.power_labels['voltage'].setText(f"{voltage_pts[-1].y():.3f} V")
-
-            current_pts = [QPointF(px/divisor, py) for px, py in self.power_deques['current']]
-            self.power_series['current'].replace(current_pts)
-            self.power_labels['current'].setText(f"{current_pts[-1].y():.2f} mA")
-            
-            # Update secondary Y-axis
-            if voltage_pts and current_pts:
-                 max_secondary = max(p.y() for p in voltage_pts + current_pts)
-                 self.power_axes['secondary_y'].setRange(0, max(10.0, max_secondary * 1.2))
-            
-            # Update shared X-axis
-            xmax = power_pts[-1].x()
-            self.power_axes['power_x'].setRange(max(0, xmax - (self.window_seconds/divisor)), xmax)
-            self.power_axes['power_x'].setLabelFormat(label_format)
-
-        def update_cpu_charts(series_list, deques, labels, unit):
-            for i, (series_obj, axisY, axisX) in enumerate(series_list):
-                dq = deques[i]
-                if not dq: continue
-                pts = [QPointF(px / divisor, py) for px, py in dq]
-                series_obj.replace(pts)
-                if pts:
-                    labels[i].setText(f"{pts[-1].y():.1f}{unit}")
-                    maxy = max(p.y() for p in pts)
-                    # Set a reasonable default max Y value
-                    default_max_y = 100 if '%' in unit else 2000 
-                    axisY.setRange(0, max(default_max_y, maxy * 1.2))
-                    xmax = pts[-1].x()
-                    axisX.setRange(max(0, xmax - (self.window_seconds/divisor)), xmax)
-                    axisX.setLabelFormat(label_format)
-
-        # 3. CPU Usage & 4. CPU Freq
-        update_cpu_charts(self.cpu_usage_series, self.cpu_usage_deques, self.cpu_usage_labels, "%")
-        update_cpu_charts(self.cpu_freq_series, self.cpu_freq_deques, self.cpu_freq_labels, " MHz")
+    def update_overview(self, elapsed_seconds):
+        """长时间区间：从金字塔取降采样后的点整条重画，每条曲线最多 OVERVIEW_POINTS 点，最多每秒一次。"""
+        totals = tuple(history.total for history in self.histories)
+        state = (self.view_span, totals)
+        if self.overview_state is not None:
+            if state == self.overview_state:
+                return  # 没有新资料
+            if time.monotonic() - self.last_overview_at < OVERVIEW_REFRESH:
+                return
+        self.overview_state = state
+        self.last_overview_at = time.monotonic()
+
+        t0 = max(0.0, elapsed_seconds - self.view_span) if self.view_span else 0.0
+        divisor, label_format = (60.0, "%.1fm") if elapsed_seconds - t0 > 60 else (1.0, "%.0fs")
+        for history, group in self.chart_groups:
+            if not len(history):
+                continue
+            names = [name for _, name, _, _ in group['series']]
+            times, values = self.pyramids[id(history)].window(t0, None, OVERVIEW_POINTS, names)
+            xs = (times / divisor).tolist()
+            for series_obj, name, label, fmt in group['series']:
+                series_obj.replace([QPointF(x, y) for x, y in zip(xs, values[name].tolist())])
+                label.setText(fmt.format(history.last(name)))
+            for axisY, columns, floor in group['y_axes']:
+                top = max((float(values[name].max()) for name in columns if len(values[name])), default=0.0)
+                axisY.setRange(0, max(floor, top * 1.2))
+            for axisX in group['x_axes']:
+                axisX.setRange(t0 / divisor, max(elapsed_seconds, t0 + 1) / divisor)
+                axisX.setLabelFormat(label_format)
 
     def export_csv(self):
-        if not self.data_log:
+        if not self.session_log or not self.session_log.rows:
             QMessageBox.information(self, "導出", "沒有可導出的資料。")
             return
+        if self.export_thread:
+            return
         path, _ = QFileDialog.getSaveFileName(self, "儲存CSV", "", "CSV 檔案 (*.csv)")
         if path:
-            with open(path, 'w', newline='', encoding="utf-8-sig") as f:
-                writer = csv.writer(f)
-                header = ["Time", "FPS", "Temp", "Mem", "GPU(%)", "Power(mW)", "Voltage(V)", 
-                          "Current(mA)", "Jank", "Big Jank"] + \
-                         [f"CPU{i}%" for i in range(8)] + \
-                         [f"Core{i}(MHz)" for i in range(8)]
-                writer.writerow(header)
-                writer.writerows(self.data_log)
-            QMessageBox.information(self, "導出成功", "CSV 檔案已儲存。")
+            # 资料已在磁碟上，只需合并分档；在背景合并，不卡住视窗与图表
+            self.export_btn.setEnabled(False)
+            self.statusBar().showMessage("導出中…")
+            self.export_thread = ExportThread(self.session_log, path)
+            self.export_thread.done.connect(self.on_export_done)
+            self.export_thread.start()
+
+    def on_export_done(self, error):
+        session_log = self.export_thread.session_log
+        self.export_thread.wait()
+        self.export_thread = None
+        self.export_btn.setEnabled(True)
+        self.statusBar().showMessage("導出失敗" if error else "CSV 已導出", 5000)
+        if error:
+            QMessageBox.warning(self, "導出失敗", f"無法寫入 CSV: {error}")
+            return
+        note = f"\n（較早的 {session_log.dropped_parts} 個分檔已輪替刪除）" if session_log.dropped_parts else ""
+        QMessageBox.information(self, "導出成功", f"CSV 檔案已儲存。{note}\n完整記錄: {session_log.path}")
+
+    def toggle_diagnostics(self, visible):
+        self.diagnostics_panel.setVisible(visible)
+        if visible:
+            self.refresh_diagnostics()
+            self.diagnostics_timer.start()
+        else:
+            self.diagnostics_timer.stop()
+
+    def toggle_tracemalloc(self, enabled):
+        if enabled:
+            TELEMETRY.start_memory_trace()
+        else:
+            TELEMETRY.stop_memory_trace()
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        report = TELEMETRY.snapshot()
+        rows = list(report['histograms'].items())
+        self.diagnostics_table.setRowCount(len(rows))
+        for r, (name, h) in enumerate(rows):
+            cells = [name, str(h['count']), str(h['errors'])] + [
+                f"{h[key]:.2f}" for key in ('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'last_ms')]
+            for c, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if c:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.diagnostics_table.setItem(r, c, item)
+
+        mem = report['memory']
+        parts = []
+        if mem['rss_mb'] is not None:
+            growth = f" (+{mem['rss_growth_mb']:.1f})" if mem['rss_growth_mb'] is not None else ""
+            parts.append(f"RSS: {mem['rss_mb']:.1f} MB{growth}，峰值 {mem['rss_peak_mb']:.1f} MB")
+        if mem['tracemalloc']:
+            parts.append(f"tracemalloc: {mem['traced_mb']:.1f} MB (+{mem['traced_growth_mb']:.1f})，"
+                         f"峰值 {mem['traced_peak_mb']:.1f} MB")
+        if report['counters']:
+            parts.append("計數: " + "，".join(f"{k}={v}" for k, v in report['counters'].items()))
+        self.diagnostics_label.setText("　".join(parts))
+
+    def export_diagnostics(self):
+        path, _ = QFileDialog.getSaveFileName(self, "儲存診斷資料", "", "JSON 檔案 (*.json)")
+        if path:
+            TELEMETRY.export(path)
+            QMessageBox.information(self, "導出成功", "診斷資料已儲存。")
 
     def closeEvent(self, event):
         self.stop_monitoring()
+        if self.setup_thread:
+            self.setup_thread.wait()
+        if self.export_thread:
+            self.export_thread.wait()
         try:
             per.run_adb_command(["disconnect"])
-            per.uninstall_service()
+            if UNINSTALL_ON_EXIT:
+                per.uninstall_service()
+            if hasattr(per, 'close_shell_sessions'):
+                per.close_shell_sessions()
         except Exception as e:
             print(f"清理過程中發生例外: {e}")
         event.accept()
@@ -1,17 +1,31 @@
+import hashlib
+import math
 import re
 import subprocess
 import time
-from subprocess import Popen, PIPE
+from subprocess import PIPE
 import requests
+import numpy as np
 import json
 import os
+import queue
+import tempfile
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List
+
+from telemetry import TELEMETRY
 # ========== ADB Utility Functions ==========
-CREATE_NO_WINDOW = 0x08000000
+# CREATE_NO_WINDOW 只在 Windows 上有效，其他平台传入非 0 值会让 subprocess 直接报错
+CREATE_NO_WINDOW = 0x08000000 if os.name == "nt" else 0
 APK_PATH = "./app-debug.apk"  
 PACKAGE_NAME = "com.example.batteryapi"
 SERVICE_CLASS = "com.example.batteryapi/com.example.batteryapi.BatteryService"
 PORT = 8080
-# 1. 尝试从环境变量中获取（如果用户设置了）
+# 1. 尝试从环境变量中获取（如果用户设置了）；没有手机时可指到 fake_adb.py 做离线测试
 ADB_EXEC = os.environ.get("ADB_EXEC_PATH")
 
 # 2. 如果未设置，则假设 adb.exe 位于当前目录或 PATH 中（用于开发环境）
@@ -21,13 +35,227 @@ if not ADB_EXEC:
     # 我们假设 adb.exe 与 .exe 位于同一目录下
     # 如果 adb.exe 在 PATH 中，则直接使用 "adb"
     ADB_EXEC = "adb"
+
+# 是否让 `adb shell ...` 指令走长驻的 shell 会话（设为 0 可退回每次 spawn 一个 adb 进程）
+USE_SHELL_SESSION = os.environ.get("PER_SHELL_SESSION", "1") != "0"
+ADB_TIMEOUT = 5
+
+# ========== 录制 / 回放（见 session_archive.py） ==========
+# RECORDER：把每次 adb 指令输出、串流行与 HTTP 回应连同时间写进 session 档
+# REPLAY：不碰设备，改由录好的 session 档提供上述原始输出，解析与分析流程完全相同
+RECORDER = None
+REPLAY = None
+
+
+def now():
+    """采集时间戳的时间来源；回放时换成录制当时的时间。"""
+    if REPLAY is not None:
+        return REPLAY.clock()
+    return time.time()
+
+
+# ========== 多设备：adb 呼叫与 collector 都可以指定 serial ==========
+# serial 为 None 时不加 -s，交给 adb 自己决定（ANDROID_SERIAL 或唯一一台设备），与旧版相同。
+# 录制 / 回放的 session 档只对应一台设备，指令一律以不含 -s 的形式记录与比对。
+def adb_target(serial=None):
+    return ["-s", serial] if serial else []
+
+
+def parse_devices(output):
+    """`adb devices` 中状态为 device 的序号（略过 offline / unauthorized）。"""
+    serials = []
+    for line in output.splitlines():
+        # 标题行（List of devices attached）与 adb server 启动讯息（* daemon ...）都不会是 "<serial> device"
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == "device":
+            serials.append(parts[0])
+    return serials
+
+
+def list_devices():
+    return parse_devices(_run_adb_command(["devices"]))
+
+
+class AdbShellError(Exception):
+    pass
+
+
+class AdbShell:
+    """
+    长驻的 `adb shell` 会话，所有 shell 指令共用同一个远端 shell，
+    省掉每次 fork adb client + 在设备上重开 shell 的开销。
+    每条指令的 stdout、stderr 用 sentinel 分开包起来并带回 exit code；
+    设备断线（adb 进程退出）时会自动重连一次。可被多个线程共用。
+    """
+
+    def __init__(self, timeout=ADB_TIMEOUT, serial=None):
+        self.timeout = timeout
+        self.serial = serial
+        self._lock = threading.Lock()
+        self._proc = None
+        self._lines = None
+        self._seq = 0
+        self._marker = f"__PER_{uuid.uuid4().hex[:8]}_"
+
+    def _connect(self):
+        self._proc = subprocess.Popen([ADB_EXEC] + adb_target(self.serial) + ["shell"], stdin=PIPE, stdout=PIPE,
+                                      stderr=subprocess.STDOUT, creationflags=CREATE_NO_WINDOW)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._reader, args=(self._proc.stdout, self._lines), daemon=True).start()
+
+    @staticmethod
+    def _reader(stream, lines):
+        # 读线程：逐行搬进 queue，EOF 时放一个 None 通知会话已断开
+        for raw in iter(stream.readline, b""):
+            lines.put(raw.decode("utf-8", errors="ignore").rstrip("\r\n"))
+        lines.put(None)
+
+    def _alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(timeout=1)
+            except Exception:
+                pass
+        self._proc = None
+        self._lines = None
+
+    def execute(self, cmd, timeout=None):
+        """
+        在会话中执行一条 shell 指令，返回 (exit_code, stdout, stderr)。
+        与 `adb shell <cmd>` 的 subprocess 版本相同，stdout 不含 stderr 的内容（解析函式只看到 stdout）。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            for attempt in range(2):
+                if not self._alive():
+                    self._kill()
+                    self._connect()
+                try:
+                    return self._roundtrip(cmd, timeout)
+                except EOFError:
+                    # 设备断线或 adb server 重启：丢掉旧会话，重连后再试一次
+                    self._kill()
+                    if attempt == 1:
+                        raise AdbShellError("adb shell 会话已断开")
+
+    def _roundtrip(self, cmd, timeout):
+        self._seq += 1
+        begin = f"{self._marker}B{self._seq}"
+        separator = f"{self._marker}S{self._seq}"
+        end = f"{self._marker}E{self._seq}"
+        # stdout 直接经 fd 3 输出，stderr 存进变数，在 separator 之后才输出；切断 stdin 以免吃掉会话的输入。
+        # 指令在 $( ) 的 subshell 中执行，其中的 exit 也不会结束会话
+        script = (f"echo {begin}\n"
+                  f"{{ __per_err=$({{ {cmd}\n}} 2>&1 1>&3 </dev/null); }} 3>&1\n"
+                  f"__per_code=$?\necho {separator}\nprintf '%s\\n' \"$__per_err\"\necho \"{end} $__per_code\"\n")
+        try:
+            self._proc.stdin.write(script.encode("utf-8"))
+            self._proc.stdin.flush()
+        except OSError:
+            raise EOFError
+
+        deadline = time.time() + timeout
+        started = False
+        out = []
+        err = None  # separator 之后为 stderr
+        while True:
+            remaining = deadline - time.time()
+            try:
+                line = self._lines.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                # 指令卡住：砍掉会话，下一条指令会重新连线
+                self._kill()
+                raise AdbShellError(f"adb shell 指令逾时: {cmd}")
+            if line is None:
+                raise EOFError
+            if not started:
+                # 丢掉 begin 之前的残留输出
+                started = line == begin
+                continue
+            if err is None:
+                idx = line.find(separator)
+                if idx >= 0:
+                    # 指令输出结尾没有换行时，separator 会接在同一行后面
+                    if idx > 0:
+                        out.append(line[:idx])
+                    err = []
+                else:
+                    out.append(line)
+                continue
+            if line.startswith(end):
+                code = line[len(end):].strip()
+                return (int(code) if code.isdigit() else -1), "\n".join(out), "\n".join(err)
+            err.append(line)
+
+
+# 会话池：多个采集线程可以同时各用一个会话，而不是排队等同一个 shell。
+# 每台设备（serial）各自一个池，各自最多 MAX_SHELL_SESSIONS 个会话
+MAX_SHELL_SESSIONS = 4
+_idle_sessions = {}  # serial -> 闲置的会话
+_session_count = {}  # serial -> 已建立的会话数
+_session_cond = threading.Condition()
+
+
+@contextmanager
+def shell_session(serial=None):
+    with _session_cond:
+        idle = _idle_sessions.setdefault(serial, [])
+        while not idle and _session_count.get(serial, 0) >= MAX_SHELL_SESSIONS:
+            _session_cond.wait()
+        if idle:
+            session = idle.pop()
+        else:
+            session = AdbShell(serial=serial)
+            _session_count[serial] = _session_count.get(serial, 0) + 1
+    try:
+        yield session
+    finally:
+        with _session_cond:
+            idle.append(session)
+            # 不同设备的等待者共用同一个 Condition，全部叫醒各自再检查
+            _session_cond.notify_all()
+
+
+def close_shell_sessions(serial=None):
+    # 只关闭闲置的会话进程；会话物件保留，下次执行时会自动重连。serial 为 None 时关闭所有设备的。
+    # 采集结束时（DataPipeline 结束、主视窗关闭）呼叫
+    with _session_cond:
+        for key, idle in _idle_sessions.items():
+            if serial is None or key == serial:
+                for session in idle:
+                    session.close()
+
+
 def run(cmd):
     return subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT).decode("utf-8", errors="ignore")
-def run_adb_command(cmd):
+def run_adb_command(cmd, serial=None):
+    if REPLAY is not None:
+        return REPLAY.adb(cmd)
+    started = time.time()
+    output = _run_adb_command(cmd, serial)
+    # 计入 adb 耗时直方图；失败（非 0 结束、找不到 adb）记为错误
+    TELEMETRY.record("adb", time.time() - started,
+                     error=output.startswith(("ERROR_CODE:", "ADB_NOT_FOUND")), scoped=True, device=serial)
+    if RECORDER is not None:
+        RECORDER.record_adb(cmd, output, started)
+    return output
+
+
+def _run_adb_command(cmd, serial=None):
+    if USE_SHELL_SESSION and len(cmd) > 1 and cmd[0] == "shell":
+        return _run_in_session(cmd[1:], serial)
     try:
-        # 将 ADB_EXEC 加入命令列表头部
-        full_cmd = [ADB_EXEC] + cmd 
-        result = subprocess.run(full_cmd, capture_output=True, text=True, encoding="utf-8", timeout=5, creationflags=CREATE_NO_WINDOW)
+        # 将 ADB_EXEC（与 -s serial）加入命令列表头部
+        full_cmd = [ADB_EXEC] + adb_target(serial) + cmd 
+        result = subprocess.run(full_cmd, capture_output=True, text=True, encoding="utf-8", timeout=ADB_TIMEOUT, creationflags=CREATE_NO_WINDOW)
         
         # 即使 returncode != 0，也返回 stderr/stdout 以便调试
         if result.returncode == 0:
@@ -42,8 +270,38 @@ def run_adb_command(cmd):
         return "ADB_NOT_FOUND" # 统一返回一个特殊的错误标志
     except Exception:
         return ""
-def get_device_name():
-    return run_adb_command(["shell", "getprop", "ro.product.model"])
+
+
+def open_stream(args, serial=None):
+    """
+    长时间的 adb 串流（exec-out logcat、设备端采样脚本），回传有 stdout/poll/kill/wait 的行程物件。
+    录制时 stdout 的每一行都会写进 session 档；回放时由 REPLAY 依录制时间送出同样的行。
+    """
+    if REPLAY is not None:
+        return REPLAY.stream(args)
+    proc = subprocess.Popen([ADB_EXEC] + adb_target(serial) + args, stdout=PIPE, stderr=subprocess.DEVNULL,
+                            creationflags=CREATE_NO_WINDOW)
+    if RECORDER is not None:
+        proc.stdout = RECORDER.tap_stream(args, proc.stdout)
+    return proc
+
+
+def _run_in_session(args, serial=None):
+    # 与 adb shell 相同，多个参数以空格拼接后交给远端 shell 解析
+    try:
+        with shell_session(serial) as session:
+            code, output, error = session.execute(" ".join(args))
+    except FileNotFoundError:
+        print(f"\n❌ [严重错误] 找不到 ADB 可执行文件！请确认 ADB_EXEC 变量设置正确：{ADB_EXEC}")
+        return "ADB_NOT_FOUND"
+    except Exception:
+        return ""
+    if code == 0:
+        return output.strip()
+    # 与 subprocess 版本相同：失败时优先附上 stderr
+    return f"ERROR_CODE:{code}::{error.strip() or output.strip()}"
+def get_device_name(serial=None):
+    return run_adb_command(["shell", "getprop", "ro.product.model"], serial)
 
 def enable_wifi_debug():
     # 先抓 IP
@@ -80,25 +338,103 @@ def get_wifi_ip():
                     return part
     return ""
 
-def get_foreground_app():
-    output = run_adb_command(["shell", "dumpsys", "activity", "activities"])
+# 在设备端先用 grep 过滤，只传回 resumed activity 那一行，而不是整份 dumpsys 输出
+FOREGROUND_QUERY = 'dumpsys activity activities | grep -m1 -E "^ *(m|top)?ResumedActivity"'
+# 会触发前景变化的 events log tag（不同 Android 版本名称不同）
+FOCUS_EVENT_TAGS = ["am_on_resume_called", "wm_on_resume_called", "wm_on_top_resumed_gained_called"]
+
+
+@TELEMETRY.timed("parse.activity")
+def parse_resumed_activity(output):
     for line in output.splitlines():
         line = line.strip()
-        if line.startswith("ResumedActivity"):
+        if "ResumedActivity" in line:
             parts = line.split()
             for part in parts:
                 if "/" in part:
-                    return part.split("/")[0]
+                    return part.split("/")[0].split("{")[-1]
     return ""
 
-def get_surfaceflinger_target_layer(package):
+
+def get_foreground_app(serial=None):
+    return parse_resumed_activity(run_adb_command(["shell", FOREGROUND_QUERY], serial))
+
+
+class ForegroundAppDetector:
+    """
+    前景应用侦测。结果会缓存 ttl 秒；开启 watch 模式后改由 `logcat -b events` 的 resume 事件驱动，
+    只有事件发生时才重新查询，应用真的改变时才通知 listener(old, new)（例如让 layer 缓存失效）。
+    """
+
+    def __init__(self, ttl=2.0, serial=None):
+        self.ttl = ttl
+        self.serial = serial
+        self.package = ""
+        self.checked_at = 0.0
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._watch_proc = None
+        self._dirty = True
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    @property
+    def watching(self):
+        proc = self._watch_proc
+        return proc is not None and proc.poll() is None
+
+    def get(self, force=False):
+        with self._lock:
+            fresh = not self._dirty if self.watching else time.time() - self.checked_at < self.ttl
+            if fresh and not force:
+                return self.package
+            self._dirty = False
+            old, self.package = self.package, get_foreground_app(self.serial)
+            self.checked_at = time.time()
+            new = self.package
+        if new != old:
+            for callback in self.listeners:
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    print(f"[ForegroundAppDetector] listener error: {e}")
+        return new
+
+    def start_watch(self):
+        if self.watching:
+            return
+        # -T 1：只从最新一笔开始，之后持续输出新的事件
+        self._watch_proc = open_stream(["exec-out", "logcat", "-b", "events", "-T", "1", "-s"] + FOCUS_EVENT_TAGS,
+                                       self.serial)
+        threading.Thread(target=self._watch_loop, args=(self._watch_proc,), daemon=True).start()
+
+    def _watch_loop(self, proc):
+        for raw in iter(proc.stdout.readline, b""):
+            if raw.strip():
+                self._dirty = True
+                self.get()
+
+    def stop_watch(self):
+        proc, self._watch_proc = self._watch_proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=1)
+            except Exception:
+                pass
+
+def get_surfaceflinger_target_layer(package, serial=None):
     """
     從 'adb shell dumpsys SurfaceFlinger --list' 的輸出中，
     找到指定 package 的最後一個 SurfaceView layer。
     此函式可以處理 layer 名稱前面包含可選十六進位前綴的情況。
     """
-    output = run_adb_command(["shell", "dumpsys", "SurfaceFlinger", "--list"])
-    
+    return parse_target_layer(run_adb_command(["shell", "dumpsys", "SurfaceFlinger", "--list"], serial), package)
+
+
+@TELEMETRY.timed("parse.layers")
+def parse_target_layer(output, package):
     pattern = rf"(?:[0-9a-fA-F]+\s+)?SurfaceView\[{re.escape(package)}/[^\]]+\]\(BLAST\)#\d+"
 
     matches = []
@@ -114,231 +450,744 @@ def get_surfaceflinger_target_layer(package):
 
 
 
-def get_refresh_rate():
-    output = run_adb_command(['shell', 'dumpsys SurfaceFlinger | grep "refresh-rate"'])
+def parse_refresh_rate(output):
     match = re.search(r'refresh-rate\s*:\s*([\d.]+)\s*Hz', output)
     if match:
         return float(match.group(1))
     return 60.0  # fallback 預設為 60Hz
 
+def get_refresh_rate(serial=None):
+    return parse_refresh_rate(run_adb_command(['shell', 'dumpsys SurfaceFlinger | grep "refresh-rate"'], serial))
+
+INVALID_TIMESTAMP = 9223372036854775807  # INT64_MAX，SurfaceFlinger 用来表示尚未显示的帧
+
+
+@TELEMETRY.timed("parse.latency")
+def parse_latency(output):
+    """
+    解析 `dumpsys SurfaceFlinger --latency <layer>` 的输出。
+    第一行是刷新周期 (ns)，之后每行为 desired-present / actual-present / frame-ready 三个时间戳。
+    返回 (refresh_period_ns, triplets)，无效的行会被过滤掉。
+    """
+    refresh_period_ns = 0
+    triplets = []
+    lines = output.splitlines()
+    if lines and lines[0].strip().isdigit():
+        refresh_period_ns = int(lines[0].strip())
+        lines = lines[1:]
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        try:
+            a, b, c = int(parts[0]), int(parts[1]), int(parts[2])
+        except ValueError:
+            continue
+        # 过滤无效数据（与原 dump_layer_stats 逻辑一致）
+        if b < INVALID_TIMESTAMP and b != 0:
+            triplets.append((a, b, c))
+    return refresh_period_ns, triplets
+
+
+def latency_rows(output):
+    """`--latency` 输出的原始帧行数，包括被 parse_latency 过滤掉的行（尚未显示、时间戳为 0）。"""
+    lines = [line for line in output.splitlines() if line.strip()]
+    if lines and lines[0].strip().isdigit():
+        lines = lines[1:]
+    return len(lines)
+
+
+def dump_latency(layer_name, serial=None):
+    return run_adb_command(["shell", "dumpsys", "SurfaceFlinger", "--latency", f'"{layer_name}"'], serial)
+
+
 def get_vsync_triplets(layer_name):
     """
     获取指定 layer 的 VSync triplets 数据
-    直接复用 dump_layer_stats 的逻辑，但返回完整的 triplets
     返回格式: [(a, b, c), (a, b, c), ...]
     """
     if not layer_name:
         return []
     
-    # 使用与 dump_layer_stats 相同的命令格式
-    cmd = f'adb shell dumpsys SurfaceFlinger --latency \\"{layer_name}\\"'
-    
     try:
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, 
-                  universal_newlines=True, creationflags=CREATE_NO_WINDOW)
-        
-        triplets = []
-        line_count = 0
-        
-        for line in p.stdout:
-            line_count += 1
-            line = line.strip()
-            
-            if line == '':
-                continue
-            
-            # 第一行是刷新周期，跳过
-            if line_count == 1:
-                continue
-            
-            parts = line.split('\t')
-            
-            try:
-                if len(parts) >= 3:
-                    a = int(parts[0])
-                    b = int(parts[1])
-                    c = int(parts[2])
-                    
-                    # 过滤无效数据（与原 dump_layer_stats 逻辑一致）
-                    if b < 9223372036854775807 and b != 0:
-                        triplets.append((a, b, c))
-                        
-                        # 打印前几个样本用于调试
-            except (ValueError, IndexError) as e:
-                if line_count <= 5:
-                    print(f"[DEBUG] Failed to parse line {line_count}: '{line}', error: {e}")
-                pass        
-        return triplets
-        
+        return parse_latency(dump_latency(layer_name))[1]
     except Exception as e:
         print(f"[ERROR] get_vsync_triplets failed: {e}")
         import traceback
         traceback.print_exc()
         return []
 
-def calculate_jank_by_vsync_triplets(triplets, refresh_period_ns):
+# ========== 向量化的帧分析 ==========
+NS_PER_SEC = 1_000_000_000
+JANK_VSYNCS = 2  # 帧时间超过 2 个 VSync 周期算 Jank
+BIG_JANK_VSYNCS = 3  # 超过 3 个 VSync 周期算 Big Jank
+JANK_LOOKBACK = 4  # 与前三帧平均值比较，需要前 4 个时间戳
 
-    jank_count = 0
-    big_jank_count = 0
 
-    display_timestamps = [t[2] for t in triplets if len(t) == 3 and t[2] > 0]
+@dataclass
+class FrameAnalysis:
+    jank: int
+    big_jank: int
+    frame_times_ns: np.ndarray  # 相邻两帧 actual-present 的间隔
+    pacing_error_ns: np.ndarray  # actual-present 相对 desired-present 的延迟
+    context: np.ndarray  # 最后几个显示时间戳，交给下一批当 look-back
 
-    if len(display_timestamps) < 4:
-        return 0, 0
+    @property
+    def mean_pacing_error_ms(self):
+        return float(self.pacing_error_ns.mean()) / 1e6 if self.pacing_error_ns.size else 0.0
 
-    JANK_THRESHOLD_NS = (1000 / 60 * 2) * 1_000_000  # 83.33ms
-    BIG_JANK_THRESHOLD_NS = (1000 / 60 * 3) * 1_000_000  # 125ms
+    @property
+    def max_pacing_error_ms(self):
+        return float(self.pacing_error_ns.max()) / 1e6 if self.pacing_error_ns.size else 0.0
 
-    for i in range(3, len(display_timestamps)):
-        current_frame_time = display_timestamps[i] - display_timestamps[i - 1]
-        
-        prev_frame_times = [
-            display_timestamps[i - 1] - display_timestamps[i - 2],
-            display_timestamps[i - 2] - display_timestamps[i - 3],
-            display_timestamps[i - 3] - display_timestamps[i - 4]
-        ]
-        avg_prev_three_frames = sum(prev_frame_times) / 3
-        condition1_jank = current_frame_time > (avg_prev_three_frames * 2)
-        condition2_jank = current_frame_time > JANK_THRESHOLD_NS
-        
-        if condition1_jank and condition2_jank:
-            jank_count += 1
-            condition2_big_jank = current_frame_time > BIG_JANK_THRESHOLD_NS
-            if condition1_jank and condition2_big_jank:
-                big_jank_count += 1
 
-    return jank_count, big_jank_count
+@TELEMETRY.timed("analyze_frames")
+def analyze_frames(triplets, refresh_period_ns=None, context=(), prev_present=None):
+    """
+    对整批 triplets 一次性计算 Jank / Big Jank、帧间隔与 pacing 误差。
+    triplets 可以是 [(a, b, c), ...] 或 (N, 3) 的 int64 ndarray（批量重新分析时避免转换）。
+    阈值按实际刷新周期缩放；context 为上一批最后几个显示时间戳，prev_present 为上一批最后一帧的
+    actual-present，两者都用来让本批开头的帧也能被计算。
+    """
+    frames = np.asarray(triplets, dtype=np.int64).reshape(-1, 3)
+    period = refresh_period_ns or NS_PER_SEC / 60
+    jank_threshold = period * JANK_VSYNCS
+    big_jank_threshold = period * BIG_JANK_VSYNCS
 
-def dump_layer_stats(layer_name):
-    cmd = f'adb shell dumpsys SurfaceFlinger --latency \\"{layer_name}\\"'
-    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True,creationflags=CREATE_NO_WINDOW)
-    L = []
+    display = frames[:, 2]
+    display = display[display > 0]
+    context = np.asarray(context, dtype=np.int64)
+    timestamps = np.concatenate([context, display])
 
-    for line in p.stdout:
-        if line.strip() != '':
-            parts = line.strip().split('\t')
-            try:
-                ints = list(map(int, parts))
-                if len(ints) > 1 and ints[1] < 9223372036854775807 and ints[1] != 0:
-                    L.append(ints[1])
-            except:
-                pass
-    return L
+    jank_count = big_jank_count = 0
+    if timestamps.size > JANK_LOOKBACK:
+        # 第 i 帧 (i >= 4)：当前帧时间与前三帧的平均帧时间比较；context 中的帧上一批已判定过
+        current = timestamps[JANK_LOOKBACK:] - timestamps[JANK_LOOKBACK - 1:-1]
+        avg_prev_three = (timestamps[JANK_LOOKBACK - 1:-1] - timestamps[:-JANK_LOOKBACK]) / 3
+        start = max(0, context.size - JANK_LOOKBACK)
+        current = current[start:]
+        avg_prev_three = avg_prev_three[start:]
+        jank = (current > avg_prev_three * 2) & (current > jank_threshold)
+        jank_count = int(np.count_nonzero(jank))
+        big_jank_count = int(np.count_nonzero(jank & (current > big_jank_threshold)))
 
-def get_fps(package):
-    layer_name = get_surfaceflinger_target_layer(package)
-    # print(layer_name)
-    if not layer_name:
-        return -1
-    L = dump_layer_stats(layer_name)
-    size = len(L)
+    present = frames[:, 1]
+    if prev_present is not None and present.size:
+        frame_times = np.diff(present, prepend=prev_present)
+    else:
+        frame_times = np.diff(present)
+    desired = frames[:, 0]
+    valid = desired > 0
+    pacing_error = present[valid] - desired[valid]
+
+    return FrameAnalysis(
+        jank=jank_count,
+        big_jank=big_jank_count,
+        frame_times_ns=frame_times,
+        pacing_error_ns=pacing_error,
+        context=timestamps[-JANK_LOOKBACK:],
+    )
+
+
+def calculate_jank_by_vsync_triplets(triplets, refresh_period_ns):
+    analysis = analyze_frames(triplets, refresh_period_ns)
+    return analysis.jank, analysis.big_jank
+
+def dump_layer_stats(layer_name):
+    return [t[1] for t in parse_latency(dump_latency(layer_name))[1]]
+
+def calculate_fps(present_times):
+    size = len(present_times)
     if size == 0:
         return -1
-    interval = L[-1] - L[0]
+    interval = present_times[-1] - present_times[0]
     if interval == 0:
         return -1
     fps = 1_000_000_000 * (size - 1) / interval
     return round(fps)
 
+def get_fps(package):
+    layer_name = get_surfaceflinger_target_layer(package)
+    # print(layer_name)
+    if not layer_name:
+        return -1
+    return calculate_fps(dump_layer_stats(layer_name))
 
-def get_cpu_usage_and_freq():
-    output = run_adb_command(["shell", "cat", "/proc/stat"])
-    lines = output.splitlines()
-    current_totals, current_idles = [], []
-    for line in lines:
+
+LATENCY_HISTORY = 127  # SurfaceFlinger --latency 最多保留的帧数
+
+
+class FrameTimeline:
+    """
+    把连续几次 `--latency` 视窗按 actual-present 时间戳拼成一条帧时间线（有上限的 ring buffer）。
+    若视窗已满且最旧一帧仍晚于上次最后一帧，表示两次 poll 之间有帧已被 SurfaceFlinger 丢掉，
+    记为一个 gap。视窗是否已满以来源的原始行数判断（过滤掉的行也占用来源的缓冲）。
+    gap_count / lost_ns / covered_ns 为整个 session 的累积值（换 layer 时 reset() 也不清除）。
+    """
+
+    def __init__(self, maxlen=4096):
+        self.frames = deque(maxlen=maxlen)
+        self.gaps = deque(maxlen=256)  # 最近的 (gap 起点, gap 终点) ns
+        self.gap_count = 0
+        self.lost_ns = 0
+        self.covered_ns = 0  # 时间线涵盖的总长度（含 gap）
+
+    def reset(self):
+        self.frames.clear()
+
+    @property
+    def last_present(self):
+        return self.frames[-1][1] if self.frames else None
+
+    @property
+    def lost_percent(self):
+        """gap 占时间线的比例 (%)，即漏掉、没有判定 Jank 的时间。"""
+        return self.lost_ns / self.covered_ns * 100 if self.covered_ns else 0.0
+
+    def merge(self, triplets, history=LATENCY_HISTORY, rows=None):
+        """合并一个视窗，返回 (新帧, 是否有 gap)。history 为来源最多保留的帧数，rows 为这次的原始行数（预设为 len(triplets)）。"""
+        rows = len(triplets) if rows is None else rows
+        last_present = self.last_present
+        if last_present is None:
+            new = list(triplets)
+            gap = False
+        else:
+            new = [t for t in triplets if t[1] > last_present]
+            gap = bool(new) and rows >= history and triplets[0][1] > last_present
+            if gap:
+                self.gaps.append((last_present, new[0][1]))
+                self.gap_count += 1
+                self.lost_ns += new[0][1] - last_present
+        if new:
+            self.covered_ns += new[-1][1] - (new[0][1] if last_present is None else last_present)
+        self.frames.extend(new)
+        return new, gap
+
+
+class JankDetector:
+    """
+    跨 poll 的 Jank 判定：把上一批最后几个显示时间戳当作 look-back，
+    每批的开头几帧也能被判定。
+    """
+
+    def __init__(self):
+        self.context = np.empty(0, dtype=np.int64)
+        self.prev_present = None
+
+    def reset(self):
+        self.context = np.empty(0, dtype=np.int64)
+        self.prev_present = None
+
+    def feed(self, triplets, refresh_period_ns=None):
+        analysis = analyze_frames(triplets, refresh_period_ns, self.context, self.prev_present)
+        self.context = analysis.context
+        if len(triplets):
+            self.prev_present = int(triplets[-1][1])
+        return analysis
+
+
+@dataclass
+class FrameStats:
+    fps: float
+    jank: int
+    big_jank: int
+    layer: str
+    refresh_period_ns: int
+    new_frames: int = 0
+    gap: bool = False  # 这次 poll 与上次之间有帧已被来源丢掉
+    gaps: int = 0  # 以下为累积值：gap 次数、遗失的时间 (ms) 与占比 (%)
+    lost_ms: float = 0.0
+    lost_pct: float = 0.0
+    frame_times_ns: np.ndarray = None
+    pacing_error_ms: float = 0.0
+    source: str = "surfaceflinger"
+
+
+FRAME_SOURCE_RETRY = 5  # 连续几次 poll 取不到帧资料，才重新查 layer（`--list`）与选择帧来源
+
+
+class SurfaceFlingerFrameSource:
+    """
+    `dumpsys SurfaceFlinger --latency` 帧来源，只适用于有 SurfaceView(BLAST) layer 的应用。
+    每个 package 解析出的 layer 名称会缓存；画面静止时取回空资料也沿用，
+    连续 FRAME_SOURCE_RETRY 次都取不到才由 FrameStatsCollector 让它失效、重新查 `--list`。
+    """
+
+    name = "surfaceflinger"
+    history = LATENCY_HISTORY
+
+    def __init__(self, serial=None):
+        self.serial = serial
+        self.layers = {}  # package -> layer name
+
+    def resolve_layer(self, package, refresh=False):
+        if refresh or package not in self.layers:
+            self.layers[package] = get_surfaceflinger_target_layer(package, self.serial)
+        return self.layers[package]
+
+    def fetch(self, package):
+        """
+        回传 (layer, refresh_period_ns, triplets, 原始行数)；找不到 layer 或 adb 失败时 triplets 为 None。
+        """
+        layer = self.resolve_layer(package)
+        if not layer:
+            return layer, 0, None, 0
+        output = dump_latency(layer, self.serial)
+        if not output or output.startswith(("ERROR_CODE", "ADB_NOT_FOUND")):
+            return layer, 0, None, 0
+        refresh_period_ns, triplets = parse_latency(output)
+        return layer, refresh_period_ns, triplets, latency_rows(output)
+
+
+GFXINFO_HISTORY = 120  # gfxinfo framestats 最多保留的帧数
+
+
+@TELEMETRY.timed("parse.gfxinfo")
+def parse_gfxinfo_framestats(output):
+    """
+    解析 `dumpsys gfxinfo <pkg> framestats` 中的 ---PROFILEDATA--- CSV 区块，
+    转成与 --latency 相同的 (desired-present, actual-present, frame-ready) triplets。
+    actual-present 优先用 DisplayPresentTime（Android 12+），否则用 FrameCompleted。
+    Flags 非 0 的帧（例如 window 刚建立时的首帧）会被略过。返回 (refresh_period_ns, triplets)。
+    """
+    refresh_period_ns = 0
+    triplets = []
+    header = None
+    in_block = False
+    for line in output.splitlines():
+        line = line.strip()
+        if line == "---PROFILEDATA---":
+            in_block = not in_block
+            header = None
+            continue
+        if not in_block or not line:
+            continue
+        cols = line.split(",")
+        if header is None:
+            header = {name: i for i, name in enumerate(cols)}
+            i_intended = header.get("IntendedVsync")
+            i_completed = header.get("FrameCompleted")
+            i_present = header.get("DisplayPresentTime")
+            i_interval = header.get("FrameInterval")
+            if i_intended is None or i_completed is None:
+                in_block = False
+            continue
+        try:
+            if cols[0] != "0":
+                continue
+            intended = int(cols[i_intended])
+            completed = int(cols[i_completed])
+            present = int(cols[i_present]) if i_present is not None else 0
+            if i_interval is not None and not refresh_period_ns:
+                refresh_period_ns = int(cols[i_interval])
+        except (ValueError, IndexError):
+            continue
+        actual = present if present > 0 else completed
+        if actual <= 0:
+            continue
+        triplets.append((intended, actual, actual))
+    triplets.sort(key=lambda t: t[1])
+    return refresh_period_ns, triplets
+
+
+def gfxinfo_rows(output):
+    """PROFILEDATA 区块的原始帧行数（含 Flags 非 0 而被略过的帧，不含标题行）；有多个区块时取最多的一个。"""
+    blocks = output.split("---PROFILEDATA---")[1::2]
+    return max((max(sum(1 for line in block.splitlines() if line.strip()) - 1, 0) for block in blocks), default=0)
+
+
+class GfxinfoFrameSource:
+    """
+    `dumpsys gfxinfo <pkg> framestats reset` 帧来源，适用于一般 View/Compose 应用。
+    每次读取后就 reset，所以每次只会拿到上次读取之后的新帧，资料量小且固定。
+    """
+
+    name = "gfxinfo"
+    history = GFXINFO_HISTORY
+
+    def __init__(self, serial=None):
+        self.serial = serial
+
+    def fetch(self, package):
+        output = run_adb_command(["shell", "dumpsys", "gfxinfo", package, "framestats", "reset"], self.serial)
+        if "---PROFILEDATA---" not in output:
+            # adb 失败或应用没有在执行（No process found），不是「没有新帧」
+            return f"gfxinfo:{package}", 0, None, 0
+        refresh_period_ns, triplets = parse_gfxinfo_framestats(output)
+        return f"gfxinfo:{package}", refresh_period_ns, triplets, gfxinfo_rows(output)
+
+
+class FrameStatsCollector:
+    """
+    FPS 与 Jank 共用的帧统计。每次 poll 只向帧来源取一次资料，FPS 与 Jank 都从同一份结果计算；
+    连续的视窗会拼进 FrameTimeline，Jank 判定的上下文跨 poll 延续。
+    backend 为 "surfaceflinger"、"gfxinfo" 或 "auto"：auto 会先找 SurfaceView layer，
+    找不到（一般 View/Compose 应用）就改用 gfxinfo。
+    """
+
+    def __init__(self, backend="auto", serial=None):
+        self.backend = backend
+        self.surfaceflinger = SurfaceFlingerFrameSource(serial)
+        self.gfxinfo = GfxinfoFrameSource(serial)
+        self.sources = {}  # auto 模式下每个 package 选定的来源
+        self.empty_polls = 0  # 连续取不到帧资料的次数
+        self.last_layer = ""
+        self.timeline = FrameTimeline()
+        self.jank_detector = JankDetector()
+
+    def invalidate(self):
+        """前景应用改变时调用：丢掉缓存的 layer 与来源选择，下次 poll 重新解析。"""
+        self.surfaceflinger.layers.clear()
+        self.sources.clear()
+        self.empty_polls = 0
+
+    def coverage(self):
+        timeline = self.timeline
+        return {'gaps': timeline.gap_count, 'lost_ms': timeline.lost_ns / 1e6, 'lost_pct': timeline.lost_percent}
+
+    def source_for(self, package):
+        if self.backend == "surfaceflinger":
+            return self.surfaceflinger
+        if self.backend == "gfxinfo":
+            return self.gfxinfo
+        if package not in self.sources:
+            has_layer = bool(self.surfaceflinger.resolve_layer(package, refresh=True))
+            self.sources[package] = self.surfaceflinger if has_layer else self.gfxinfo
+        return self.sources[package]
+
+    def fetch(self, package):
+        source = self.source_for(package)
+        layer, refresh_period_ns, triplets, rows = source.fetch(package)
+        if triplets:
+            self.empty_polls = 0
+        else:
+            # 画面静止时同样取不到资料，所以沿用原本的 layer 与来源；
+            # 连续多次才当作 layer 已换（切换 Activity、Surface 重建、改成游戏画面），下次 poll 重新解析
+            self.empty_polls += 1
+            if self.empty_polls >= FRAME_SOURCE_RETRY:
+                self.empty_polls = 0
+                self.surfaceflinger.layers.pop(package, None)
+                self.sources.pop(package, None)
+        return source, layer, refresh_period_ns, triplets, rows
+
+    def poll(self, package, refresh_period_ns=None):
+        """
+        返回 FrameStats。帧来源有回应但没有任何帧（画面静止）时 fps 与 jank 为 0；
+        找不到 layer、应用不在执行或 adb 失败时返回 None。
+        """
+        source, layer, period_from_dump, triplets, rows = self.fetch(package)
+        if triplets is None:
+            return None
+        refresh_period_ns = period_from_dump or refresh_period_ns or int(1_000_000_000 / 60)
+        if not triplets:
+            return FrameStats(fps=0, jank=0, big_jank=0, layer=layer, refresh_period_ns=refresh_period_ns,
+                              source=source.name, **self.coverage())
+
+        if layer != self.last_layer:
+            self.last_layer = layer
+            self.timeline.reset()
+            self.jank_detector.reset()
+
+        prev_present = self.timeline.last_present
+        new, gap = self.timeline.merge(triplets, source.history, rows)
+        if gap:
+            # gap 两侧的帧不相邻，不能拿来互相比较
+            self.jank_detector.reset()
+        analysis = self.jank_detector.feed(new, refresh_period_ns)
+
+        # FPS 以精确的区间计算：上次 poll 的最后一帧到这次的最后一帧
+        if prev_present is None or gap:
+            fps = calculate_fps([t[1] for t in new])
+        elif new:
+            fps = round(1_000_000_000 * len(new) / (new[-1][1] - prev_present))
+        else:
+            fps = 0
+        return FrameStats(
+            fps=fps,
+            jank=analysis.jank,
+            big_jank=analysis.big_jank,
+            layer=layer,
+            refresh_period_ns=refresh_period_ns,
+            new_frames=len(new),
+            gap=gap,
+            **self.coverage(),
+            frame_times_ns=analysis.frame_times_ns,
+            pacing_error_ms=analysis.mean_pacing_error_ms,
+            source=source.name,
+        )
+
+
+class FrameTimeHistogram:
+    """
+    帧时间 (ms) 的固定 bucket 对数直方图，用来即时回报 P50/P90/P99/P99.9 与 stutter 比例。
+    bucket 以 2% 递增，分位数的相对误差约 1%；记忆体固定，与 session 长度无关。
+    """
+
+    MIN_MS = 0.1
+    MAX_MS = 10_000.0
+    GROWTH = 1.02
+
+    def __init__(self):
+        self._log_growth = math.log(self.GROWTH)
+        # index 0 为下溢 (< MIN_MS)，最后一个为上溢 (>= MAX_MS)
+        self.size = int(math.ceil(math.log(self.MAX_MS / self.MIN_MS) / self._log_growth)) + 2
+        self.counts = np.zeros(self.size, dtype=np.int64)
+        self.count = 0
+        self.total_ns = 0
+        self.stutter_ns = 0
+        self.max_ms = 0.0
+
+    def record(self, frame_times_ns, refresh_period_ns=None):
+        frame_times = np.asarray(frame_times_ns, dtype=np.float64)
+        frame_times = frame_times[frame_times > 0]
+        if not frame_times.size:
+            return
+        ms = frame_times / 1e6
+        idx = np.floor(np.log(ms / self.MIN_MS) / self._log_growth).astype(np.int64) + 1
+        np.clip(idx, 0, self.size - 1, out=idx)
+        self.counts += np.bincount(idx, minlength=self.size)
+        self.count += frame_times.size
+        self.total_ns += int(frame_times.sum())
+        # stutter：超过 Jank 阈值 (2 个 VSync) 的帧所占的时间比例
+        period = refresh_period_ns or NS_PER_SEC / 60
+        self.stutter_ns += int(frame_times[frame_times > period * JANK_VSYNCS].sum())
+        self.max_ms = max(self.max_ms, float(ms.max()))
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        i = int(np.searchsorted(cumulative, q / 100 * self.count))
+        if i == 0:
+            return self.MIN_MS
+        if i >= self.size - 1:
+            return self.max_ms
+        # bucket i 涵盖 [MIN * G^(i-1), MIN * G^i)，取几何中点
+        return min(self.MIN_MS * self.GROWTH ** (i - 0.5), self.max_ms)
+
+    @property
+    def stutter_ratio(self):
+        return self.stutter_ns / self.total_ns if self.total_ns else 0.0
+
+    def summary(self):
+        return {
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'stutter': self.stutter_ratio * 100,
+            'frames': self.count,
+        }
+
+
+CPUFREQ_GLOB = "/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq"
+GPU_BUSY_PATH = "/sys/class/kgsl/kgsl-3d0/gpubusy"
+MALI_UTILIZATION_PATH = "/sys/class/misc/mali0/device/utilization"  # 没有 Adreno gpubusy 的设备（Mali GPU）
+BATTERY_TEMP_PATH = "/sys/class/power_supply/battery/temp"
+THERMAL_ZONE_GLOB = "/sys/class/thermal/thermal_zone*"  # 没有 BATTERY_TEMP_PATH 的设备从这里找电池温度
+
+
+def parse_proc_stat(output):
+    """解析 /proc/stat 开头的 cpu 行，返回 (totals, idles)，index 0 为总计行。"""
+    totals, idles = [], []
+    for line in output.splitlines():
         if line.startswith("cpu"):
             parts = list(map(int, line.split()[1:5]))
-            total = sum(parts)
-            idle = parts[3]
-            current_totals.append(total)
-            current_idles.append(idle)
+            totals.append(sum(parts))
+            idles.append(parts[3])
         else:
             break
+    return totals, idles
 
-    if not hasattr(get_cpu_usage_and_freq, "_prev_totals"):
-        get_cpu_usage_and_freq._prev_totals = current_totals
-        get_cpu_usage_and_freq._prev_idles = current_idles
-        return [0] * (len(current_totals) - 1), [0] * (len(current_totals) - 1)
-
-    prev_totals = get_cpu_usage_and_freq._prev_totals
-    prev_idles = get_cpu_usage_and_freq._prev_idles
 
-    length = min(len(current_totals), len(prev_totals))
+def calculate_cpu_usages(prev_totals, prev_idles, totals, idles):
+    # 跳过 index 0 的总计行，只计算各核心
+    length = min(len(totals), len(prev_totals))
     usages = []
     for i in range(1, length):
-        total_diff = current_totals[i] - prev_totals[i]
-        idle_diff = current_idles[i] - prev_idles[i]
+        total_diff = totals[i] - prev_totals[i]
+        idle_diff = idles[i] - prev_idles[i]
         usage = (total_diff - idle_diff) / total_diff * 100 if total_diff else 0
         usages.append(usage)
+    return usages
 
-    get_cpu_usage_and_freq._prev_totals = current_totals
-    get_cpu_usage_and_freq._prev_idles = current_idles
 
-    freqs = []
-    idx = 0
-    while True:
-        freq = run_adb_command(["shell", "cat", f"/sys/devices/system/cpu/cpu{idx}/cpufreq/scaling_cur_freq"])
-        if "No such file" in freq or freq.strip() == "":
-            break
-        freqs.append(int(freq.strip()) / 1000 if freq.strip().isdigit() else 0)
-        idx += 1
+def parse_cpu_freqs(output):
+    """
+    解析 `grep -H . .../cpu*/cpufreq/scaling_cur_freq` 的输出，返回按核心排序的 MHz 列表。
+    读不到的核心（例如离线）补 0。
+    """
+    found = {}
+    for m in re.finditer(r"cpu(\d+)/cpufreq/scaling_cur_freq:(\d+)", output):
+        found[int(m.group(1))] = int(m.group(2)) / 1000
+    if not found:
+        return []
+    return [found.get(i, 0) for i in range(max(found) + 1)]
 
-    return usages, freqs
-def GPU_Usage():
-    # 1. 執行 adb 指令讀取 gpubusy 檔案
-    output = run_adb_command(["shell", "cat", "/sys/class/kgsl/kgsl-3d0/gpubusy"])
-    
-    if not output:
-        return 0.0
 
-    try:
-        # 3. 將輸出的字串分割成兩個部分
-        parts = output.split()
-        
-        if len(parts) == 2:
+def parse_gpubusy(output):
+    # Adreno gpubusy 为 "busy total"；Mali 的 utilization 只有一个百分比
+    parts = output.split()
+    if len(parts) == 1:
+        try:
+            return float(parts[0])
+        except ValueError:
+            return 0.0
+    if len(parts) == 2:
+        try:
             busy_cycles = int(parts[0])
             total_cycles = int(parts[1])
-            
-            if total_cycles == 0:
-                return 0.0
-            
-            usage = (busy_cycles / total_cycles) * 100
-            return usage
-            
-    except (ValueError, IndexError):
-        # 如果輸出格式不對 (例如不是數字)，則返回 0
-        return 0.0
-        
+        except ValueError:
+            return 0.0
+        if total_cycles == 0:
+            return 0.0
+        return (busy_cycles / total_cycles) * 100
     return 0.0
-def get_battery_temp():
-    output =run("adb shell dumpsys battery | grep temperature")
-    match = re.search(r':\s*(\d+)', output)
 
+
+def parse_battery_temp(output):
+    # 同时兼容 `dumpsys battery` 的 "temperature: 323" 与 sysfs 的 "323"（单位 0.1°C）；
+    # thermal zone 的 temp 以 m°C 为单位（"32300"），超过 1000 的值视为 m°C
+    match = re.search(r"temperature:\s*(-?\d+)", output)
     if match:
-        # match.group(1) 提取括號 () 內的數字，即 "323"
-        temp_str = match.group(1)
-        
-        try:
-            # 轉換為整數 (323)，然後除以 1000 得到攝氏度 (32.3)
-            temp_int = int(temp_str)
-            return temp_int / 10
-        except ValueError:
-            # 如果抓到的內容不是有效數字，則返回 0
-            return 0
+        return int(match.group(1)) / 10
+    output = output.strip()
+    if output.lstrip("-").isdigit():
+        value = int(output)
+        return value / 1000 if abs(value) >= 1000 else value / 10
+    return 0
+
+
+def parse_temp_node(output):
+    """
+    DeviceProfile 的 temp_node：读得到的 power_supply 电池温度节点优先，其次是 type 含 "batt" 的 thermal zone。
+    都没有时返回 None（只能读 dumpsys battery）。
+    """
+    lines = [line.strip() for line in output.splitlines()]
+    if BATTERY_TEMP_PATH in lines:
+        return BATTERY_TEMP_PATH
+    for line in lines:
+        zone, _, kind = line.partition(":")
+        if zone.startswith("/sys/class/thermal/thermal_zone") and "batt" in kind.lower():
+            return f"{zone}/temp"
+    return None
+
+
+def parse_meminfo(output):
+    mem = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            try:
+                mem[parts[0].strip(':')] = int(parts[1])
+            except ValueError:
+                pass
+    total = mem.get("MemTotal", 1)
+    available = mem.get("MemAvailable", 0)
+    return (total - available) / total * 100
+
+
+class CpuUsageTracker:
+    """CPU 使用率需要 /proc/stat 前后两次的差值；每台设备（每个 collector）各持有一个。第一次回传全 0。"""
+
+    def __init__(self):
+        self._prev_totals = None
+        self._prev_idles = None
+
+    def update(self, totals, idles):
+        if self._prev_totals is None:
+            usages = [0] * max(len(totals) - 1, 0)
+        else:
+            usages = calculate_cpu_usages(self._prev_totals, self._prev_idles, totals, idles)
+        self._prev_totals, self._prev_idles = totals, idles
+        return usages
+
+
+# 没有传入 tracker 时（逐项读取的旧用法），每台设备（serial）预设的差值状态；collector 各自持有自己的 tracker
+_default_cpu_trackers = {}
+
+
+def get_cpu_usage_and_freq(tracker=None, serial=None):
+    # /proc/stat 与所有核心的频率在同一次 shell 调用中读取
+    if tracker is None:
+        tracker = _default_cpu_trackers.setdefault(serial, CpuUsageTracker())
+    output = run_adb_command(["shell", f'grep ^cpu /proc/stat; echo @@freq; grep -H . {CPUFREQ_GLOB} 2>/dev/null; true'],
+                             serial)
+    stat_text, _, freq_text = output.partition("@@freq")
+    return tracker.update(*parse_proc_stat(stat_text)), parse_cpu_freqs(freq_text)
+def GPU_Usage(serial=None):
+    # 1. 執行 adb 指令讀取 gpubusy 檔案
+    output = run_adb_command(["shell", "cat", GPU_BUSY_PATH], serial)
+    
+    if not output:
+        return 0.0
+    # 2. 輸出格式為 "busy total"，格式不對時返回 0
+    return parse_gpubusy(output)
+def get_battery_temp(serial=None, node=None):
+    # node 为 DeviceProfile 探测到的温度节点；没有时读 dumpsys battery
+    cmd = f"cat {node} 2>/dev/null || dumpsys battery | grep temperature" if node else "dumpsys battery | grep temperature"
+    output = run_adb_command(["shell", cmd], serial)
+    # "temperature: 323" -> 32.3°C；沒有找到時返回 0
+    return parse_battery_temp(output)
+def local_apk_hash(path=None):
+    """本机 APK 的 sha256；档案不存在时回传 None。"""
+    digest = hashlib.sha256()
+    try:
+        with open(path or APK_PATH, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def parse_sha256sum(output):
+    match = re.match(r"\s*([0-9a-fA-F]{64})\b", output or "")
+    return match.group(1).lower() if match else None
+
+
+def installed_apk_hash(package=PACKAGE_NAME, serial=None):
+    """设备上已安装的 APK（pm path 的 base.apk）的 sha256；未安装或设备没有 sha256sum 时回传 None。"""
+    output = run_adb_command(["shell", f'p=$(pm path {package} 2>/dev/null | head -n 1); p=${{p#package:}}; '
+                                       f'[ -n "$p" ] && sha256sum "$p"'], serial)
+    return parse_sha256sum(output)
+
+
+def install_and_start_service(progress=None, force=False, serial=None):
+    """
+    必要时安装功耗服务，然后启动它。设备上已装的 APK 与本机 APK_PATH 的 sha256 相同就不再 adb install；
+    force=True 时一律重新安装。progress(text) 回报目前的步骤（预设直接 print）。回传这次是否真的安装了。
+    """
+    report = progress or print
+    report("檢查功耗服務版本…")
+    local = local_apk_hash()
+    installed = None if force else installed_apk_hash(serial=serial)
+    if installed is not None and local in (installed, None):
+        # 本机没有 APK 时也直接用设备上已安装的版本
+        report("功耗服務已是最新版本，略過安裝" if local else "找不到本機 APK，使用設備上已安裝的服務")
+        did_install = False
     else:
-        # 如果沒有找到匹配的 "temperature: <數字>" 模式，則返回 0
-        return 0
-def install_and_start_service():
+        report("安裝功耗服務…")
+        with TELEMETRY.timer("service.install"):
+            install_apk(serial)
+        did_install = True
+    report("啟動功耗服務…")
+    start_service(serial)
+    return did_install
+
+
+def install_apk(serial=None):
     # 注意：这里的 adb install/uninstall 命令字符串中含有空格和引号，
     # run 函数中使用 shell=True 是合适的，但我们需要确保 ADB_EXEC 在 PATH 中
     # 或者用绝对路径替换 'adb'
     
     adb_exec_cmd = ADB_EXEC if ADB_EXEC != "adb" else "adb" # 确保 cmd 字符串中是 adb
+    if serial:
+        adb_exec_cmd += f" -s {serial}"
     
     # 转换为使用绝对路径的命令字符串
     install_cmd = f'{adb_exec_cmd} install -r "{APK_PATH}"'
     uninstall_cmd = f'{adb_exec_cmd} uninstall {PACKAGE_NAME}'
-    start_cmd = f"{adb_exec_cmd} shell am start-foreground-service -n {SERVICE_CLASS}"
     
     try:
         # 1. 先尝试安装/更新 (注意：如果 adb 找不到，这里会失败)
@@ -369,8 +1218,14 @@ def install_and_start_service():
         # 捕获外部 adb 命令找不到的错误
         print(f"❌ [严重错误] 找不到 ADB ({adb_exec_cmd})。请检查 ADB_EXEC 路径。")
         raise
-        
 
+
+def start_service(serial=None):
+    adb_exec_cmd = ADB_EXEC if ADB_EXEC != "adb" else "adb"
+    if serial:
+        adb_exec_cmd += f" -s {serial}"
+    start_cmd = f"{adb_exec_cmd} shell am start-foreground-service -n {SERVICE_CLASS}"
+    
     # 3. 启动服务
     try:
         # 启动命令
@@ -379,37 +1234,24 @@ def install_and_start_service():
     except subprocess.CalledProcessError as e:
         # 启动失败通常是 Manifest 或代碼问题
         print(f"❌ 服务启动失败，错误信息：\n{e.output}")
-def get_device_ip():
-    output = run("adb shell ip addr show wlan0")
+def parse_device_ip(output):
     match = re.search(r"inet\s+(\d+\.\d+\.\d+\.\d+)", output)
     if match:
         ip = match.group(1)
         return ip
     else:
         return None
+def get_device_ip(serial=None):
+    return parse_device_ip(run_adb_command(["shell", "ip", "addr", "show", "wlan0"], serial))
 def get_power_data(ip):
     try:
         url = f"http://{ip}:{PORT}/battery"
-        resp = requests.get(url, timeout=3)
+        with TELEMETRY.timer("http", scoped=True):
+            resp = requests.get(url, timeout=3)
 
         if resp.status_code == 200:
             try:
-                data = resp.json()
-                
-                # 【已修正】使用您服務實際回傳的鍵名: 'powerMW', 'voltageV', 'currentMA'
-                power = data.get('powerMW')
-                voltage = data.get('voltageV') 
-                current = data.get('currentMA')
-
-                if power is not None and voltage is not None and current is not None:
-                    return {
-                        'power_mW': power,
-                        'voltage_V': voltage, 
-                        'current_mA': current
-                    }
-                else:
-                    return None
-
+                return parse_power_payload(resp.json())
             except json.JSONDecodeError:
                 return None
         else:
@@ -418,27 +1260,510 @@ def get_power_data(ip):
     except requests.exceptions.RequestException as e:
         print(f"⚠️ 無法連線至 {ip}:{PORT}。錯誤: {e}")
         return None
-def uninstall_service():
+def parse_power_payload(data):
+    # 【已修正】使用您服務實際回傳的鍵名: 'powerMW', 'voltageV', 'currentMA'
+    power = data.get('powerMW')
+    voltage = data.get('voltageV') 
+    current = data.get('currentMA')
+
+    if power is not None and voltage is not None and current is not None:
+        return {
+            'power_mW': power,
+            'voltage_V': voltage, 
+            'current_mA': current
+        }
+    return None
+
+
+POWER_FORWARD_PORT = 18080  # adb forward 在本机使用的 port（同时监控多台设备时，第 i 台用 POWER_FORWARD_PORT + i）
+# 设备与主机时钟差的 EWMA 权重：越大越快跟上时钟漂移，越小越不受单次传输延迟影响
+POWER_CLOCK_ALPHA = float(os.environ.get("PER_POWER_CLOCK_ALPHA", "0.2"))
+
+
+class PowerClient:
+    """
+    BatteryService 功耗端点的长连线客户端。
+    - 透过 `adb forward tcp:forward_port tcp:PORT` 走 USB，不需要 Wi-Fi；forward 失败时改用 ip_provider() 给的 Wi-Fi IP
+    - requests.Session 保持 keep-alive，不再每次重新建立连线
+    - poll() 不阻塞：回传最近一次的结果，并在背景发出下一次请求
+    - 断路器：连续失败 failure_threshold 次后暂停 cooldown 秒（每次再失败加倍，最多 max_cooldown）
+    """
+
+    def __init__(self, use_forward=True, ip_provider=None, timeout=1.0,
+                 failure_threshold=3, cooldown=2.0, max_cooldown=60.0, serial=None, forward_port=None):
+        self.use_forward = use_forward
+        self.serial = serial
+        self.forward_port = forward_port or POWER_FORWARD_PORT
+        self.ip_provider = ip_provider or (lambda: get_device_ip(serial))
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.base_url = None
+        self.forwarded = False
+
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until = 0.0
+
+        self.last_status = None
+        self.latest = None
+        self.latest_at = 0.0
+        # 批次模式：服务端以高频率把样本记在 ring buffer，这里每次取回 cursor 之后的全部样本
+        self.batch_supported = True
+        self.cursor = 0
+        self.clock_offset = None
+        self.pending = deque(maxlen=100_000)
+        self._inflight = False
+        self._lock = threading.Lock()
+
+    def _resolve_base_url(self):
+        if self.use_forward and not self.forwarded:
+            result = run_adb_command(["forward", f"tcp:{self.forward_port}", f"tcp:{PORT}"], self.serial)
+            self.forwarded = not (result.startswith("ERROR_CODE") or result == "ADB_NOT_FOUND")
+        if self.forwarded:
+            return f"http://127.0.0.1:{self.forward_port}"
+        ip = self.ip_provider()
+        return f"http://{ip}:{PORT}" if ip else None
+
+    @property
+    def circuit_open(self):
+        return time.time() < self.open_until
+
+    def get_json(self, path, params=None):
+        """
+        受断路器保护的 GET，失败时返回 None。断路器打开时直接返回 None，不会碰网路。
+        """
+        if self.circuit_open:
+            return None
+        if self.base_url is None:
+            self.base_url = self._resolve_base_url()
+            if self.base_url is None:
+                self._record_failure()
+                return None
+        try:
+            status, data = self._get(path, params)
+            self.last_status = status
+            if status == 404:
+                # 服务还活着，只是不支援这个端点
+                return None
+            if status != 200:
+                raise requests.exceptions.HTTPError(f"HTTP {status}")
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            self._record_failure(e)
+            return None
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        return data
+
+    def _get(self, path, params):
+        """回传 (status, JSON)；录制与回放都以 path 为 key。"""
+        if REPLAY is not None:
+            status, data, error = REPLAY.http(path, params)
+            if error:
+                raise requests.exceptions.ConnectionError(error)
+            return status, data
+        started = time.time()
+        try:
+            with TELEMETRY.timer("http", scoped=True, device=self.serial):
+                resp = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+                data = resp.json() if resp.status_code == 200 else None
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            if RECORDER is not None:
+                RECORDER.record_http(path, params, started, error=str(e))
+            raise
+        if RECORDER is not None:
+            RECORDER.record_http(path, params, started, resp.status_code, data)
+        return resp.status_code, data
+
+    def _record_failure(self, error=None):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            # 打开断路器；冷却结束后放行一次试探请求，再失败就把冷却时间加倍
+            self.open_until = time.time() + self.cooldown
+            print(f"⚠️ 功耗服務 {self.base_url} 連續失敗 {self.failures} 次，暫停 {self.cooldown:.0f}s。錯誤: {error}")
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.failures = self.failure_threshold - 1
+            # 下次重新决定走 forward 还是 Wi-Fi IP
+            self.base_url = None
+            self.forwarded = False
+
+    def fetch(self):
+        """阻塞式取得一次功耗资料。"""
+        data = self.get_json("/battery")
+        power = parse_power_payload(data) if isinstance(data, dict) else None
+        if power is not None:
+            with self._lock:
+                self.latest = power
+                self.latest_at = now()
+        return power
+
+    def fetch_batch(self):
+        """
+        批次协定：GET /battery/batch?since=<cursor>
+        回应 {"cursor": <下一次的 cursor>, "samples": [{"t": <设备时间 ms>, "powerMW": .., "voltageV": .., "currentMA": ..}, ...]}
+        样本的设备时间会平移到主机时间轴，加进 pending，由 drain() 取走。
+        服务端不支援（404）时改回单点的 /battery。
+        """
+        sent_at = now()
+        data = self.get_json("/battery/batch", {"since": self.cursor})
+        received_at = now()
+        if data is None:
+            if self.last_status == 404:
+                self.batch_supported = False
+            return []
+        samples = data.get("samples") if isinstance(data, dict) else None
+        cursor = data.get("cursor", self.cursor) if isinstance(data, dict) else None
+        if not isinstance(samples, list) or not isinstance(cursor, (int, float)) or isinstance(cursor, bool):
+            # 格式不对的回应（例如不是物件、cursor 不是数字）当作一次失败，计入断路器
+            self._record_failure(f"batch 回應格式錯誤: {str(data)[:80]}")
+            return []
+        samples = [s for s in samples if isinstance(s, dict)]
+        if cursor < self.cursor:
+            # cursor 倒退：服务端重启（或设备重开机），之前的时钟差不再适用
+            self.clock_offset = None
+        self.cursor = cursor
+        times = [s["t"] for s in samples if isinstance(s.get("t"), (int, float))]
+        if not times:
+            return []
+        # 设备与主机的时钟差：最新样本约在请求往返的中点产生；以 EWMA 平滑，时钟漂移时可增可减
+        offset = (sent_at + received_at) / 2 - max(times) / 1000
+        if self.clock_offset is None:
+            self.clock_offset = offset
+        else:
+            self.clock_offset += POWER_CLOCK_ALPHA * (offset - self.clock_offset)
+
+        batch = []
+        for sample in samples:
+            power = parse_power_payload(sample)
+            if power is None or not isinstance(sample.get("t"), (int, float)):
+                continue
+            power['timestamp'] = sample["t"] / 1000 + self.clock_offset
+            batch.append(power)
+        batch.sort(key=lambda p: p['timestamp'])
+        with self._lock:
+            self.pending.extend(batch)
+            if batch:
+                self.latest = {k: v for k, v in batch[-1].items() if k != 'timestamp'}
+                self.latest_at = batch[-1]['timestamp']
+        return batch
+
+    def drain(self):
+        """取走目前累积的批次样本（依时间排序）。"""
+        with self._lock:
+            samples = list(self.pending)
+            self.pending.clear()
+        return samples
+
+    def poll(self):
+        """不阻塞：回传 (最近一次的结果, 取得时间)，并在背景发出下一次请求。"""
+        with self._lock:
+            if not self._inflight and not self.circuit_open:
+                self._inflight = True
+                threading.Thread(target=self._fetch_in_background, daemon=True).start()
+            return self.latest, self.latest_at
+
+    def _fetch_in_background(self):
+        try:
+            if self.batch_supported:
+                self.fetch_batch()
+            if not self.batch_supported:
+                self.fetch()
+        finally:
+            with self._lock:
+                self._inflight = False
+
+    def close(self):
+        self.session.close()
+        if self.forwarded:
+            run_adb_command(["forward", "--remove", f"tcp:{self.forward_port}"], self.serial)
+            self.forwarded = False
+def uninstall_service(serial=None):
     # 使用 check=False 容忍卸载失败（应用可能未安装）
     adb_exec_cmd = ADB_EXEC if ADB_EXEC != "adb" else "adb"
+    if serial:
+        adb_exec_cmd += f" -s {serial}"
     subprocess.run(f"{adb_exec_cmd} uninstall {PACKAGE_NAME}", 
                    shell=True, check=False, 
                    creationflags=CREATE_NO_WINDOW)
     print(f"✅ 尝试卸载 {PACKAGE_NAME} 完毕。")
-def get_mem_usage():
-    output = run_adb_command(["shell", "cat", "/proc/meminfo"])
-    mem = {}
+def get_mem_usage(serial=None):
+    output = run_adb_command(["shell", "cat", "/proc/meminfo"], serial)
+    return parse_meminfo(output)
+
+
+# ========== 批次快照：一次 shell 调用读完 CPU / 内存 / GPU / 温度 ==========
+SNAPSHOT_SECTIONS = {
+    "stat": "grep ^cpu /proc/stat",
+    "freq": f"grep -H . {CPUFREQ_GLOB} 2>/dev/null",
+    "mem": 'grep -E "^(MemTotal|MemAvailable):" /proc/meminfo',
+    "gpu": f"cat {GPU_BUSY_PATH} 2>/dev/null",
+    "temp": f"cat {BATTERY_TEMP_PATH} 2>/dev/null || dumpsys battery | grep temperature",
+}
+
+
+def snapshot_sections(profile_values=None):
+    """
+    依 DeviceProfile 探测到的节点调整快照区块：没有 Adreno gpubusy、只有 Mali utilization 的设备改读后者；
+    没有 power_supply 电池温度节点的设备改读电池的 thermal zone，都没有时直接读 dumpsys battery（不再每次先 cat 失败）。
+    其余设备（或尚未探测）与 SNAPSHOT_SECTIONS 相同，指令不变，之前录制的 session 档仍可回放。
+    """
+    profile_values = profile_values or {}
+    sections = dict(SNAPSHOT_SECTIONS)
+    nodes = profile_values.get("gpu_nodes") or []
+    if nodes and GPU_BUSY_PATH not in nodes:
+        sections["gpu"] = f"cat {nodes[0]} 2>/dev/null"
+    if "temp_node" in profile_values and profile_values["temp_node"] != BATTERY_TEMP_PATH:
+        node = profile_values["temp_node"]
+        sections["temp"] = (f"cat {node} 2>/dev/null || dumpsys battery | grep temperature" if node
+                            else "dumpsys battery | grep temperature")
+    return sections
+
+
+def build_snapshot_script(sections=None):
+    """每个区块前输出 `@@<name>` 标记，最后以 `@@end` 结尾，方便判断输出是否完整。"""
+    parts = [f"echo @@{name}; {cmd}" for name, cmd in (sections or SNAPSHOT_SECTIONS).items()]
+    parts.append("echo @@end")
+    return "; ".join(parts)
+
+
+def split_sections(output):
+    sections = {}
+    current = None
     for line in output.splitlines():
-        parts = line.split()
-        if len(parts) >= 2:
-            mem[parts[0].strip(':')] = int(parts[1])
-    total = mem.get("MemTotal", 1)
-    available = mem.get("MemAvailable", 0)
-    return (total - available) / total * 100
-def check_adb_connection():
+        if line.startswith("@@"):
+            current = line[2:].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return {name: "\n".join(lines) for name, lines in sections.items()}
+
+
+@dataclass
+class Snapshot:
+    timestamp: float
+    usages: List[float]
+    freqs: List[float]
+    mem: float
+    gpu: float
+    temp: float
+
+
+class SnapshotCollector:
+    """
+    用一次 shell 调用读取 /proc/stat、所有核心 cpufreq、meminfo、gpubusy 与电池温度，
+    解析成一个 Snapshot。CPU 使用率需要前后两次的差值，状态保存在实例中（每台设备各建一个）。
+    sections 为 snapshot_sections() 的结果（预设 SNAPSHOT_SECTIONS）。
+    """
+
+    def __init__(self, serial=None, sections=None):
+        self.serial = serial
+        self.cpu = CpuUsageTracker()
+        self.set_sections(sections)
+
+    def set_sections(self, sections):
+        self.script = build_snapshot_script(sections)
+
+    def collect(self):
+        timestamp = now()
+        output = run_adb_command(["shell", self.script], self.serial)
+        return self.parse(output, timestamp)
+
+    @TELEMETRY.timed("parse.snapshot")
+    def parse(self, output, timestamp=None):
+        sections = split_sections(output)
+        if "end" not in sections:
+            raise ValueError(f"snapshot 输出不完整: {output[:200]!r}")
+
+        usages = self.cpu.update(*parse_proc_stat(sections.get("stat", "")))
+
+        return Snapshot(
+            timestamp=now() if timestamp is None else timestamp,
+            usages=usages,
+            freqs=parse_cpu_freqs(sections.get("freq", "")),
+            mem=parse_meminfo(sections.get("mem", "")),
+            gpu=parse_gpubusy(sections.get("gpu", "")),
+            temp=parse_battery_temp(sections.get("temp", "")),
+        )
+
+
+# ========== 设备端流式采样：推送脚本后用 adb exec-out 持续读取 ==========
+SAMPLER_REMOTE_PATH = "/data/local/tmp/per_sampler.sh"
+
+
+def build_sampler_script(sections=None):
+    """
+    设备端采样脚本，$1 为采样间隔（秒）。每条记录以 `@@ts <设备时间>` 开头、`@@end` 结尾，
+    中间的区块与 build_snapshot_script 相同。sleep 放到背景与采样并行，
+    所以记录间隔是 max(间隔, 采样耗时)，不会因为采样本身的耗时而漂移。
+    """
+    body = "\n".join(f"  echo @@{name}; {cmd}" for name, cmd in (sections or SNAPSHOT_SECTIONS).items())
+    return (
+        "#!/system/bin/sh\n"
+        "interval=${1:-0.5}\n"
+        "while true; do\n"
+        "  sleep $interval &\n"
+        "  echo \"@@ts $(date +%s.%N)\"\n"
+        f"{body}\n"
+        "  echo @@end\n"
+        "  wait\n"
+        "done\n"
+    )
+
+
+def push_sampler_script(serial=None, sections=None):
+    with tempfile.NamedTemporaryFile("w", suffix=".sh", delete=False, newline="\n") as f:
+        f.write(build_sampler_script(sections))
+        local_path = f.name
+    try:
+        result = run_adb_command(["push", local_path, SAMPLER_REMOTE_PATH], serial)
+    finally:
+        os.remove(local_path)
+    if result.startswith("ERROR_CODE") or result == "ADB_NOT_FOUND":
+        raise RuntimeError(f"推送采样脚本失败: {result}")
+
+
+class SamplerStream:
+    """
+    在设备上只启动一次采样脚本，主机端以 generator 管线持续解析：
+    stdout 行 -> 记录 (@@ts ... @@end) -> Snapshot。
+    Snapshot.timestamp 以设备时钟为准，并平移到主机时间轴上，保留设备端的等间隔。
+    """
+
+    def __init__(self, interval=0.5, serial=None, sections=None):
+        self.interval = interval
+        self.serial = serial
+        self.sections = sections
+        self._proc = None
+
+    def start(self):
+        push_sampler_script(self.serial, self.sections)
+        self._proc = open_stream(["exec-out", "sh", SAMPLER_REMOTE_PATH, str(self.interval)], self.serial)
+        return self
+
+    def stop(self):
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=1)
+            except Exception:
+                pass
+
+    def __iter__(self):
+        return self.samples()
+
+    def samples(self):
+        if self._proc is None:
+            self.start()
+        collector = SnapshotCollector(self.serial)
+        clock_offset = None
+        for device_ts, record in self._records(self._lines()):
+            if clock_offset is None:
+                clock_offset = now() - device_ts
+            try:
+                yield collector.parse(record, device_ts + clock_offset)
+            except ValueError:
+                continue
+
+    def _lines(self):
+        proc = self._proc
+        for raw in iter(proc.stdout.readline, b""):
+            yield raw.decode("utf-8", errors="ignore").rstrip("\r\n")
+
+    @staticmethod
+    def _records(lines):
+        device_ts = None
+        buf = []
+        for line in lines:
+            if line.startswith("@@ts"):
+                try:
+                    device_ts = float(line.split()[1])
+                except (IndexError, ValueError):
+                    device_ts = None
+                buf = []
+                continue
+            if device_ts is None:
+                continue
+            buf.append(line)
+            if line == "@@end":
+                yield device_ts, "\n".join(buf)
+                device_ts = None
+
+
+# ========== 设备资料：session 开始时探测一次，之后按各自的 TTL 更新 ==========
+# 每项资料：(探测指令, 解析函式, TTL 秒；None 表示整个 session 都不会变)
+DEVICE_PROFILE_FIELDS = {
+    "model": ("getprop ro.product.model", lambda out: out.strip(), None),
+    "ip": ("ip addr show wlan0", parse_device_ip, 60.0),
+    "refresh_rate": ('dumpsys SurfaceFlinger | grep "refresh-rate"', parse_refresh_rate, 30.0),
+    "gpu_nodes": (f"ls {GPU_BUSY_PATH} {MALI_UTILIZATION_PATH}", lambda out: out.split(), None),
+    # 只列出读得到的节点（有些设备的 sysfs 节点存在但 SELinux 不让读）
+    "temp_node": (f"cat {BATTERY_TEMP_PATH} >/dev/null 2>&1 && echo {BATTERY_TEMP_PATH}; "
+                  f"for z in {THERMAL_ZONE_GLOB}; do cat $z/temp >/dev/null 2>&1 && echo \"$z:$(cat $z/type)\"; done",
+                  parse_temp_node, None),
+}
+
+
+class DeviceProfile:
+    """
+    变化很慢的设备资料（型号、IP、刷新率、GPU 与温度节点）。
+    probe() 用一次 shell 调用取得全部；之后 get() 只在该项过期或被 invalidate() 时才重新查询该项。
+    TTL 以 now() 计时，回放时跟着录制当时的时间走。
+    """
+
+    def __init__(self, fields=DEVICE_PROFILE_FIELDS, serial=None):
+        self.fields = fields
+        self.serial = serial
+        self.values = {}
+        self.fetched_at = {}
+        self._lock = threading.Lock()
+
+    def probe(self):
+        script = "; ".join(f"echo @@{name}; {cmd} 2>/dev/null" for name, (cmd, _, _) in self.fields.items())
+        sections = split_sections(run_adb_command(["shell", script + "; echo @@end"], self.serial))
+        fetched_at = now()
+        with self._lock:
+            for name, (_, parse, _) in self.fields.items():
+                if name in sections:
+                    self.values[name] = parse(sections[name])
+                    self.fetched_at[name] = fetched_at
+        return dict(self.values)
+
+    def expired(self, name):
+        if name not in self.fetched_at:
+            return True
+        ttl = self.fields[name][2]
+        return ttl is not None and now() - self.fetched_at[name] >= ttl
+
+    def get(self, name):
+        with self._lock:
+            if not self.expired(name):
+                return self.values[name]
+        cmd, parse, _ = self.fields[name]
+        value = parse(run_adb_command(["shell", f"{cmd} 2>/dev/null; true"], self.serial))
+        with self._lock:
+            self.values[name] = value
+            self.fetched_at[name] = now()
+        return value
+
+    def invalidate(self, name=None):
+        """资料可能已经变了（例如功耗服务连不上、刷新周期改变），下次 get() 重新查询。"""
+        with self._lock:
+            if name is None:
+                self.fetched_at.clear()
+            else:
+                self.fetched_at.pop(name, None)
+
+
+def check_adb_connection(serial=None):
     try:
         # 使用 run_adb_command
-        output = run_adb_command(["get-state"]).strip()
+        output = run_adb_command(["get-state"], serial).strip()
         
         if output.startswith("ERROR_CODE") or output == "ADB_NOT_FOUND":
             return False
@@ -0,0 +1,714 @@
+import os
+import re
+import time
+import math
+import tempfile
+import threading
+
+from collector import CollectorScheduler
+from rollup import Rollup
+from session_archive import ReplaySource, SessionRecorder, default_archive_path
+from session_log import SESSION_DIR, SessionLog, log_columns
+from telemetry import TELEMETRY
+
+# ========== 采集管线（不依赖 Qt） ==========
+# DataPipeline 依各 collector 的周期采集资料，每个结果与缓存合并后交给 on_data；
+# SessionSummary 把结果累进分层汇总，每秒写一行 session log。
+# GUI（main.py 的 DataThread / MonitorWindow）与 headless.py 共用这里的全部逻辑；
+# DevicePool 同时监控多台设备，每台一条独立的管线。
+
+# It's assumed a 'per' module exists with the necessary functions.
+# Since it's not provided, a mock will be used for demonstration if run directly.
+# MockPer 跳过了 per.py 的解析与 adb 呼叫；要测试真正的采集管线，请改用
+# ADB_EXEC_PATH=fake_adb.py（配合 fake_power_server.py）。
+try:
+    import per
+except ImportError:
+    print("Warning: 'per' module not found. Using mock data.")
+    class MockPer:
+        # 签名与返回型别与 per.py 相同（没有 serial 参数的设备只有一台）
+        def get_foreground_app(self, serial=None): return "com.mock.app"
+        def get_fps(self, package): return 60 * (0.9 + 0.1 * math.sin(time.time()))
+        def get_cpu_usage_and_freq(self, tracker=None, serial=None):
+            t = time.time()
+            # Simulate initial zero values for the first 0.1 seconds
+            if not hasattr(self, 'start_time'):
+                self.start_time = t
+            if t - self.start_time < 0.1:
+                 return [0]*8, [0]*8
+            usages = [50 + 40 * math.sin(t + i) for i in range(8)]
+            freqs = [1500 + 1000 * math.sin(t + i) for i in range(8)]
+            return usages, freqs
+        def GPU_Usage(self, serial=None): return 45 + 20 * math.sin(time.time() * 0.5)
+        def get_battery_temp(self, serial=None, node=None): return 35 + 5 * math.sin(time.time() * 0.2)
+        def get_mem_usage(self, serial=None): return 60 + 10 * math.sin(time.time() * 0.3)
+        def get_power_data(self, ip):
+            t = time.time()
+            current = abs(-400 + 150 * math.sin(t * 2))
+            voltage = 4.2 - 0.2 * math.sin(t * 2)
+            power = current * voltage
+            return {'power_mW': power, 'voltage_V': voltage, 'current_mA': current}
+        def get_refresh_rate(self, serial=None): return 120.0
+        def get_surfaceflinger_target_layer(self, package, serial=None):
+            return f"SurfaceView[{package}/{package}.MainActivity](BLAST)#0"
+        def get_vsync_triplets(self, layer_name):
+            # Mock triplets data：(desired present, actual present, frame ready) ns
+            import random
+            if not layer_name:
+                return []
+            triplets = []
+            base_time = time.time_ns()
+            for i in range(10):
+                triplets.append((base_time + i * 16_666_666, base_time + i * 16_666_666 + random.randint(0, 50_000_000),
+                                 base_time + i * 16_666_666 + random.randint(0, 50_000_000)))
+            return triplets
+        def calculate_jank_by_vsync_triplets(self, triplets, refresh_period_ns):
+            return (int(time.time()) % 5, int(time.time()) % 2)
+        def get_device_name(self, serial=None): return "Mock Device"
+        def get_device_ip(self, serial=None): return "192.168.1.100"
+        def enable_wifi_debug(self): return "192.168.1.100"
+        def install_and_start_service(self, progress=None, force=False, serial=None): print("Mock: Installing service.")
+        def run_adb_command(self, cmd, serial=None):
+            print(f"Mock ADB: {cmd}")
+            return ""
+        def uninstall_service(self, serial=None): print("Mock: Uninstalling service.")
+        def list_devices(self): return []
+    per = MockPer()
+
+
+DATA_COLLECTION_INTERVAL = 500  # 数据采集间隔改为 500ms
+DATA_LOG_INTERVAL = 1.0  # 数据记录到 log 的间隔 1 秒
+# 每秒 / 10 秒 / 60 秒的分层汇总：最细一层写进 log，SUMMARY_WINDOW 那一层为摘要（GUI 上方的标签、headless 的进度输出）
+ROLLUP_WINDOWS = (DATA_LOG_INTERVAL, 10.0, 60.0)
+ROLLUP_METRICS = ["FPS", "Temp", "Mem", "GPU", "Power", "Voltage", "Current", "Jank", "BigJank", "FrameGap"]
+SUMMARY_WINDOW = 10.0
+STREAM_SAMPLING = False  # True: 在设备端循环采样（adb exec-out 串流），不再每次轮询
+FOREGROUND_WATCH = False  # True: 以 logcat 事件侦测前景应用切换，平时直接用缓存
+FRAME_BACKEND = "auto"  # 帧资料来源: "surfaceflinger" / "gfxinfo" / "auto"（没有 SurfaceView 时改用 gfxinfo）
+# 录制 / 回放：PER_RECORD=<档案或目录> 把每次监控的原始输出录进 session 档；
+# PER_REPLAY=<档案> 改为回放该档，PER_REPLAY_SPEED 为回放速度（1 为即时，fast 为尽快）
+RECORD_SESSION = os.environ.get("PER_RECORD")
+REPLAY_SESSION = os.environ.get("PER_REPLAY")
+REPLAY_SPEED = None if os.environ.get("PER_REPLAY_SPEED") == "fast" else float(os.environ.get("PER_REPLAY_SPEED", "1"))
+
+# 各 collector 的采集周期（秒），设为 None 可关闭不需要的 collector。
+# snapshot（CPU/GPU/温度/内存）的周期由 DATA_COLLECTION_INTERVAL 决定
+COLLECTOR_PERIODS = {
+    'snapshot': DATA_COLLECTION_INTERVAL / 1000.0,
+    'foreground': 2.0,
+    # 须短于帧来源的缓冲（SurfaceFlinger 约 127 帧，120Hz 时约 1.06 秒），否则每次 poll 之间都会漏帧（gap）
+    'frames': 0.5,
+    'power': 1.0,
+    'refresh_rate': 10.0,
+    'device': 5.0,
+}
+# 每个 collector 的结果会更新哪些图表
+SOURCE_METRICS = {
+    'snapshot': ('Temp', 'Mem', 'GPU', 'CPU'),
+    'frames': ('FPS',),
+    'power': ('Power',),
+}
+
+def session_time():
+    # 采集时间的时间来源，回放时为录制当时的时间
+    return per.now() if hasattr(per, 'now') else time.time()
+
+
+class DataPipeline:
+    """
+    run() 会阻塞到 stop()（或回放结束）为止；每个 collector 结果与缓存合并后呼叫 on_data(info)。
+    on_data 会从不同的采集线程呼叫，需要时请自行交回单一线程处理（Qt 的 signal、queue.Queue）。
+    serial 指定设备（None 为 adb 预设的设备）；power_port 为功耗服务 adb forward 的本机 port（多台设备时各不相同）。
+    """
+
+    def __init__(self, interval_ms=500, streaming=STREAM_SAMPLING, periods=None, on_data=None,
+                 serial=None, power_port=None):
+        self.on_data = on_data
+        self.serial = serial
+        self.done = threading.Event()
+        self.interval = interval_ms / 1000.0
+        self.streaming = streaming and hasattr(per, 'SamplerStream')
+        self.sampler = None
+        self.samples = None
+        self.last_triplets = []  # 缓存上次的 triplets
+        self.error_count = 0
+        # 批次快照（mock 模式下没有，退回逐项读取）
+        # 每个 collector 物件各自保存差值 / 缓存状态，只对 serial 这台设备下指令
+        self.snapshot_collector = per.SnapshotCollector(serial) if hasattr(per, 'SnapshotCollector') else None
+        self.snapshot_sections = None
+        self.frame_collector = per.FrameStatsCollector(FRAME_BACKEND, serial) if hasattr(per, 'FrameStatsCollector') else None
+        self.foreground = per.ForegroundAppDetector(serial=serial) if hasattr(per, 'ForegroundAppDetector') else None
+        # 变化很慢的设备资料（型号、IP、刷新率…），session 开始时探测一次
+        self.profile = per.DeviceProfile(serial=serial) if hasattr(per, 'DeviceProfile') else None
+        self.last_refresh_period_ns = 0
+        # 功耗服务：keep-alive + adb forward，不阻塞采集线程
+        self.power_client = None
+        if hasattr(per, 'PowerClient'):
+            self.power_client = per.PowerClient(
+                ip_provider=(lambda: self.profile.get('ip')) if self.profile else None,
+                serial=serial, forward_port=power_port)
+        self.last_power_at = 0.0
+        if self.foreground:
+            self.foreground.add_listener(self.on_foreground_changed)
+        # 整个 session 的帧时间分布（固定记忆体）
+        self.frame_histogram = per.FrameTimeHistogram() if hasattr(per, 'FrameTimeHistogram') else None
+
+        # 各 collector 的周期；None 表示关闭。快照周期即采集间隔，串流模式下由设备端控制节奏
+        self.periods = dict(COLLECTOR_PERIODS, **(periods or {}))
+        if self.periods.get('snapshot') is not None:
+            self.periods['snapshot'] = 0 if self.streaming else self.interval
+        self.replay = getattr(per, 'REPLAY', None)
+        virtual_time = None
+        if self.replay is not None and self.replay.realtime:
+            # 定速回放：周期按速度缩短
+            self.periods = {name: None if period is None else period / self.replay.speed
+                            for name, period in self.periods.items()}
+        elif self.replay is not None:
+            # 尽快回放：排程走回放的虚拟时钟，不真的等待
+            virtual_time = self.replay
+        self.scheduler = CollectorScheduler(self.publish, clock=session_time, virtual_time=virtual_time,
+                                            device=serial)
+        self.lock = threading.Lock()
+        
+        # 缓存上次的数据，避免某些数据获取失败时显示空白
+        self.last_data = {
+            'device': '',
+            'ip': '',
+            'refresh_rate': 60.0
+        }
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self.done.set()
+
+    def _run(self):
+        collectors = {
+            'snapshot': self.collect_snapshot,
+            'foreground': self.collect_foreground,
+            'frames': self.collect_frames,
+            'power': self.collect_power,
+            'refresh_rate': self.collect_refresh_rate,
+            'device': self.collect_device,
+        }
+        for name, func in collectors.items():
+            period = self.periods.get(name)
+            if period is not None:
+                self.scheduler.add(name, func, period)
+        if self.foreground and FOREGROUND_WATCH:
+            self.foreground.start_watch()
+        if self.profile:
+            try:
+                self.profile.probe()
+            except Exception as e:
+                TELEMETRY.count("error.profile_probe", device=self.serial)
+                print(f"[DataPipeline] profile probe error: {e}")
+            if self.snapshot_collector:
+                # 依探测到的 GPU 节点调整快照指令（轮询与串流共用）
+                self.snapshot_sections = per.snapshot_sections(self.profile.values)
+                self.snapshot_collector.set_sections(self.snapshot_sections)
+        if self.replay is not None:
+            threading.Thread(target=self.watch_replay, daemon=True).start()
+        self.scheduler.run()
+
+        if self.foreground:
+            self.foreground.stop_watch()
+        if self.power_client:
+            self.power_client.close()
+
+        if self.sampler:
+            self.sampler.stop()
+        if hasattr(per, 'close_shell_sessions'):
+            # 采集都已结束：关掉这台设备的长驻 adb shell（拔掉的设备不会一直留着行程）
+            per.close_shell_sessions(self.serial)
+
+    def publish(self, source, result, captured_at):
+        """collector 结果一到就与缓存合并后发出，附上来源与采集时间。"""
+        with self.lock:
+            # Jank 是增量，不进缓存
+            jank_count = result.pop('jank', 0)
+            big_jank_count = result.pop('big_jank', 0)
+            frame_gap = result.pop('frame_gap', False)
+            captured_at = result.pop('captured_at', captured_at)
+            # 批次功耗样本同样只属于这一次结果
+            power_samples = result.pop('power_samples', [])
+            self.last_data.update(result)
+
+            # 使用缓存的数据
+            info = {
+                'usages': self.last_data.get('usages', []),
+                'freqs': self.last_data.get('freqs', []),
+                'fps': self.last_data.get('fps', 0.0),
+                'gpu': self.last_data.get('gpu', 0.0),
+                'temp': self.last_data.get('temp', 0.0),
+                'mem': self.last_data.get('mem', 0.0),
+                'power_info': self.last_data.get('power_info', {}),
+                'refresh_rate': self.last_data.get('refresh_rate', 60.0),
+                'device': self.last_data.get('device', ''),
+                'ip': self.last_data.get('ip', None),
+                'frame_stats': self.last_data.get('frame_stats', {}),
+                'frame_coverage': self.last_data.get('frame_coverage', {}),
+                'power_samples': power_samples,
+                'jank': jank_count,
+                'big_jank': big_jank_count,
+                'frame_gap': frame_gap,
+                'source': source,
+                'captured_at': captured_at,
+            }
+        if self.on_data is not None:
+            self.on_data(info)
+
+    # === 快速数据 ===
+    def collect_snapshot(self):
+        # CPU 使用率/频率、GPU、温度、内存 - 一次 shell 调用读完
+        if self.snapshot_collector:
+            snapshot = self.next_snapshot()
+            return {
+                'usages': snapshot.usages, 'freqs': snapshot.freqs,
+                'gpu': snapshot.gpu, 'temp': snapshot.temp, 'mem': snapshot.mem,
+                'captured_at': snapshot.timestamp,
+            }
+        usages, freqs = per.get_cpu_usage_and_freq(serial=self.serial)
+        return {
+            'usages': usages, 'freqs': freqs,
+            'gpu': per.GPU_Usage(), 'temp': per.get_battery_temp(), 'mem': per.get_mem_usage(),
+        }
+
+    # === 慢速数据：各自的周期 ===
+    def collect_foreground(self):
+        if self.foreground:
+            return {'foreground_app': self.foreground.get()}
+        return {'foreground_app': per.get_foreground_app()}
+
+    def on_foreground_changed(self, old, new):
+        # 应用真的切换了才让 layer / 帧来源缓存失效
+        if self.frame_collector:
+            self.frame_collector.invalidate()
+        with self.lock:
+            self.last_data['foreground_app'] = new
+
+    def collect_frames(self):
+        foreground_app = self.last_data.get('foreground_app', '')
+        if not foreground_app:
+            return None
+        if self.frame_collector:
+            # FPS 与 Jank 共用同一次 --latency dump
+            stats = self.frame_collector.poll(foreground_app, int(1_000_000_000 / self.last_data.get('refresh_rate', 60.0)))
+            if stats is None:
+                return None
+            result = {'jank': stats.jank, 'big_jank': stats.big_jank, 'frame_gap': stats.gap,
+                      'frame_coverage': {'gaps': stats.gaps, 'lost_ms': stats.lost_ms, 'lost_pct': stats.lost_pct}}
+            if self.profile and self.last_refresh_period_ns and stats.refresh_period_ns != self.last_refresh_period_ns:
+                # 刷新周期变了（例如切换 60/120Hz），让缓存的刷新率失效
+                self.profile.invalidate('refresh_rate')
+            self.last_refresh_period_ns = stats.refresh_period_ns
+            if self.frame_histogram is not None and stats.frame_times_ns is not None:
+                self.frame_histogram.record(stats.frame_times_ns, stats.refresh_period_ns)
+                result['frame_stats'] = self.frame_histogram.summary()
+            if stats.fps >= 0:
+                result['fps'] = stats.fps
+            return result
+
+        result = {}
+        # FPS - 较慢
+        fps = per.get_fps(foreground_app)
+        if fps >= 0:  # 只有有效值才更新
+            result['fps'] = fps
+
+        # === Jank 计算 ===
+        try:
+            layer_name = per.get_surfaceflinger_target_layer(foreground_app)
+            
+            if layer_name and hasattr(per, 'get_vsync_triplets'):
+                current_triplets = per.get_vsync_triplets(layer_name)
+                
+                if current_triplets and len(current_triplets) > 0:
+                    new_triplets = current_triplets
+                    if self.last_triplets and len(self.last_triplets) > 0:
+                        last_timestamp = self.last_triplets[-1][2]
+                        new_triplets = [t for t in current_triplets if t[2] > last_timestamp]
+                    
+                    if new_triplets and len(new_triplets) >= 4:
+                        refresh_period_ns = int(1_000_000_000 / self.last_data.get('refresh_rate', 60.0))
+                        result['jank'], result['big_jank'] = per.calculate_jank_by_vsync_triplets(
+                            new_triplets, refresh_period_ns
+                        )
+                    
+                    self.last_triplets = current_triplets[-50:]
+        except Exception as e:
+            TELEMETRY.count("error.jank", device=self.serial)
+            if self.error_count % 20 == 0:
+                print(f"[DataPipeline] Jank error: {e}")
+            self.error_count += 1
+        return result
+
+    def collect_power(self):
+        if self.power_client:
+            # 回传上一次背景请求的结果，只有拿到新资料时才发布
+            power_info, fetched_at = self.power_client.poll()
+            if not power_info or fetched_at == self.last_power_at:
+                return None
+            self.last_power_at = fetched_at
+            result = {'power_info': power_info, 'captured_at': fetched_at}
+            # 批次模式下一次带回上次之后的所有高频样本
+            samples = self.power_client.drain()
+            if samples:
+                result['power_samples'] = samples
+            return result
+        ip = self.profile.get('ip') if self.profile else per.get_device_ip()
+        power_info = per.get_power_data(ip)
+        if not power_info and self.profile:
+            # 连不上时可能是 IP 换了，下次重新查询
+            self.profile.invalidate('ip')
+        return {'power_info': power_info} if power_info else None
+
+    def collect_refresh_rate(self):
+        # 刷新率（很少变化）
+        refresh_rate = self.profile.get('refresh_rate') if self.profile else per.get_refresh_rate()
+        return {'refresh_rate': refresh_rate} if refresh_rate > 0 else None
+
+    def collect_device(self):
+        # 设备信息（基本不变）
+        if self.profile:
+            return {'device': self.profile.get('model'), 'ip': self.profile.get('ip')}
+        result = {}
+        if not self.last_data.get('device'):
+            result['device'] = per.get_device_name()
+        if not self.last_data.get('ip'):
+            result['ip'] = per.get_device_ip() if hasattr(per, 'get_device_ip') else None
+        return result or None
+
+    def next_snapshot(self):
+        if not self.streaming:
+            return self.snapshot_collector.collect()
+        if self.samples is None:
+            self.sampler = per.SamplerStream(interval=self.interval, serial=self.serial,
+                                             sections=self.snapshot_sections)
+            self.samples = iter(self.sampler)
+        try:
+            return next(self.samples)
+        except StopIteration:
+            # 串流中断（例如设备断线）：下一轮重新推送并启动脚本
+            self.sampler.stop()
+            self.sampler = None
+            self.samples = None
+            time.sleep(self.interval)
+            raise RuntimeError("sampler stream ended")
+
+    def watch_replay(self):
+        # 回放到档案结尾就结束采集
+        while not self.done.is_set():
+            if self.replay.finished(timeout=0.2):
+                self.scheduler.stop()
+                return
+
+    def stop(self):
+        self.scheduler.stop()
+        if self.replay is not None:
+            # 放开等待下一笔记录的 collector
+            self.replay.stop()
+        sampler = self.sampler
+        if sampler:
+            # 终止 adb exec-out，让阻塞中的 next() 立即返回
+            sampler.stop()
+
+
+# ========== Session：记录档、录制 / 回放 ==========
+def open_session_log(package, directory=None, interval_ms=DATA_COLLECTION_INTERVAL, streaming=STREAM_SAMPLING,
+                     serial=None):
+    metadata = {
+        'package': package,
+        'device': (per.get_device_name(serial) if serial else per.get_device_name()) or 'unknown',
+        'interval_ms': interval_ms,
+        'frame_backend': FRAME_BACKEND,
+        'streaming': streaming,
+        'replay': REPLAY_SESSION or '',
+    }
+    if serial or os.environ.get("ANDROID_SERIAL"):
+        metadata['serial'] = serial or os.environ["ANDROID_SERIAL"]
+    try:
+        session_log = SessionLog(metadata) if directory is None else SessionLog(metadata, directory=directory)
+    except OSError as e:
+        # 工作目录不可写（例如装在唯读位置）：改写到暂存目录
+        print(f"[SessionLog] 無法建立記錄目錄: {e}")
+        session_log = SessionLog(metadata, directory=tempfile.gettempdir())
+    print(f"記錄檔: {session_log.path}")
+    return session_log
+
+
+def open_session_archive(interval_ms=DATA_COLLECTION_INTERVAL, streaming=STREAM_SAMPLING):
+    """依设定开始录制或回放 session 档，回传是否为回放。"""
+    if not hasattr(per, 'REPLAY'):
+        return False
+    if REPLAY_SESSION:
+        per.REPLAY = ReplaySource(REPLAY_SESSION, speed=REPLAY_SPEED)
+        return True
+    if RECORD_SESSION:
+        path = default_archive_path(RECORD_SESSION) if os.path.isdir(RECORD_SESSION) else RECORD_SESSION
+        per.RECORDER = SessionRecorder(path, {'interval_ms': interval_ms,
+                                              'frame_backend': FRAME_BACKEND, 'streaming': streaming})
+        print(f"录制 session: {path}")
+    return False
+
+
+def close_session_archive():
+    if getattr(per, 'RECORDER', None) is not None:
+        per.RECORDER.close()
+        per.RECORDER = None
+    if getattr(per, 'REPLAY', None) is not None:
+        per.REPLAY.stop()
+        per.REPLAY = None
+
+
+def power_samples(info, default_time):
+    """这次结果的功耗样本 [(时间, mW, V, mA)]；没有批次时就是这一次的单点读数。"""
+    if 'Power' not in SOURCE_METRICS.get(info.get('source'), ()):
+        return []
+    samples = info.get('power_samples') or [dict(info.get('power_info', {}), timestamp=info.get('captured_at', default_time))]
+    return [(
+        sample['timestamp'],
+        abs(float(sample.get('power_mW', 0) or 0)),
+        float(sample.get('voltage_V', 0) or 0),
+        abs(float(sample.get('current_mA', 0) or 0)),
+    ) for sample in samples]
+
+
+class SessionSummary:
+    """
+    把 DataPipeline 的每个结果累进分层汇总（rollup.Rollup），最细一层的窗口结束时写一行到 session_log。
+    add() 只能从单一线程呼叫。wait_for_cpu 为 True 时，等到第一笔非 0 的 CPU 资料才开始累积（避免记到开头的 0 值）。
+    """
+
+    def __init__(self, session_log=None, start_time=None, windows=ROLLUP_WINDOWS, wait_for_cpu=True):
+        self.session_log = session_log
+        self.windows = tuple(windows)
+        self.logging = not wait_for_cpu
+        # 每次监控重新建立，核心数从 8 开始（换了设备也不会沿用上一台的栏数）
+        self.rollup = Rollup(ROLLUP_METRICS, self.windows, percentiles=True)
+        self.rollup.reset(start_time)
+        self.cpu_cores = 0
+        self.fit_cpu_cores(8)
+        self.log_cores = None  # 写进 log 的核心数，第一行写出时决定
+        self.frame_coverage = {}  # 最新的帧时间线累积 gap（FrameStats.gaps / lost_ms / lost_pct）
+
+    def add(self, info, current_time, power=()):
+        """累积一个结果（power 为 power_samples() 的结果），回传这次结束的各层窗口长度。"""
+        updated = SOURCE_METRICS.get(info.get('source'), ())
+        usages = info.get('usages') or [0]*8
+        freqs = info.get('freqs') or [0]*8
+        if not self.logging and sum(usages) > 0:
+            self.logging = True
+        if not self.logging:
+            return []
+
+        # 累积数据（固定大小的阵列，每个样本不再配置新的 list）
+        rollup = self.rollup
+        if 'FPS' in updated:
+            rollup.add('FPS', info.get('fps', 0.0) or 0.0)
+        if 'Temp' in updated:
+            rollup.add('Temp', info.get('temp', 0.0) or 0.0)
+        if 'Mem' in updated:
+            rollup.add('Mem', info.get('mem', 0.0) or 0.0)
+        if 'GPU' in updated:
+            rollup.add('GPU', info.get('gpu', 0.0) or 0.0)
+        for _, p, v, c in power:
+            rollup.add('Power', p); rollup.add('Voltage', v); rollup.add('Current', c)
+        jank, big_jank = info.get('jank', 0), info.get('big_jank', 0)
+        if jank or big_jank:
+            rollup.add('Jank', jank); rollup.add('BigJank', big_jank)
+        if info.get('frame_gap'):
+            rollup.add('FrameGap', 1)
+        if info.get('frame_coverage'):
+            self.frame_coverage = info['frame_coverage']
+
+        if 'CPU' in updated:
+            self.fit_cpu_cores(max(len(usages), len(freqs)))
+            rollup.add_many(self.cpu_usage_index, usages)
+            rollup.add_many(self.cpu_freq_index, freqs)
+
+        # 每秒写入一次数据（窗口以固定的 1 秒前进，落后太多时重新对齐）
+        closed = rollup.advance(current_time)
+        if self.windows[0] in closed and self.session_log is not None:
+            self.write_row(info)
+        return closed
+
+    def fit_cpu_cores(self, cores):
+        """核心数比目前多时，在汇总中加上新核心的 CPU / Core 栏。"""
+        if cores <= self.cpu_cores:
+            return
+        self.cpu_cores = cores
+        self.cpu_usage_index = self.rollup.indices([f"CPU{i}" for i in range(cores)])
+        self.cpu_freq_index = self.rollup.indices([f"Core{i}" for i in range(cores)])
+
+    def write_row(self, info):
+        rollup = self.rollup
+        if self.log_cores is None:
+            # 至少 8 栏，与旧版的 CSV 相同；核心较多的设备多出的栏接在后面
+            self.log_cores = max(8, self.cpu_cores)
+            self.session_log.columns = log_columns(self.log_cores)
+        power_info = info.get('power_info', {})
+        latest = {
+            'FPS': info.get('fps', 0.0) or 0.0, 'Temp': info.get('temp', 0.0) or 0.0,
+            'Mem': info.get('mem', 0.0) or 0.0, 'GPU': info.get('gpu', 0.0) or 0.0,
+            'Power': abs(float(power_info.get('power_mW', 0) or 0)),
+            'Voltage': float(power_info.get('voltage_V', 0) or 0),
+            'Current': abs(float(power_info.get('current_mA', 0) or 0)),
+        }
+        frame_stats = info.get('frame_stats') or {}
+        # 时间栏为这一秒窗口的结束时间（与采集时间同一个时钟，回放时为录制当时的时间），不是写入当下的时间；
+        # 这一秒内没有新样本的指标（周期较长的 collector）沿用最新值
+        self.session_log.append(
+            [time.strftime("%H:%M:%S", time.localtime(rollup.started_at))] +
+            [rollup.mean(name, default=latest[name])
+             for name in ("FPS", "Temp", "Mem", "GPU", "Power", "Voltage", "Current")] +
+            [int(rollup.sum('Jank')), int(rollup.sum('BigJank'))] +
+            [rollup.mean(f"CPU{i}") for i in range(self.log_cores)] +
+            [rollup.mean(f"Core{i}") for i in range(self.log_cores)] + [
+                # 到目前为止的帧时间分位数（累积值）
+                frame_stats.get('p50', 0.0), frame_stats.get('p90', 0.0),
+                frame_stats.get('p99', 0.0), frame_stats.get('p999', 0.0),
+                frame_stats.get('stutter', 0.0),
+                # 这一秒内的 gap 次数（两次 poll 之间漏掉的帧没有判定 Jank）与累积的遗失比例
+                int(rollup.sum('FrameGap')), self.frame_coverage.get('lost_pct', 0.0)
+            ])
+
+    def describe(self, window=SUMMARY_WINDOW):
+        """该层最近一个窗口的摘要文字。"""
+        rollup = self.rollup
+        return (f"近 {window:.0f} 秒: FPS 平均/最低 {rollup.mean('FPS', window):.1f}/{rollup.min('FPS', window):.1f}"
+                f" | 溫度最高 {rollup.max('Temp', window):.1f}°C"
+                f" | 功耗 平均/P95 {rollup.mean('Power', window):.0f}/{rollup.percentile('Power', 95, window):.0f}mW"
+                f" | Jank {int(rollup.sum('Jank', window))}" +
+                (f" | 幀缺口 {int(rollup.sum('FrameGap', window))}" if rollup.sum('FrameGap', window) else ""))
+
+    def describe_coverage(self):
+        """整个 session 的帧时间线缺口；没有 gap 时为 None。"""
+        coverage = self.frame_coverage
+        if not coverage.get('gaps'):
+            return None
+        return (f"幀時間線缺口 {coverage['gaps']} 次，遺失 {coverage['lost_ms']:.0f}ms（{coverage['lost_pct']:.1f}%），"
+                f"這段時間的 Jank 未計入")
+
+
+# ========== 多设备：每台设备一条独立的管线 ==========
+def device_directory(directory, serial):
+    """每台设备的 session log 放在 directory/<serial>/ 下（Wi-Fi 设备的 ip:port 换成合法的目录名）。"""
+    return os.path.join(SESSION_DIR if directory is None else directory, re.sub(r"[^\w.-]", "_", serial))
+
+
+class DeviceSession:
+    """
+    一台设备的采集：安装 / 启动功耗服务、自己的 DataPipeline（collector、CPU 差值、shell 会话池、功耗 port 都各自独立）、
+    SessionSummary 与 session log。run() 在 DevicePool 为它开的线程中执行，直到 stop() 为止。
+    """
+
+    def __init__(self, serial, power_port=None, directory=None, interval_ms=DATA_COLLECTION_INTERVAL,
+                 streaming=STREAM_SAMPLING, periods=None, package=None, install=True, on_summary=None):
+        self.serial = serial
+        self.power_port = power_port
+        self.directory = device_directory(directory, serial)
+        self.interval_ms = interval_ms
+        self.streaming = streaming
+        self.periods = periods
+        self.package = package
+        self.install = install
+        self.on_summary = on_summary
+        self.pipeline = None
+        self.session_log = None
+        self.summary = None
+        self.samples = 0
+        self.error = None
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.error = str(e)
+            print(f"[{self.serial}] 採集失敗: {e}")
+        finally:
+            if self.session_log is not None:
+                self.session_log.close()
+
+    def _run(self):
+        if self.install:
+            try:
+                per.install_and_start_service(progress=lambda text: print(f"[{self.serial}] {text}"),
+                                              serial=self.serial)
+            except Exception as e:
+                # 与单台设备相同：装不上时功耗栏位为 0，其余照常采集
+                print(f"[{self.serial}] 功耗服務安裝失敗: {e}")
+        package = self.package or per.get_foreground_app(self.serial)
+        if not package:
+            self.error = "無法取得前景應用程式"
+            print(f"[{self.serial}] {self.error}")
+            return
+        with self._lock:
+            if self.stopped:
+                return
+            self.pipeline = DataPipeline(self.interval_ms, streaming=self.streaming, periods=self.periods,
+                                         on_data=self.on_data, serial=self.serial, power_port=self.power_port)
+            self.session_log = open_session_log(package, self.directory, self.interval_ms, self.streaming,
+                                                serial=self.serial)
+            self.summary = SessionSummary(self.session_log, session_time(),
+                                          wait_for_cpu=self.pipeline.periods.get('snapshot') is not None)
+        print(f"[{self.serial}] 開始採集 {package}")
+        self.pipeline.run()
+
+    def on_data(self, info):
+        # 从各采集线程呼叫；同一台设备的结果以 lock 依序累进 SessionSummary
+        if 'error' in info:
+            print(f"[{self.serial}] data error: {info['error']}")
+            return
+        with self._lock:
+            self.samples += 1
+            current_time = time.time()
+            closed = self.summary.add(info, current_time, power_samples(info, current_time))
+            text = self.summary.describe() if SUMMARY_WINDOW in closed else None
+        if text is not None and self.on_summary is not None:
+            self.on_summary(self.serial, text)
+
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            pipeline = self.pipeline
+        if pipeline is not None:
+            pipeline.stop()
+
+
+class DevicePool:
+    """
+    同时监控多台设备（例如 device farm 上的 6～10 支手机）：每个 serial 一个 DeviceSession，各自一个线程，
+    各自一份 session log（directory/<serial>/session_<时间>/）。第 i 台设备的功耗服务 forward 到 POWER_FORWARD_PORT + i。
+    serials 为 None 时使用 `adb devices` 列出的全部设备。录制 / 回放只支援单台设备，这里不使用。
+    """
+
+    def __init__(self, serials=None, directory=None, interval_ms=DATA_COLLECTION_INTERVAL,
+                 streaming=STREAM_SAMPLING, periods=None, package=None, install=True, on_summary=None):
+        if serials is None:
+            serials = per.list_devices()
+        base_port = getattr(per, 'POWER_FORWARD_PORT', None)
+        self.sessions = {
+            serial: DeviceSession(serial, None if base_port is None else base_port + i, directory, interval_ms,
+                                  streaming, periods, package, install, on_summary)
+            for i, serial in enumerate(dict.fromkeys(serials))
+        }
+        self.threads = []
+
+    def start(self):
+        for serial, session in self.sessions.items():
+            thread = threading.Thread(target=session.run, name=f"device-{serial}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def stop(self, timeout=10):
+        for session in self.sessions.values():
+            session.stop()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
@@ -0,0 +1,124 @@
+import numpy as np
+
+# ========== 图表历史：预先配置的列式环形缓冲 ==========
+# 一个共用的时间栏加上多个数值栏，容量固定，append 为 O(1)。
+# 每笔资料同时写在 i 与 i + capacity 两个位置，所以最近 n 笔永远是一段连续的记忆体，
+# times() / column() 回传的是不复制的 view，可以直接交给 numpy 做 min/max。
+# 各栏的最大 / 最小值随写入更新；只有被挤掉的旧值刚好是极值时，下次查询才重新扫一次该栏。
+
+
+class RingBuffer:
+    """
+    columns 为数值栏的名称；时间栏固定为 float64，数值栏预设 float32（图表用足够）。
+    回传的 view 在下一次 append 之后可能被覆写，需要保留时请自行 copy。
+    """
+
+    def __init__(self, capacity, columns, dtype=np.float32):
+        self.capacity = capacity
+        self.columns = list(columns)
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._t = np.zeros(capacity * 2, dtype=np.float64)
+        self._v = np.zeros((len(self.columns), capacity * 2), dtype=dtype)
+        self._head = 0  # 下一笔写入的位置 (0..capacity-1)
+        self._size = 0
+        self.total = 0  # 累计写入的笔数，图表用来判断有没有新资料
+        self._max = np.full(len(self.columns), -np.inf)
+        self._min = np.full(len(self.columns), np.inf)
+        self._stale = np.zeros(len(self.columns), dtype=bool)  # 极值可能已被挤出缓冲，需要重算
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+        self.total = 0
+        self._max[:] = -np.inf
+        self._min[:] = np.inf
+        self._stale[:] = False
+
+    def append(self, t, values):
+        i = self._head
+        if self._size == self.capacity:
+            self._evict(self._v[:, i])
+        self._t[i] = self._t[i + self.capacity] = t
+        self._v[:, i] = self._v[:, i + self.capacity] = values
+        np.maximum(self._max, self._v[:, i], out=self._max)
+        np.minimum(self._min, self._v[:, i], out=self._min)
+        self._head = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self.total += 1
+
+    def extend(self, times, values):
+        """一次加入多笔；values 的形状为 (笔数, 栏数)。"""
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=self._v.dtype).reshape(len(times), len(self.columns))
+        added = len(times)
+        if not added:
+            return
+        if added > self.capacity:
+            times, values = times[-self.capacity:], values[-self.capacity:]
+        n = len(times)
+        evicted = self._size + n - self.capacity
+        if evicted > 0:
+            oldest = (self._head - self._size) % self.capacity
+            self._evict(self._v[:, (oldest + np.arange(evicted)) % self.capacity])
+        idx = (self._head + np.arange(n)) % self.capacity
+        self._t[idx] = self._t[idx + self.capacity] = times
+        self._v[:, idx] = self._v[:, idx + self.capacity] = values.T
+        np.maximum(self._max, values.max(axis=0), out=self._max)
+        np.minimum(self._min, values.min(axis=0), out=self._min)
+        self._head = (self._head + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        self.total += added
+
+    def _evict(self, old):
+        # 被挤掉的值若等于目前的极值，该栏的极值就不再可靠
+        old = old.reshape(len(self.columns), -1)
+        self._stale |= (old >= self._max[:, None]).any(axis=1) | (old <= self._min[:, None]).any(axis=1)
+
+    def _span(self):
+        # 最近 size 笔在镜像区中的起讫位置
+        end = self._head + self.capacity
+        return end - self._size, end
+
+    def times(self):
+        start, end = self._span()
+        return self._t[start:end]
+
+    def column(self, name):
+        start, end = self._span()
+        return self._v[self._index.get(name, name), start:end]
+
+    def max(self, name):
+        return self._extrema(self._index.get(name, name))[0]
+
+    def min(self, name):
+        return self._extrema(self._index.get(name, name))[1]
+
+    def _extrema(self, col):
+        if not self._size:
+            return None, None
+        if self._stale[col]:
+            values = self.column(col)
+            self._max[col] = values.max()
+            self._min[col] = values.min()
+            self._stale[col] = False
+        return float(self._max[col]), float(self._min[col])
+
+    def since(self, total):
+        """累计第 total 笔之后新增、且仍在缓冲中的资料：(times, 取栏位的函式)。"""
+        n = min(self.total - total, self._size)
+        start, end = self._span()
+        return self._t[end - n:end], lambda name: self._v[self._index.get(name, name), end - n:end]
+
+    @property
+    def last_time(self):
+        return float(self._t[self._head + self.capacity - 1]) if self._size else None
+
+    def last(self, name):
+        return float(self._v[self._index.get(name, name), self._head + self.capacity - 1]) if self._size else None
+
+    @property
+    def nbytes(self):
+        return self._t.nbytes + self._v.nbytes
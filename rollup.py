@@ -0,0 +1,216 @@
+import math
+
+import numpy as np
+
+# ========== 串流分层汇总 ==========
+# 每个指标在每一层窗口（预设 1 秒、10 秒、60 秒）各有一组 count / sum / min / max / last，全部放在预先配置的阵列里。
+# add() 只更新最细的一层；一个窗口结束时整层累进上一层，所以每个样本的成本固定，
+# 不会随窗口长度或样本数增加而配置新的记忆体。指标数（例如 CPU 核心数）可以在执行中增加。
+# 选用的近似分位数（P95 等）以固定的对数 bucket 计数，与 telemetry.LatencyHistogram 相同的分桶方式。
+
+WINDOWS = (1.0, 10.0, 60.0)
+
+MIN_VALUE = 0.01
+MAX_VALUE = 1e6
+GROWTH = 1.1
+_LOG_GROWTH = math.log(GROWTH)
+BUCKETS = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / _LOG_GROWTH)) + 2
+
+
+def _bucket(value):
+    # index 0 为下溢（含 0 与负值），最后一个为上溢
+    if not value >= MIN_VALUE:
+        return 0
+    return min(int(math.log(value / MIN_VALUE) / _LOG_GROWTH) + 1, BUCKETS - 1)
+
+
+def _buckets(values):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = np.log(np.maximum(values, MIN_VALUE) / MIN_VALUE) / _LOG_GROWTH + 1
+    index = np.where(values >= MIN_VALUE, index, 0)
+    return np.minimum(index, BUCKETS - 1).astype(np.intp)
+
+
+class _Window:
+    """一个窗口的累计值，每个指标一栏；hist 的形状为 (指标数, BUCKETS)。"""
+
+    def __init__(self, n, histogram):
+        self.count = np.zeros(n, dtype=np.int64)
+        self.sum = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.last = np.full(n, np.nan)  # 跨窗口沿用：窗口内没有样本时仍是最新值
+        self.hist = np.zeros((n, BUCKETS), dtype=np.int32) if histogram else None
+
+    def reset(self, last=None):
+        self.count[:] = 0
+        self.sum[:] = 0
+        self.min[:] = np.inf
+        self.max[:] = -np.inf
+        self.last[:] = np.nan if last is None else last
+        if self.hist is not None:
+            self.hist[:] = 0
+
+    def merge(self, other):
+        """把下一层刚结束的窗口累进来。"""
+        self.count += other.count
+        self.sum += other.sum
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self.last[:] = other.last
+        if self.hist is not None:
+            self.hist += other.hist
+
+    def resized(self, n):
+        window = _Window(n, self.hist is not None)
+        old = len(self.count)
+        for name in ("count", "sum", "min", "max", "last", "hist"):
+            if getattr(self, name) is not None:
+                getattr(window, name)[:old] = getattr(self, name)
+        return window
+
+
+class Rollup:
+    """
+    metrics 为指标名称；windows 为各层窗口长度（秒），较长的一层须为较短一层的整数倍。
+    add() / add_many() 记录样本，advance(now) 在最细一层的窗口到期时把结果交给各层，
+    之后 mean() / min() / max() / percentile() 等读取该层最近一个已结束的窗口。
+    """
+
+    def __init__(self, metrics=(), windows=WINDOWS, percentiles=False):
+        self.windows = tuple(windows)
+        self.ratios = [1] + [max(1, round(b / a)) for a, b in zip(self.windows, self.windows[1:])]
+        self.percentiles = percentiles
+        self.metrics = []
+        self._index = {}
+        self._current = [_Window(0, percentiles) for _ in self.windows]
+        self._closed = [_Window(0, percentiles) for _ in self.windows]
+        self._filled = [0] * len(self.windows)  # 每层已累进几个下层窗口
+        self.started_at = None  # 最细一层目前窗口的开始时间
+        self.indices(metrics)
+
+    def indices(self, names):
+        """各指标的 index（numpy 阵列，可交给 add_many）；没有的指标会新增一栏。"""
+        missing = [name for name in names if name not in self._index]
+        if missing:
+            for name in missing:
+                self._index[name] = len(self.metrics)
+                self.metrics.append(name)
+            n = len(self.metrics)
+            self._current = [w.resized(n) for w in self._current]
+            self._closed = [w.resized(n) for w in self._closed]
+        return np.array([self._index[name] for name in names], dtype=np.intp)
+
+    def reset(self, now=None):
+        for window in self._current + self._closed:
+            window.reset()
+        self._filled = [0] * len(self.windows)
+        self.started_at = now
+
+    # === 写入 ===
+    def add(self, name, value):
+        i = self._index[name]
+        w = self._current[0]
+        w.count[i] += 1
+        w.sum[i] += value
+        if value < w.min[i]:
+            w.min[i] = value
+        if value > w.max[i]:
+            w.max[i] = value
+        w.last[i] = value
+        if w.hist is not None:
+            w.hist[i, _bucket(value)] += 1
+
+    def add_many(self, indices, values):
+        """一次记录多个指标（例如每个核心一栏）；values 较短时只记录前面几栏。"""
+        values = np.asarray(values, dtype=np.float64)
+        indices = indices[:len(values)]
+        values = values[:len(indices)]
+        w = self._current[0]
+        w.count[indices] += 1
+        w.sum[indices] += values
+        w.min[indices] = np.minimum(w.min[indices], values)
+        w.max[indices] = np.maximum(w.max[indices], values)
+        w.last[indices] = values
+        if w.hist is not None:
+            w.hist[indices, _buckets(values)] += 1
+
+    def advance(self, now):
+        """
+        最细一层的窗口到期时结束它并逐层往上累进，回传这次结束的各层窗口长度（例如 [1.0] 或 [1.0, 10.0]）。
+        窗口以固定间隔前进；落后超过两个窗口（例如 UI 卡住）时改从 now 重新对齐。
+        """
+        if self.started_at is None:
+            self.started_at = now
+            return []
+        interval = self.windows[0]
+        if now - self.started_at < interval:
+            return []
+        self.started_at += interval
+        if now - self.started_at > 2 * interval:
+            self.started_at = now
+        closed = []
+        for k, window in enumerate(self.windows):
+            if k:
+                self._current[k].merge(self._closed[k - 1])
+                self._filled[k] += 1
+                if self._filled[k] < self.ratios[k]:
+                    break
+            self._close(k)
+            closed.append(window)
+        return closed
+
+    def _close(self, k):
+        # 两组阵列轮流使用：刚结束的窗口留着给读取，另一组清空后继续累计
+        current, closed = self._current[k], self._closed[k]
+        closed.reset(current.last)
+        self._current[k], self._closed[k] = closed, current
+        self._filled[k] = 0
+
+    # === 读取（最近一个已结束的窗口） ===
+    def _window(self, window):
+        return self._closed[0 if window is None else self.windows.index(window)]
+
+    def count(self, name, window=None):
+        return int(self._window(window).count[self._index[name]])
+
+    def sum(self, name, window=None):
+        return float(self._window(window).sum[self._index[name]])
+
+    def mean(self, name, window=None, default=0.0):
+        """窗口内的平均值；窗口内没有样本时沿用最新值，从未有过样本时回传 default。"""
+        w = self._window(window)
+        i = self._index[name]
+        if w.count[i]:
+            return float(w.sum[i] / w.count[i])
+        return self.last(name, window, default)
+
+    def min(self, name, window=None, default=0.0):
+        w = self._window(window)
+        i = self._index[name]
+        return float(w.min[i]) if w.count[i] else default
+
+    def max(self, name, window=None, default=0.0):
+        w = self._window(window)
+        i = self._index[name]
+        return float(w.max[i]) if w.count[i] else default
+
+    def last(self, name, window=None, default=0.0):
+        value = self._window(window).last[self._index[name]]
+        return default if math.isnan(value) else float(value)
+
+    def percentile(self, name, q=95, window=None, default=0.0):
+        """近似分位数（需以 percentiles=True 建立），相对误差约 5%。"""
+        w = self._window(window)
+        i = self._index[name]
+        if w.hist is None or not w.count[i]:
+            return default
+        cumulative = np.cumsum(w.hist[i])
+        b = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        if b == 0:
+            return float(w.min[i])
+        if b >= BUCKETS - 1:
+            return float(w.max[i])
+        # bucket b 涵盖 [MIN * G^(b-1), MIN * G^b)，取几何中点，并限制在实际的最小 / 最大值之间
+        value = MIN_VALUE * GROWTH ** (b - 0.5)
+        return float(min(max(value, w.min[i]), w.max[i]))
@@ -0,0 +1,321 @@
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+# ========== Session 录制 / 回放 ==========
+# 录制：live 采集时把每次 adb 指令的原始输出、exec-out 串流的每一行与功耗服务的 HTTP 回应，
+# 连同时间写成一行一笔的 JSON（副档名 .gz 时以 gzip 压缩）。
+# 回放：把 per.REPLAY 设成 ReplaySource，per.py 的解析与 DataThread 的整条管线就会吃录好的资料，
+# 可以用新的 Jank / FPS 演算法重跑旧的 session，也是量测解析吞吐量时可重现的资料集。
+
+ARCHIVE_VERSION = 1
+FAST_STALL = 0.1  # 尽快回放：等待中的请求超过这么久没有人推进虚拟时钟，就自己推进（例如采集排程还没开始）
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8", newline="\n")
+
+
+def command_key(args):
+    # 与 adb shell 相同，多个参数以空格拼接；["shell", "ip route"] 与 ["shell", "ip", "route"] 视为同一个指令
+    return " ".join(str(a) for a in args)
+
+
+class SessionRecorder:
+    """
+    每笔记录：{"t": 时间, "kind": "adb" | "http" | "stream", "key": ..., ...}，第一行为 {"kind": "meta", ...}。
+    指令与 HTTP 的 t 为发出请求的时间，dt 为耗时；串流的 t 为读到该行的时间。可被多个采集线程同时呼叫。
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stream_ids = defaultdict(int)
+        self._file = _open(path, "w")
+        self._write(dict(metadata or {}, kind="meta", version=ARCHIVE_VERSION, t=time.time()))
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record_adb(self, cmd, output, started):
+        self._write({"t": started, "dt": time.time() - started, "kind": "adb", "key": command_key(cmd), "out": output})
+
+    def record_http(self, path, params, started, status=None, data=None, error=None):
+        record = {"t": started, "dt": time.time() - started, "kind": "http", "key": path, "params": params,
+                  "status": status, "data": data}
+        if error:
+            record["error"] = error
+        self._write(record)
+
+    def tap_stream(self, args, stdout):
+        """包住串流的 stdout，读到的每一行都写进档案；同一个指令每开一次串流编号加一。"""
+        key = command_key(args)
+        with self._lock:
+            stream_id = self._stream_ids[key]
+            self._stream_ids[key] += 1
+        return _TappedStream(self, key, stream_id, stdout)
+
+    def close(self):
+        with self._lock:
+            f, self._file = self._file, None
+        if f is not None:
+            f.close()
+
+
+class _TappedStream:
+    def __init__(self, recorder, key, stream_id, stdout):
+        self.recorder = recorder
+        self.key = key
+        self.stream_id = stream_id
+        self.stdout = stdout
+
+    def readline(self):
+        raw = self.stdout.readline()
+        if raw:
+            self.recorder._write({"t": time.time(), "kind": "stream", "key": self.key, "id": self.stream_id,
+                                  "line": raw.decode("utf-8", errors="ignore")})
+        return raw
+
+    def close(self):
+        self.stdout.close()
+
+
+def load_archive(path):
+    """回传 (meta, records)，records 依时间排序。"""
+    meta = {}
+    records = []
+    with _open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 录制中途崩溃时最后一行可能不完整
+                continue
+            if record.get("kind") == "meta":
+                meta = record
+            else:
+                records.append(record)
+    records.sort(key=lambda r: r["t"])
+    return meta, records
+
+
+class _Track:
+    """同一个 key 的所有记录，依时间排序，next 为下一笔还没送出的位置。"""
+
+    def __init__(self):
+        self.times = []
+        self.records = []
+        self.next = 0
+
+    @property
+    def exhausted(self):
+        return self.next >= len(self.records)
+
+
+class ReplaySource:
+    """
+    回放时钟从录制起点开始走，指令拿到的是时间最接近「此刻」的资料：已过时的记录会被跳过，
+    还没到时间就等到那时再回传，并重现录制时的耗时，和真的设备一样。
+    speed 为回放速度：1.0 为即时，2.0 为两倍速…；None 为尽快回放，此时时钟是虚拟的：
+    请求等的是虚拟时间，采集排程在所有进行中的采集都在等待时呼叫 advance() 直接跳到下一个事件，
+    所以各 collector 之间的先后顺序与录制时相同。
+    某个 key 的记录用完后，请求会阻塞到回放结束（尽快回放时则直接结束回放）。
+    录制里没有的指令（例如推送暂存档）回传空字串。
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.meta, records = load_archive(path)
+        self.tracks = defaultdict(_Track)
+        self.streams = defaultdict(list)  # key -> [[(t, line), ...] 第 0 次开启, 第 1 次开启, ...]
+        for record in records:
+            if record["kind"] == "stream":
+                runs = self.streams[record["key"]]
+                while len(runs) <= record.get("id", 0):
+                    runs.append([])
+                runs[record.get("id", 0)].append((record["t"], record["line"]))
+            else:
+                track = self.tracks[(record["kind"], record["key"])]
+                track.times.append(record["t"])
+                track.records.append(record)
+        self.stream_opened = defaultdict(int)
+        times = [r["t"] for r in records]
+        self.start_t = min(times) if times else self.meta.get("t", 0.0)
+        self.end_t = max(times) if times else self.start_t
+        self.started_at = time.time()
+        self.virtual_t = self.start_t
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._waiting = {}  # 线程 id -> 等待的虚拟时间
+        self._done = threading.Event()
+        self.on_wait = None  # 有请求开始等待虚拟时间时呼叫（让采集排程重新检查是否该推进时钟）
+
+    @property
+    def realtime(self):
+        return self.speed is not None
+
+    def clock(self):
+        if self.realtime:
+            return self.start_t + (time.time() - self.started_at) * self.speed
+        return self.virtual_t
+
+    def advance(self, t):
+        """尽快回放：把虚拟时钟推进到 t，但不会越过任何等待中的请求。"""
+        with self._cond:
+            self._advance_locked(t)
+
+    def _advance_locked(self, t):
+        if self._waiting:
+            t = min(t, min(self._waiting.values()))
+        if t != math.inf:
+            self.virtual_t = max(self.virtual_t, t)
+        # 时间已到的等待者立刻不算在等待中，排程才不会在它们醒来前重复推进
+        for thread_id in [k for k, w in self._waiting.items() if w <= self.virtual_t]:
+            del self._waiting[thread_id]
+        self._cond.notify_all()
+
+    def _exhausted(self):
+        # 某个 key 的记录用完了：尽快回放就此结束，定速回放则等时钟走到结尾
+        if not self.realtime:
+            self._done.set()
+            self._cond.notify_all()
+            if self.on_wait:
+                self.on_wait()
+
+    def is_waiting(self, thread_id):
+        with self._lock:
+            return thread_id in self._waiting
+
+    def _wait_until(self, t, cancel=None):
+        # 等回放时钟走到 t；stop() 或 cancel 会提早结束等待
+        if self.realtime:
+            while not self._done.is_set() and not (cancel and cancel.is_set()):
+                delay = (t - self.clock()) / self.speed
+                if delay <= 0:
+                    break
+                (cancel or self._done).wait(min(delay, 1.0))
+            return
+        me = threading.get_ident()
+        with self._cond:
+            while self.virtual_t < t and not self._done.is_set() and not (cancel and cancel.is_set()):
+                self._waiting[me] = t
+                if self.on_wait:
+                    self.on_wait()
+                before = self.virtual_t
+                if not self._cond.wait(FAST_STALL) and self.virtual_t == before and t != math.inf:
+                    # 没有人推进时钟（例如排程还没开始），自己推进到最早的等待者
+                    self._advance_locked(t)
+            self._waiting.pop(me, None)
+
+    def _next(self, kind, key, skip=True):
+        track = self.tracks.get((kind, key))
+        if track is None:
+            return None
+        with self._lock:
+            if track.exhausted:
+                record = None
+                self._exhausted()
+            else:
+                # 取时间最接近此刻的一笔（录制时的时间戳比排程时间晚一点，只取「之前」的会拿到上一轮的资料）
+                now = self.clock()
+                i = track.next
+                while skip and i + 1 < len(track.records) and abs(track.times[i + 1] - now) <= abs(track.times[i] - now):
+                    i += 1
+                track.next = i + 1
+                record = track.records[i]
+        if record is None:
+            self._done.wait()
+            return None
+        self._wait_until(record["t"] + record.get("dt", 0) if self.realtime else record["t"])
+        return record
+
+    def adb(self, cmd):
+        record = self._next("adb", command_key(cmd))
+        return record["out"] if record else ""
+
+    def http(self, path, params=None):
+        """回传 (status, data, error)。批次端点以 cursor 续读，跳过任何一笔都会掉样本，所以依序送出。"""
+        record = self._next("http", path, skip=False)
+        if record is None:
+            return None, None, "replay: no recorded response"
+        return record.get("status"), record.get("data"), record.get("error")
+
+    def stream(self, args):
+        key = command_key(args)
+        with self._lock:
+            runs = self.streams.get(key, [])
+            n = self.stream_opened[key]
+            self.stream_opened[key] += 1
+        return ReplayProcess(self, runs[n] if n < len(runs) else [])
+
+    def finished(self, timeout=0):
+        """是否已回放到结尾；timeout 秒内结束（或被 stop()）会立即返回 True。"""
+        if self._done.wait(timeout):
+            return True
+        if self.clock() > self.end_t:
+            self.stop()
+        return self._done.is_set()
+
+    def stop(self):
+        with self._cond:
+            self._done.set()
+            self._cond.notify_all()
+
+
+class ReplayProcess:
+    """模拟串流行程：stdout.readline() 依录制时间送出当次串流的每一行，结束时回传 b""。"""
+
+    def __init__(self, source, lines):
+        self.source = source
+        self.lines = lines
+        self.index = 0
+        self.killed = threading.Event()
+        self.stdout = self
+
+    def readline(self):
+        if self.killed.is_set():
+            return b""
+        if self.index >= len(self.lines):
+            # 录到的串流已读完（logcat 之类的串流本来就可能很久没有输出），阻塞到回放结束，
+            # 而不是让呼叫端以为断线而重开串流
+            self.source._wait_until(math.inf, cancel=self.killed)
+            return b""
+        t, line = self.lines[self.index]
+        self.index += 1
+        self.source._wait_until(t, cancel=self.killed)
+        if self.killed.is_set():
+            return b""
+        return line.encode("utf-8")
+
+    def poll(self):
+        if self.killed.is_set() or self.index >= len(self.lines):
+            return 0
+        return None
+
+    def kill(self):
+        self.killed.set()
+
+    def wait(self, timeout=None):
+        return 0
+
+    def close(self):
+        self.kill()
+
+
+def default_archive_path(directory="."):
+    return os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S.jsonl.gz"))
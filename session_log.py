@@ -0,0 +1,175 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+# ========== Session 记录档 ==========
+# 每秒一行的平均值一产生就交给背景线程写进磁碟，不再整份留在记忆体里，
+# 当机或强制关窗也只会丢掉最后几行。档案超过 ROTATE_BYTES 就换下一个分档，只保留最近 KEEP_PARTS 个；
+# 每个分档开头是 `# key: value` 的 session / 设备资料，接着是 CSV 表头。
+
+def log_columns(cores=8):
+    """CSV 表头；核心数超过 8 时多出的 CPU / Core 栏接在后面。"""
+    return ["Time", "FPS", "Temp", "Mem", "GPU(%)", "Power(mW)", "Voltage(V)",
+            "Current(mA)", "Jank", "Big Jank"] + \
+           [f"CPU{i}%" for i in range(cores)] + \
+           [f"Core{i}(MHz)" for i in range(cores)] + \
+           ["FrameTime P50(ms)", "FrameTime P90(ms)", "FrameTime P99(ms)",
+            "FrameTime P99.9(ms)", "Stutter(%)", "Frame Gaps", "Frames Lost(%)"]
+
+
+LOG_COLUMNS = log_columns()
+
+SESSION_DIR = os.environ.get("PER_SESSION_DIR", "sessions")
+ROTATE_BYTES = 8 * 2**20  # 单一分档的大小上限
+# 最多保留几个分档（约 KEEP_PARTS * ROTATE_BYTES 的磁碟空间），更旧的分档会被删除；0 为不限制
+KEEP_PARTS = int(os.environ.get("PER_SESSION_KEEP_PARTS", "32"))
+FSYNC_INTERVAL = 5.0  # 每隔几秒 fsync 一次；每一行都会立即 flush 给作业系统
+
+
+class SessionLog:
+    """
+    append(row) 只把资料放进佇列，不会阻塞 UI 线程；close() 会写完剩下的资料再返回。
+    档案放在 directory/session_<时间>/part0001.csv, part0002.csv …，超过 keep_parts 个时删除最旧的分档
+    （parts 只列出仍保留的分档，dropped_parts 为已删除的数量）。
+    columns 可在第一次 append() 之前修改（例如知道设备核心数之后）。
+    """
+
+    def __init__(self, metadata=None, directory=SESSION_DIR, rotate_bytes=ROTATE_BYTES,
+                 fsync_interval=FSYNC_INTERVAL, columns=LOG_COLUMNS, keep_parts=KEEP_PARTS):
+        self.metadata = dict(metadata or {})
+        self.columns = list(columns)
+        self.metadata.setdefault("started", time.strftime("%Y-%m-%d %H:%M:%S"))
+        self.rotate_bytes = rotate_bytes
+        self.keep_parts = keep_parts
+        self.fsync_interval = fsync_interval
+        self.path = os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S"))
+        os.makedirs(self.path, exist_ok=True)
+        self.parts = []
+        self.part_count = 0
+        self.dropped_parts = 0
+        self.rows = 0
+        self.error = None
+        self._file = None
+        self._writer = None
+        self._last_sync = time.monotonic()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="session-log", daemon=True)
+        self._thread.start()
+
+    def append(self, row):
+        self.rows += 1
+        self._queue.put(row)
+
+    def flush(self):
+        """等背景线程把目前佇列中的资料都写进磁碟。"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    # === 背景线程 ===
+    def _run(self):
+        try:
+            while True:
+                try:
+                    row = self._queue.get(timeout=self.fsync_interval)
+                except queue.Empty:
+                    self._sync()
+                    continue
+                try:
+                    if row is None:
+                        break
+                    self._write(row)
+                finally:
+                    self._queue.task_done()
+        finally:
+            self._close_part()
+
+    def _write(self, row):
+        if self.error is not None:
+            return
+        try:
+            if self._file is None or self._file.tell() >= self.rotate_bytes:
+                self._open_part()
+            self._writer.writerow(row)
+            self._file.flush()
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        except OSError as e:
+            # 磁碟满或权限问题：停止写入，已写入的部分仍然可以导出
+            self.error = e
+            print(f"[SessionLog] 寫入 {self.path} 失敗: {e}")
+
+    def _open_part(self):
+        self._close_part()
+        self.part_count += 1
+        path = os.path.join(self.path, f"part{self.part_count:04d}.csv")
+        self._file = open(path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file)
+        self.parts.append(path)
+        self._drop_old_parts()
+        meta = dict(self.metadata, part=self.part_count)
+        for key, value in meta.items():
+            self._file.write(f"# {key}: {value}\n")
+        self._writer.writerow(self.columns)
+
+    def _drop_old_parts(self):
+        # 长时间的 soak 测试不会无限制地占用磁碟：只留最近 keep_parts 个分档
+        while self.keep_parts and len(self.parts) > self.keep_parts:
+            old = self.parts.pop(0)
+            self.dropped_parts += 1
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _sync(self):
+        if self._file is not None:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+        self._last_sync = time.monotonic()
+
+    def _close_part(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    # === 导出 ===
+    def export_csv(self, path):
+        """
+        把保留的分档合并成一份只有表头与资料列的 CSV（与旧版导出格式相同）。
+        分档多时要花一些时间，GUI 在背景线程呼叫；记录仍在进行时导出到呼叫当下为止的资料。
+        """
+        self.flush()
+        with open(path, "w", newline="", encoding="utf-8-sig") as out:
+            csv.writer(out).writerow(self.columns)
+            for part in list(self.parts):
+                try:
+                    with open(part, "r", newline="", encoding="utf-8-sig") as f:
+                        copy_rows(f, out)
+                except FileNotFoundError:
+                    # 导出期间刚好被轮替删除
+                    continue
+
+
+def copy_rows(src, dst):
+    # 跳过 metadata 与表头，其余整行照抄（不重新解析 CSV）
+    header = None
+    for line in src:
+        if header is None:
+            if line.startswith("#"):
+                continue
+            header = line
+            continue
+        dst.write(line)
+
@@ -0,0 +1,253 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+# ========== 自我量测 ==========
+# 每次 adb 指令、功耗 HTTP 请求、解析函式、collector 与 UI 更新的耗时都记进各自的直方图，
+# 看得出漏掉的样本是慢在 adb、HTTP 还是 UI。adb / HTTP 另外按当时所在的 collector 分开记一份（"adb@frames"）。
+# 同时监控多台设备时，带设备的记录再按 serial 分开（"adb@frames#SERIAL"、"missed.frames#SERIAL"），总数仍记在不带后缀的名称。
+
+ENABLED = os.environ.get("PER_TELEMETRY", "1") != "0"
+
+
+class LatencyHistogram:
+    """
+    耗时 (ms) 的固定 bucket 对数直方图，记忆体固定。bucket 以 10% 递增，分位数的相对误差约 5%。
+    与 per.FrameTimeHistogram 相同的分桶方式，但每次只记一个值，不经过 numpy。
+    """
+
+    MIN_MS = 0.01
+    MAX_MS = 600_000.0
+    GROWTH = 1.1
+    _LOG_GROWTH = math.log(GROWTH)
+    SIZE = int(math.ceil(math.log(MAX_MS / MIN_MS) / _LOG_GROWTH)) + 2
+
+    def __init__(self):
+        # index 0 为下溢 (< MIN_MS)，最后一个为上溢 (>= MAX_MS)
+        self.counts = [0] * self.SIZE
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, ms, error=False):
+        if ms < self.MIN_MS:
+            i = 0
+        else:
+            i = min(int(math.log(ms / self.MIN_MS) / self._LOG_GROWTH) + 1, self.SIZE - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.last_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if error:
+            self.errors += 1
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= target and c:
+                break
+        if i == 0:
+            return self.MIN_MS
+        if i >= self.SIZE - 1:
+            return self.max_ms
+        # bucket i 涵盖 [MIN * G^(i-1), MIN * G^i)，取几何中点
+        return min(self.MIN_MS * self.GROWTH ** (i - 0.5), self.max_ms)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms,
+            'last_ms': self.last_ms,
+        }
+
+
+def _device_key(name, device):
+    return f"{name}#{device}" if device else name
+
+
+def _rss_bytes():
+    """目前的常驻记忆体 (RSS)；读不到时返回 None。"""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if os.name == "nt":
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                           [(name, ctypes.c_size_t) for name in (
+                               "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                               "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                               "PagefileUsage", "PeakPagefileUsage")]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+            return None
+        # macOS 等：只有峰值 (ru_maxrss，单位为 bytes)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except Exception:
+        return None
+
+
+class Telemetry:
+    """
+    name -> LatencyHistogram，外加计数器（例如 collector 漏掉的排程）与工具本身的记忆体用量。
+    可被多个采集线程与 UI 线程同时呼叫。
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started_at = time.time()
+            self.rss_start = _rss_bytes()
+            self.rss_peak = self.rss_start or 0
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.trace_start = tracemalloc.get_traced_memory()[0]
+
+    def record(self, name, seconds, error=False, scoped=False, device=None):
+        if not self.enabled:
+            return
+        ms = seconds * 1000
+        scope = getattr(self._local, "scope", None) if scoped else None
+        device = device or (getattr(self._local, "device", None) if scoped else None)
+        detail = _device_key(f"{name}@{scope}" if scope else name, device)
+        with self._lock:
+            self._histogram(name).record(ms, error)
+            if detail != name:
+                self._histogram(detail).record(ms, error)
+
+    def _histogram(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = LatencyHistogram()
+        return h
+
+    def count(self, name, n=1, device=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if device:
+                key = _device_key(name, device)
+                self.counters[key] = self.counters.get(key, 0) + n
+
+    @contextmanager
+    def timer(self, name, scoped=False, device=None):
+        """计时一段程式；中途抛出例外时记为错误。"""
+        start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.record(name, time.perf_counter() - start, error, scoped, device)
+
+    def timed(self, name):
+        """装饰器版的 timer()。"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def scope(self, name, device=None):
+        """这段期间同一线程的 scoped 计时（adb / HTTP）另外记到 "<name>@<scope>"；有 device 时为 "<name>@<scope>#<device>"。"""
+        previous = getattr(self._local, "scope", None), getattr(self._local, "device", None)
+        self._local.scope, self._local.device = name, device
+        try:
+            yield
+        finally:
+            self._local.scope, self._local.device = previous
+
+    # === 记忆体 ===
+    def start_memory_trace(self):
+        # tracemalloc 会让每次配置变慢，预设不开，由诊断面板按需开启
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.trace_start = tracemalloc.get_traced_memory()[0]
+
+    def stop_memory_trace(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def memory(self):
+        rss = _rss_bytes()
+        if rss:
+            self.rss_peak = max(self.rss_peak, rss)
+        result = {
+            'rss_mb': rss / 2**20 if rss else None,
+            'rss_growth_mb': (rss - self.rss_start) / 2**20 if rss and self.rss_start else None,
+            'rss_peak_mb': self.rss_peak / 2**20 if self.rss_peak else None,
+            'tracemalloc': tracemalloc.is_tracing(),
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            result.update({
+                'traced_mb': current / 2**20,
+                'traced_growth_mb': (current - getattr(self, 'trace_start', 0)) / 2**20,
+                'traced_peak_mb': peak / 2**20,
+            })
+        return result
+
+    def top_allocations(self, limit=10):
+        """tracemalloc 开启时，依配置量排序的前几个程式位置。"""
+        if not tracemalloc.is_tracing():
+            return []
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        return [{'where': str(s.traceback), 'size_kb': s.size / 1024, 'count': s.count} for s in stats]
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: h.summary() for name, h in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {
+            'uptime_s': time.time() - self.started_at,
+            'histograms': histograms,
+            'counters': counters,
+            'memory': self.memory(),
+        }
+
+    def export(self, path):
+        report = self.snapshot()
+        report['top_allocations'] = self.top_allocations()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+TELEMETRY = Telemetry()